@@ -35,6 +35,13 @@ class Config:
         "DEV_ENV",
         "GEMINI_API_KEY",
     ]
+    # Keys of providers that are only needed when a model of theirs is configured
+    _optional_env_keys = [
+        "OPENAI_API_KEY",
+        "ANTHROPIC_API_KEY",
+        "GROQ_API_KEY",
+        "PERPLEXITY_API_KEY",
+    ]
 
     def __init__(self):
         def recursive_update(default, override):
@@ -77,6 +84,8 @@ class Config:
                 raise ValueError(f"Environment variable {key} not found")
             else:
                 setattr(self, key, os.environ.get(key))
+        for key in self._optional_env_keys:
+            setattr(self, key, os.environ.get(key))
 
         # Figure out runtime environment
         self.is_local = os.getenv("GITHUB_ACTIONS") != "true"
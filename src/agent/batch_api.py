@@ -0,0 +1,187 @@
+import asyncio
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import dspy
+import httpx
+import litellm
+from loguru import logger as log
+
+from global_config import global_config
+
+# litellm providers with a batch API (files + batches endpoints)
+BATCH_PROVIDERS = ("openai", "azure", "vertex_ai", "bedrock", "hosted_vllm", "litellm_proxy")
+_FINISHED = ("completed", "failed", "expired", "cancelled")
+
+
+def max_output_tokens(model_name: str, max_tokens: int) -> int:
+    """`max_tokens` capped at the model's output limit, if litellm's model map has one."""
+    try:
+        limit = litellm.get_model_info(model_name).get("max_output_tokens")
+    except Exception:
+        # Models missing from litellm's model map are sent `max_tokens` as it is
+        limit = None
+    return min(max_tokens, limit) if limit else max_tokens
+
+
+@dataclass
+class BatchRequest:
+    """One agent call to run as a line of a batch job; `custom_id` joins its result back."""
+    custom_id: str
+    signature: type[dspy.Signature]
+    inputs: dict[str, Any]
+
+
+class BatchUsage:
+    """Tokens of the batch jobs' answered requests, priced at interactive and at batch rates."""
+
+    def __init__(self, model_name: str, discount: float):
+        self.model_name = model_name
+        self.discount = discount
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.interactive_cost = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, usage: dict) -> None:
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+        try:
+            prompt_cost, completion_cost = litellm.cost_per_token(
+                model=self.model_name, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens
+            )
+        except Exception:
+            # Models missing from litellm's price map are counted, not priced
+            prompt_cost = completion_cost = 0.0
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.interactive_cost += prompt_cost + completion_cost
+
+    @property
+    def batch_cost(self) -> float:
+        return self.interactive_cost * self.discount
+
+
+class BatchJobs:
+    """
+    Runs agent calls through the provider's batch API instead of one request each.
+
+    Requests are formatted with the same dspy adapter as interactive calls, written to a
+    JSONL file in the OpenAI batch format, submitted as one job and polled every
+    `poll_seconds` until it finishes. Answers are parsed back into Predictions keyed by
+    custom_id. Batch jobs trade latency (up to the provider's completion window) for a
+    lower price, so they suit offline work such as re-scoring stored profiles.
+    """
+
+    def __init__(
+        self,
+        model_name: str = global_config.batch_api.model,
+        api_base: Optional[str] = None,
+        api_key: Optional[str] = None,
+        poll_seconds: float = global_config.batch_api.poll_seconds,
+        timeout_seconds: float = global_config.batch_api.timeout_seconds,
+        max_tokens: Optional[int] = global_config.batch_api.max_tokens,
+    ):
+        self.provider, _, self.model = model_name.partition("/")
+        if self.provider not in BATCH_PROVIDERS:
+            raise ValueError(f"{model_name} has no batch API; use one of the providers {BATCH_PROVIDERS}")
+        self.model_name = model_name
+        self.api_base = api_base
+        self.api_key = api_key or global_config.llm_api_key(model_name)
+        self.poll_seconds = poll_seconds
+        self.timeout_seconds = timeout_seconds
+        # A request asking for more than the model can write is rejected, so the budget is capped
+        self.max_tokens = max_output_tokens(model_name, max_tokens or global_config.weird_quirk.max_tokens)
+        self.adapter = dspy.ChatAdapter()
+        self.usage = BatchUsage(model_name, global_config.batch_api.discount)
+
+    @property
+    def _client_kwargs(self) -> dict:
+        # litellm opens a new connection for every files/batches call; one whose connect stalls
+        # fails within seconds and is retried by the SDK, instead of waiting out the read timeout
+        return {
+            "custom_llm_provider": self.provider,
+            "api_base": self.api_base,
+            "api_key": self.api_key,
+            "timeout": httpx.Timeout(600.0, connect=5.0),
+        }
+
+    def request_line(self, request: BatchRequest) -> dict:
+        messages = self.adapter.format(request.signature, demos=[], inputs=request.inputs)
+        return {
+            "custom_id": request.custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.model,
+                "messages": messages,
+                "temperature": global_config.weird_quirk.temperature,
+                "max_tokens": self.max_tokens,
+            },
+        }
+
+    async def submit(self, requests: list[BatchRequest]) -> str:
+        """Upload `requests` and start a batch job, returning its id."""
+        lines = "\n".join(json.dumps(self.request_line(request)) for request in requests)
+        upload = await litellm.acreate_file(
+            file=("requests.jsonl", lines.encode()), purpose="batch", **self._client_kwargs
+        )
+        batch = await litellm.acreate_batch(
+            completion_window="24h",
+            endpoint="/v1/chat/completions",
+            input_file_id=upload.id,
+            **self._client_kwargs,
+        )
+        log.info(f"Submitted batch job {batch.id} with {len(requests)} requests")
+        return batch.id
+
+    async def wait(self, batch_id: str):
+        """Poll the job until it finishes; raises if it did not complete."""
+        start = time.monotonic()
+        while True:
+            batch = await litellm.aretrieve_batch(batch_id=batch_id, **self._client_kwargs)
+            if batch.status in _FINISHED:
+                break
+            if time.monotonic() - start > self.timeout_seconds:
+                raise TimeoutError(f"Batch job {batch_id} still {batch.status} after {self.timeout_seconds}s")
+            await asyncio.sleep(self.poll_seconds)
+        if batch.status != "completed" or batch.output_file_id is None:
+            raise RuntimeError(f"Batch job {batch_id} ended {batch.status}")
+        return batch
+
+    async def results(self, batch, requests: list[BatchRequest]) -> dict[str, dspy.Prediction]:
+        """Parse a completed job's output file into Predictions by custom_id; failed lines are left out."""
+        signatures = {request.custom_id: request.signature for request in requests}
+        content = await litellm.afile_content(file_id=batch.output_file_id, **self._client_kwargs)
+        predictions = {}
+        for line in content.content.decode().splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            custom_id = result["custom_id"]
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                log.warning(f"Batch request {custom_id} failed: {result.get('error') or response.get('status_code')}")
+                continue
+            body = response["body"]
+            self.usage.add(body.get("usage") or {})
+            try:
+                outputs = self.adapter.parse(signatures[custom_id], body["choices"][0]["message"]["content"])
+            except Exception as e:
+                log.warning(f"Batch request {custom_id} answer did not parse: {e}")
+                continue
+            predictions[custom_id] = dspy.Prediction(**outputs)
+        return predictions
+
+    async def run(self, requests: list[BatchRequest]) -> dict[str, dspy.Prediction]:
+        """Submit `requests` as one batch job, wait for it and return the parsed answers by custom_id."""
+        if not requests:
+            return {}
+        batch = await self.wait(await self.submit(requests))
+        return await self.results(batch, requests)
@@ -1,53 +1,96 @@
-from dspy.utils.callback import BaseCallback
+from dspy.utils.callback import ACTIVE_CALL_ID, BaseCallback
 from langfuse.decorators import langfuse_context
 from langfuse import Langfuse
 from litellm import completion_cost
 from langfuse.media import LangfuseMedia
 from typing import Optional
+from functools import lru_cache
+from PIL import Image as PILImage
 import dspy
 
+@lru_cache(maxsize=1)
+def _langfuse_client() -> Langfuse:
+    return Langfuse()
+
+def _describe_image(value) -> str:
+    """Short stand-in for an image input, e.g. '<image 1080x1350 RGBA>'."""
+    if isinstance(value, PILImage.Image):
+        return f"<image {value.width}x{value.height} {value.mode}>"
+    return "<image>"
+
+def _content_text(content) -> str:
+    """Text of a chat message content, which is a list of parts when images are attached."""
+    if isinstance(content, list):
+        return "".join(
+            part.get("text", "") if part.get("type") == "text" else "<image>"
+            for part in content if isinstance(part, dict)
+        )
+    return content or ""
+
 # 1. Define a custom callback class that extends BaseCallback class
 class LangFuseDSPYCallback(BaseCallback):
+    """
+    Mirror DSPy module and LM calls into Langfuse.
+
+    One callback serves every concurrent call of its agent, so all per-call state
+    is keyed by DSPy's call_id and the Langfuse trace/observation ids are captured
+    when each call starts, in the context of the run that issued it.
+    """
+
     def __init__(self, signature: dspy.Signature):
         super().__init__()
-        self.current_system_prompt = None
-        self.current_prompt = None
-        self.current_completion = None
-        # Initialize Langfuse client
-        self.langfuse = Langfuse()
-        self.current_span = None
+        # Share one Langfuse client (and its background flush thread) across all callbacks
+        self.langfuse = _langfuse_client()
 
         self.input_field_names = signature.input_fields.keys()
-        self.input_field_values = {}
+        # call_id -> {"inputs", "trace_id", "parent_observation_id"} for in-flight modules
+        self.module_calls = {}
+        # call_id -> {"span", "model", "system_prompt", "prompt"} for in-flight LM calls
+        self.lm_calls = {}
 
+        # Image inputs are logged as a short description so the callback never keeps decoded images alive
+        self.image_field_names = set()
         for input_field_name, input_field in signature.input_fields.items():
             if input_field.annotation == Optional[dspy.Image] or input_field.annotation == dspy.Image:
-                pass # TODO: We need to handle this.
+                self.image_field_names.add(input_field_name)
 
     def on_module_start(self, call_id, *args, **kwargs):
         inputs = kwargs.get("inputs")
         extracted_args = inputs["kwargs"]
 
+        input_field_values = {}
         for input_field_name in self.input_field_names:
             if input_field_name in extracted_args:
-                self.input_field_values[input_field_name] = extracted_args[input_field_name]
+                value = extracted_args[input_field_name]
+                if input_field_name in self.image_field_names:
+                    value = _describe_image(value)
+                input_field_values[input_field_name] = value
+
+        self.module_calls[call_id] = {
+            "inputs": input_field_values,
+            "trace_id": langfuse_context.get_current_trace_id(),
+            "parent_observation_id": langfuse_context.get_current_observation_id(),
+        }
 
     def on_module_end(self, call_id, outputs, exception):
+        module_call = self.module_calls.pop(call_id, None)
+        if module_call is None:
+            return
         metadata = {
-            "existing_trace_id": langfuse_context.get_current_trace_id(),
-            "parent_observation_id": langfuse_context.get_current_observation_id(),
+            "existing_trace_id": module_call["trace_id"],
+            "parent_observation_id": module_call["parent_observation_id"],
         }
-        outputs_extracted = {k:v for k,v in outputs.items()}
+        outputs_extracted = {k:v for k,v in outputs.items()} if outputs is not None else None
 
         langfuse_context.update_current_observation(
-            input=self.input_field_values,
+            input=module_call["inputs"],
             output=outputs_extracted,
             metadata=metadata
         )
 
     def on_lm_start(self, call_id, *args, **kwargs):
-        # There is a double-trigger, so only count the first trigger.
-        if self.current_span:
+        # There is a double-trigger when one LM call wraps another, so only count the outer one.
+        if ACTIVE_CALL_ID.get() in self.lm_calls:
             return
 
         # Everything related to the LM instance 
@@ -61,20 +104,18 @@ class LangFuseDSPYCallback(BaseCallback):
         inputs = kwargs.get("inputs")
         messages = inputs.get("messages")
 
-        # Extract prompt from kwargs
+        # Extract prompt from kwargs; attached images are logged as a placeholder, not base64
         assert messages[0].get("role") == "system"
-        system_prompt = messages[0].get("content")
+        system_prompt = _content_text(messages[0].get("content"))
         assert messages[1].get("role") == "user"
-        user_input = messages[1].get("content")
-
-        self.current_system_prompt = system_prompt
-        self.current_prompt = user_input
+        user_input = _content_text(messages[1].get("content"))
 
         # Create a new generation using the Langfuse client
         trace_id = langfuse_context.get_current_trace_id()
         parent_observation_id = langfuse_context.get_current_observation_id()
+        span = None
         if trace_id:
-            self.current_span = self.langfuse.generation(
+            span = self.langfuse.generation(
                 input=user_input,
                 name=model_name,
                 trace_id=trace_id,
@@ -87,39 +128,51 @@ class LangFuseDSPYCallback(BaseCallback):
                 }
             )
 
+        self.lm_calls[call_id] = {
+            "span": span,
+            "model": model_name,
+            "system_prompt": system_prompt,
+            "prompt": user_input,
+        }
+
     def on_lm_end(self, call_id, outputs, exception):
+        lm_call = self.lm_calls.pop(call_id, None)
+        if lm_call is None:
+            return
+
+        model_name = lm_call["model"]
         if isinstance(outputs, list):
-            completion = outputs[0]
-            return 
-        else:
+            completion = outputs[0] if outputs else ""
+            if isinstance(completion, dict):
+                completion = completion.get("text", "")
+        elif outputs is not None:
             model_name = outputs.model
             choices = outputs.choices[0]
             completion = choices.message.content
+        else:
+            completion = ""
 
-
-
-        total_cost = completion_cost(
-            model=model_name,
-            prompt=self.current_system_prompt+self.current_prompt,
-            completion=completion,
-        )
+        prompt = lm_call["system_prompt"] + lm_call["prompt"]
+        try:
+            total_cost = completion_cost(
+                model=model_name,
+                prompt=prompt,
+                completion=completion,
+            )
+        except Exception:
+            # Models missing from litellm's price map (e.g. local servers) have no cost
+            total_cost = None
 
         # End the generation if we have one
-        if self.current_span:
+        if lm_call["span"]:
             # Use low-level SDK parameters to log usage and cost details
-            self.current_span.end(
+            lm_call["span"].end(
                 output=completion,
                 usage_details={
-                    "prompt_tokens": len(self.current_system_prompt + self.current_prompt),
+                    "prompt_tokens": len(prompt),
                     "completion_tokens": len(completion),
-                    "total_tokens": len(self.current_system_prompt + self.current_prompt) + len(completion),
+                    "total_tokens": len(prompt) + len(completion),
                 },
                 model=model_name,
-                cost_details={
-                    "total": total_cost,
-                },
+                cost_details={"total": total_cost} if total_cost is not None else None,
             )
-            self.current_span = None
-
-        self.current_generation = completion
-
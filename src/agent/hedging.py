@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from loguru import logger as log
+
+
+def percentile(values, q: float) -> Optional[float]:
+    """Nearest-rank q-th percentile (0-100) of `values`, or None when there are none."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class HedgeStats:
+    """
+    Counters and latency windows of one agent's hedged runs.
+
+    `latencies` are end-to-end run latencies. `primary_latencies` are how long the
+    primary model took, or had already taken when its request was cancelled, so
+    primary percentiles are a lower bound of what runs would take without hedging.
+    """
+
+    def __init__(self, window: int):
+        self.runs = 0
+        self.hedged = 0
+        self.backup_wins = 0
+        self.failovers = 0
+        self.latencies: deque = deque(maxlen=window)
+        self.primary_latencies: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def report(self) -> dict:
+        with self._lock:
+            runs = max(self.runs, 1)
+            return {
+                "runs": self.runs,
+                "hedge_rate": self.hedged / runs,
+                "backup_win_rate": self.backup_wins / runs,
+                "failovers": self.failovers,
+                **{f"p{q}_seconds": percentile(self.latencies, q) for q in (50, 95, 99)},
+                **{f"primary_p{q}_seconds": percentile(self.primary_latencies, q) for q in (50, 95, 99)},
+            }
+
+
+class Hedge:
+    """
+    Race a backup model against a primary that runs past its usual latency.
+
+    The backup request fires once the primary has been running longer than the
+    `latency_percentile` of its recent latencies (`initial_delay_seconds` until
+    `min_samples` have been seen). The first successful result wins and the other
+    request is cancelled. A primary that fails with one of `failover_errors` hands
+    over to the backup straight away; if the backup fails too, the primary's error
+    is raised so the caller's retry policy applies.
+    """
+
+    def __init__(
+        self,
+        latency_percentile: float = 95,
+        latency_window: int = 200,
+        min_samples: int = 20,
+        initial_delay_seconds: float = 10.0,
+        failover_errors: tuple[type[BaseException], ...] = (),
+    ):
+        self.latency_percentile = latency_percentile
+        self.min_samples = min_samples
+        self.initial_delay_seconds = initial_delay_seconds
+        self.failover_errors = failover_errors
+        self.stats = HedgeStats(latency_window)
+
+    def delay(self) -> float:
+        """Seconds to give the primary before hedging."""
+        with self.stats._lock:
+            if len(self.stats.primary_latencies) < self.min_samples:
+                return self.initial_delay_seconds
+            return percentile(self.stats.primary_latencies, self.latency_percentile)
+
+    def _record(self, start: float, primary_seconds: Optional[float], backup_won: bool) -> None:
+        with self.stats._lock:
+            self.stats.latencies.append(time.perf_counter() - start)
+            if primary_seconds is not None:
+                self.stats.primary_latencies.append(primary_seconds)
+            self.stats.backup_wins += backup_won
+
+    async def run(
+        self,
+        primary: Callable[[], Awaitable],
+        backup: Callable[[], Awaitable],
+    ):
+        start = time.perf_counter()
+        with self.stats._lock:
+            self.stats.runs += 1
+        primary_task = asyncio.ensure_future(primary())
+        backup_task = None
+        try:
+            done, _ = await asyncio.wait({primary_task}, timeout=self.delay())
+            if done:
+                error = primary_task.exception()
+                if error is None:
+                    self._record(start, time.perf_counter() - start, backup_won=False)
+                    return primary_task.result()
+                if not isinstance(error, self.failover_errors):
+                    raise error
+                with self.stats._lock:
+                    self.stats.failovers += 1
+                log.warning(f"Primary model failed ({type(error).__name__}); failing over to backup")
+                try:
+                    result = await backup()
+                except Exception:
+                    raise error
+                self._record(start, None, backup_won=True)
+                return result
+
+            with self.stats._lock:
+                self.stats.hedged += 1
+            backup_task = asyncio.ensure_future(backup())
+            pending = {primary_task, backup_task}
+            primary_error = backup_error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Prefer the primary when both finish in the same step
+                for task in sorted(done, key=lambda t: t is not primary_task):
+                    error = task.exception()
+                    if error is None:
+                        primary_seconds = None if primary_error else time.perf_counter() - start
+                        self._record(start, primary_seconds, backup_won=task is backup_task)
+                        return task.result()
+                    if task is primary_task:
+                        primary_error = error
+                    else:
+                        backup_error = error
+            raise primary_error or backup_error
+        finally:
+            # The losing request, or both when the caller was cancelled
+            for task in (primary_task, backup_task):
+                if task is not None and not task.done():
+                    task.cancel()
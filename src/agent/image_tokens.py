@@ -0,0 +1,19 @@
+import math
+
+GEMINI_TOKENS_PER_TILE = 258
+GEMINI_SMALL_IMAGE_SIDE = 384
+GEMINI_TILE_SIDE = 768
+
+
+def estimate_image_tokens(size: tuple[int, int]) -> int:
+    """
+    Approximate Gemini input tokens for an image.
+
+    Images with both sides <= 384px cost a single tile; larger images are
+    split into 768x768 tiles of 258 tokens each.
+    """
+    width, height = size
+    if width <= GEMINI_SMALL_IMAGE_SIDE and height <= GEMINI_SMALL_IMAGE_SIDE:
+        return GEMINI_TOKENS_PER_TILE
+    tiles = math.ceil(width / GEMINI_TILE_SIDE) * math.ceil(height / GEMINI_TILE_SIDE)
+    return tiles * GEMINI_TOKENS_PER_TILE
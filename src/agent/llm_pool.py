@@ -0,0 +1,103 @@
+import asyncio
+import functools
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, Optional
+
+import httpx
+import litellm
+from litellm.llms.custom_httpx.http_handler import AsyncHTTPHandler
+from openai import AsyncOpenAI
+
+from global_config import global_config
+
+# litellm providers whose async requests take an AsyncOpenAI client, and those taking its own handler
+OPENAI_CLIENT_PROVIDERS = ("openai", "custom_openai", "litellm_proxy")
+HTTP_HANDLER_PROVIDERS = ("gemini", "vertex_ai", "vertex_ai_beta")
+
+
+class _LoopPool:
+    """Concurrency limit and pooled HTTP client owned by one event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        concurrency = global_config.llm_config.concurrency
+        self.slots = asyncio.Semaphore(concurrency.max_in_flight)
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=concurrency.max_in_flight,
+                max_keepalive_connections=concurrency.max_keepalive_connections,
+                keepalive_expiry=concurrency.keepalive_expiry_seconds,
+            ),
+            timeout=httpx.Timeout(600.0, connect=5.0),
+        )
+        # (provider, api_base, api_key) -> litellm client object wrapping http_client
+        self.clients: dict[tuple, Any] = {}
+        # Started now, then suspended until the loop shuts down its async generators
+        # (asyncio.run does so before closing the loop), which closes the client on its loop
+        self._closer = self._close_on_shutdown()
+        self._started = loop.create_task(self._closer.__anext__())
+
+    async def _close_on_shutdown(self):
+        try:
+            yield
+        finally:
+            await self.http_client.aclose()
+
+    def client(self, model: str, api_base: Optional[str], api_key: Optional[str]) -> Optional[Any]:
+        """The client for litellm's `client` argument, or None if litellm should build its own."""
+        _, provider, api_key, api_base = litellm.get_llm_provider(model, api_base=api_base, api_key=api_key)
+        key = (provider, api_base, api_key)
+        if key not in self.clients:
+            if provider in OPENAI_CLIENT_PROVIDERS and api_key:
+                # litellm's own retries are off (num_retries=0), so the SDK's are too
+                self.clients[key] = AsyncOpenAI(
+                    api_key=api_key, base_url=api_base, http_client=self.http_client, max_retries=0
+                )
+            elif provider in HTTP_HANDLER_PROVIDERS:
+                handler = AsyncHTTPHandler()
+                handler.client = self.http_client
+                self.clients[key] = handler
+            else:
+                self.clients[key] = None
+        return self.clients[key]
+
+
+# httpx connections and asyncio semaphores are bound to the loop that created them
+_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopPool]" = weakref.WeakKeyDictionary()
+
+
+def _loop_pool() -> _LoopPool:
+    loop = asyncio.get_running_loop()
+    if loop not in _pools:
+        _pools[loop] = _LoopPool(loop)
+    return _pools[loop]
+
+
+@asynccontextmanager
+async def llm_slot():
+    """Hold one of the event loop's in-flight LM request slots."""
+    async with _loop_pool().slots:
+        yield
+
+
+def with_loop_client(completion_fn):
+    """
+    Wrap dspy's async litellm completion so every request holds one of the running loop's
+    in-flight slots while it is sent, and goes through the loop's pooled client, reusing
+    its keep-alive connections instead of each opening their own.
+
+    Only the request itself holds the slot, not the tool calls or retry waits of the agent
+    run around it. The client is added below dspy's request cache, so neither it nor a
+    cache hit touches the pool.
+    """
+
+    @functools.wraps(completion_fn)
+    async def completion(request: dict, **kwargs):
+        if "client" not in request:
+            client = _loop_pool().client(request["model"], request.get("api_base"), request.get("api_key"))
+            if client is not None:
+                request = {**request, "client": client}
+        async with llm_slot():
+            return await completion_fn(request=request, **kwargs)
+
+    return completion
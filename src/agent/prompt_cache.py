@@ -0,0 +1,73 @@
+from typing import Optional
+
+from global_config import global_config
+from src.agent.rate_limiter import RateLimitedLM, estimate_request_tokens, provider_of
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def _parts(content) -> list[dict]:
+    return content if isinstance(content, list) else [{"type": "text", "text": content or ""}]
+
+
+def static_prefix_end(messages: list[dict]) -> Optional[tuple[int, int]]:
+    """
+    (message index, part index) of the last part of the static prompt prefix.
+
+    The prefix is the system message (signature instructions and field formats) and,
+    when the user message carries an image, the text before it: the inputs formatted
+    ahead of the image, such as the shared system_prompt. None when there is no
+    system message.
+    """
+    if not messages or messages[0].get("role") != "system":
+        return None
+    end = (0, len(_parts(messages[0]["content"])) - 1)
+    if len(messages) < 2 or messages[1].get("role") != "user":
+        return end
+    parts = _parts(messages[1]["content"])
+    first_image = next((i for i, part in enumerate(parts) if part.get("type") != "text"), None)
+    return (1, first_image - 1) if first_image else end
+
+
+def static_prefix(messages: list[dict], end: tuple[int, int]) -> list[dict]:
+    """The messages up to and including part `end`."""
+    message_index, part_index = end
+    last = {**messages[message_index], "content": _parts(messages[message_index]["content"])[: part_index + 1]}
+    return messages[:message_index] + [last]
+
+
+def mark_static_prefix(messages: list[dict], end: tuple[int, int]) -> list[dict]:
+    """Copy of `messages` with a provider cache breakpoint (cache_control) on part `end`."""
+    message_index, part_index = end
+    parts = [dict(part) for part in _parts(messages[message_index]["content"])]
+    parts[part_index]["cache_control"] = CACHE_CONTROL
+    marked = list(messages)
+    marked[message_index] = {**messages[message_index], "content": parts}
+    return marked
+
+
+class PromptCachingLM(RateLimitedLM):
+    """
+    RateLimitedLM that asks the provider to cache the static prompt prefix.
+
+    Whether a provider gets an explicit cache_control breakpoint (Anthropic) or relies
+    on automatic prefix caching (OpenAI, Gemini) is set per provider
+    in llm_config.prompt_caching. Prefixes shorter than the provider's minimum are sent
+    unmarked, since the provider would not cache them anyway.
+    """
+
+    def _mark(self, messages: Optional[list[dict]]) -> Optional[list[dict]]:
+        caching = global_config.llm_config.prompt_caching
+        provider = getattr(caching.providers, provider_of(self.model), None)
+        if not messages or not caching.enabled or provider is None or not provider.explicit:
+            return messages
+        end = static_prefix_end(messages)
+        if end is None or estimate_request_tokens(static_prefix(messages, end), 0) < provider.min_prefix_tokens:
+            return messages
+        return mark_static_prefix(messages, end)
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        return super().forward(prompt=prompt, messages=self._mark(messages), **kwargs)
+
+    async def aforward(self, prompt=None, messages=None, **kwargs):
+        return await super().aforward(prompt=prompt, messages=self._mark(messages), **kwargs)
@@ -0,0 +1,394 @@
+import asyncio
+import email.utils
+import functools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+import dspy
+from dspy.clients.lm import alitellm_completion, litellm_completion
+from litellm import RateLimitError
+from loguru import logger as log
+
+from global_config import global_config
+from src.agent.image_tokens import GEMINI_TOKENS_PER_TILE
+from src.agent.llm_pool import with_loop_client
+
+
+def provider_of(model_name: str) -> str:
+    """Provider prefix of a litellm model name, e.g. 'gemini' for 'gemini/gemini-2.0-flash'."""
+    return model_name.split("/", 1)[0] if "/" in model_name else "openai"
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Seconds the provider asked us to wait, from a Retry-After header if the error carries one."""
+    headers = getattr(error, "litellm_response_headers", None)
+    if headers is None:
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+    value = headers.get("retry-after") if headers is not None else None
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+def estimate_request_tokens(messages: Optional[list], max_tokens: Optional[int]) -> int:
+    """
+    Rough token cost of a request before it is sent: ~4 characters per text token,
+    one tile per attached image, plus the completion it is expected to need. That is
+    llm_config.rate_limits.expected_completion_tokens unless `max_tokens` is lower; the
+    real usage is settled once the call returns.
+    """
+    expected = global_config.llm_config.rate_limits.expected_completion_tokens
+    tokens = min(max_tokens, expected) if max_tokens is not None else expected
+    for message in messages or []:
+        content = message.get("content")
+        parts = content if isinstance(content, list) else [{"type": "text", "text": content or ""}]
+        for part in parts:
+            if part.get("type") == "image_url":
+                tokens += GEMINI_TOKENS_PER_TILE
+            else:
+                tokens += len(json.dumps(part.get("text", ""))) // 4
+    return tokens
+
+
+class TokenBucket:
+    """
+    Continuously refilled budget of `per_minute` units.
+
+    Reservations may take the bucket into debt; the returned delay is how long the
+    caller must wait for its share to be refilled, so waiters are served in order.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        self._refill(now)
+        self.level -= amount
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def refund(self, amount: float) -> None:
+        self.level = min(self.capacity, self.level + amount)
+
+
+class ProviderLimiter:
+    """
+    Requests/min and tokens/min buckets plus an AIMD concurrency window for one provider.
+
+    The window grows by `additive_increase` per window of successful calls and is
+    multiplied by `multiplicative_decrease` on a rate-limit error, at most once per
+    cooldown. A Retry-After from the provider pauses every new call until it passes.
+    State is guarded by a thread lock, so one limiter serves event-loop tasks and
+    worker threads alike.
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        initial_concurrency: int = 8,
+        min_concurrency: int = 1,
+        max_concurrency: int = 32,
+        additive_increase: float = 1.0,
+        multiplicative_decrease: float = 0.5,
+        cooldown_seconds: float = 1.0,
+    ):
+        self.provider = provider
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.limit = float(initial_concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.additive_increase = additive_increase
+        self.multiplicative_decrease = multiplicative_decrease
+        self.cooldown_seconds = cooldown_seconds
+
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.rate_limited = 0
+
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._async_waiters: deque = deque()
+
+    # Concurrency window
+
+    def _try_enter(self) -> bool:
+        if self.in_flight < max(int(self.limit), self.min_concurrency):
+            self.in_flight += 1
+            return True
+        return False
+
+    def _wake_waiters(self) -> None:
+        free = max(int(self.limit), self.min_concurrency) - self.in_flight
+        while free > 0 and self._async_waiters:
+            loop, future = self._async_waiters.popleft()
+            if future.done():  # Cancelled while waiting
+                continue
+            loop.call_soon_threadsafe(_resolve, future)
+            free -= 1
+        self._slot_freed.notify_all()
+
+    def _leave(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self._wake_waiters()
+
+    # Quotas
+
+    def _capped(self, tokens: int) -> int:
+        # A reservation above the bucket's capacity could never be refilled in one minute
+        return min(tokens, int(self.tokens.capacity)) if self.tokens else tokens
+
+    def _reserve(self, tokens: int) -> float:
+        now = time.monotonic()
+        delay = 0.0
+        if self.requests:
+            delay = max(delay, self.requests.reserve(1, now))
+        if self.tokens:
+            delay = max(delay, self.tokens.reserve(self._capped(tokens), now))
+        return delay
+
+    def _blocked_for(self) -> float:
+        return max(self.blocked_until - time.monotonic(), 0.0)
+
+    def settle(self, estimated_tokens: int, used_tokens: Optional[int], cache_hit: bool = False) -> None:
+        """Correct the token bucket once the real usage of a call is known."""
+        with self._lock:
+            if cache_hit:
+                if self.requests:
+                    self.requests.refund(1)
+                used_tokens = 0
+            if self.tokens and used_tokens is not None:
+                self.tokens.refund(self._capped(estimated_tokens) - used_tokens)
+
+    # Feedback
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.limit = min(self.max_concurrency, self.limit + self.additive_increase / max(self.limit, 1.0))
+            self._wake_waiters()
+
+    def on_rate_limited(self, retry_after: Optional[float]) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self.rate_limited += 1
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            if now - self.last_decrease >= self.cooldown_seconds:
+                self.limit = max(self.min_concurrency, self.limit * self.multiplicative_decrease)
+                self.last_decrease = now
+                log.warning(
+                    f"{self.provider} rate limited; concurrency window now {int(self.limit)}"
+                    + (f", pausing {retry_after:.1f}s" if retry_after else "")
+                )
+
+    def _observe(self, error: Optional[BaseException]) -> None:
+        if error is None:
+            self.on_success()
+        elif isinstance(error, RateLimitError):
+            self.on_rate_limited(retry_after_seconds(error))
+
+    # Entry points
+
+    @asynccontextmanager
+    async def acquire(self, tokens: int):
+        """Wait for a concurrency slot, the provider's quota and any Retry-After pause."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self._try_enter():
+                    break
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                with self._lock:
+                    if (loop, future) in self._async_waiters:
+                        self._async_waiters.remove((loop, future))
+                    else:
+                        # Woken, then cancelled (a losing hedge, a deadline) before it ran:
+                        # pass the wakeup on, or the waiters behind it are never woken
+                        self._wake_waiters()
+                raise
+        try:
+            while (delay := self._blocked_for()) > 0:
+                await asyncio.sleep(delay)
+            with self._lock:
+                delay = self._reserve(tokens)
+            if delay:
+                await asyncio.sleep(delay)
+            while (delay := self._blocked_for()) > 0:
+                await asyncio.sleep(delay)
+            error = None
+            try:
+                yield
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                self._observe(error)
+        finally:
+            self._leave()
+
+    @contextmanager
+    def acquire_sync(self, tokens: int):
+        """Blocking counterpart of `acquire` for LM calls made from worker threads."""
+        with self._lock:
+            while not self._try_enter():
+                self._slot_freed.wait()
+        try:
+            while (delay := self._blocked_for()) > 0:
+                time.sleep(delay)
+            with self._lock:
+                delay = self._reserve(tokens)
+            if delay:
+                time.sleep(delay)
+            while (delay := self._blocked_for()) > 0:
+                time.sleep(delay)
+            error = None
+            try:
+                yield
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                self._observe(error)
+        finally:
+            self._leave()
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+_limiters: dict[str, ProviderLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model_name: str) -> ProviderLimiter:
+    """Process-wide limiter for the model's provider, shared by every ReactAgent."""
+    provider = provider_of(model_name)
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            rate_limits = global_config.llm_config.rate_limits
+            quota = getattr(rate_limits.providers, provider, None) or rate_limits.default
+            adaptive = rate_limits.adaptive
+            limiter = ProviderLimiter(
+                provider,
+                requests_per_minute=quota.requests_per_minute,
+                tokens_per_minute=quota.tokens_per_minute,
+                initial_concurrency=adaptive.initial_concurrency,
+                min_concurrency=adaptive.min_concurrency,
+                max_concurrency=global_config.llm_config.concurrency.max_in_flight,
+                additive_increase=adaptive.additive_increase,
+                multiplicative_decrease=adaptive.multiplicative_decrease,
+                cooldown_seconds=adaptive.cooldown_seconds,
+            )
+            _limiters[provider] = limiter
+        return limiter
+
+
+def _with_call_timeout(completion_fn):
+    """
+    Wrap dspy's litellm completion so every request gets llm_config.retry.call_timeout_seconds
+    as its timeout, unless the caller set one. The request is only sent once it has passed
+    the rate limiter, so waiting there does not count towards it.
+
+    Like the pooled client, the timeout is added below dspy's request cache, so it is not
+    part of the cache key.
+    """
+
+    def with_timeout(request: dict) -> dict:
+        timeout = global_config.llm_config.retry.call_timeout_seconds
+        return request if timeout is None or "timeout" in request else {**request, "timeout": timeout}
+
+    if asyncio.iscoroutinefunction(completion_fn):
+        @functools.wraps(completion_fn)
+        async def acompletion(request: dict, **kwargs):
+            return await completion_fn(request=with_timeout(request), **kwargs)
+
+        return acompletion
+
+    @functools.wraps(completion_fn)
+    def completion(request: dict, **kwargs):
+        return completion_fn(request=with_timeout(request), **kwargs)
+
+    return completion
+
+
+class RateLimitedLM(dspy.LM):
+    """
+    dspy.LM whose every request passes through its provider's shared ProviderLimiter,
+    with llm_config.retry.call_timeout_seconds as its timeout.
+
+    Async requests also go through the running event loop's pooled HTTP client.
+    """
+
+    def _get_cached_completion_fn(self, completion_fn, cache, enable_memory_cache):
+        if completion_fn is alitellm_completion:
+            completion_fn = _with_call_timeout(with_loop_client(completion_fn))
+        elif completion_fn is litellm_completion:
+            completion_fn = _with_call_timeout(completion_fn)
+        return super()._get_cached_completion_fn(completion_fn, cache, enable_memory_cache)
+
+    def _settle(self, limiter: ProviderLimiter, estimate: int, response) -> None:
+        if response is None:
+            # Failed or cancelled before a response: release the reservation rather than leave
+            # the bucket in debt for tokens that were never reported
+            limiter.settle(estimate, 0)
+            return
+        usage = getattr(response, "usage", None)
+        limiter.settle(
+            estimate,
+            getattr(usage, "total_tokens", None) if usage else None,
+            cache_hit=getattr(response, "cache_hit", False),
+        )
+
+    def forward(self, prompt=None, messages=None, **kwargs):
+        limiter = get_rate_limiter(self.model)
+        estimate = estimate_request_tokens(
+            messages or [{"role": "user", "content": prompt}],
+            kwargs.get("max_tokens", self.kwargs.get("max_tokens")),
+        )
+        response = None
+        try:
+            with limiter.acquire_sync(estimate):
+                response = super().forward(prompt=prompt, messages=messages, **kwargs)
+        finally:
+            self._settle(limiter, estimate, response)
+        return response
+
+    async def aforward(self, prompt=None, messages=None, **kwargs):
+        limiter = get_rate_limiter(self.model)
+        estimate = estimate_request_tokens(
+            messages or [{"role": "user", "content": prompt}],
+            kwargs.get("max_tokens", self.kwargs.get("max_tokens")),
+        )
+        response = None
+        try:
+            async with limiter.acquire(estimate):
+                response = await super().aforward(prompt=prompt, messages=messages, **kwargs)
+        finally:
+            self._settle(limiter, estimate, response)
+        return response
@@ -1,5 +1,10 @@
-from typing import Callable # Changed from List, Callable; asyncio removed
+from typing import Callable, Optional # Changed from List, Callable
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
 import dspy
+from PIL import Image as PILImage
 from global_config import global_config
 
 from loguru import logger as log
@@ -10,8 +15,172 @@ from tenacity import (
     retry_if_exception_type
 )
 from src.agent.dspy_langfuse import LangFuseDSPYCallback
-from litellm import ServiceUnavailableError
+from litellm import (
+    APIConnectionError,
+    AuthenticationError,
+    BadRequestError,
+    InternalServerError,
+    NotFoundError,
+    PermissionDeniedError,
+    RateLimitError,
+    ServiceUnavailableError,
+    Timeout,
+)
 from langfuse.decorators import observe
+from dspy.clients.base_lm import GLOBAL_HISTORY
+from src.agent.result_cache import ResultCache, get_result_cache
+from dspy.utils.callback import BaseCallback
+from src.agent.rate_limiter import retry_after_seconds
+from src.agent.prompt_cache import PromptCachingLM
+from src.agent.hedging import Hedge
+from src.agent.structured_output import StructuredOutputStats, StructuredPredict
+from src.agent.trajectory_checkpoint import (
+    CheckpointedReAct,
+    CheckpointStats,
+    current_checkpoint,
+    trajectory_checkpoint,
+)
+
+# Transient provider errors worth another attempt: rate limits, timeouts and outages.
+# Timeout includes a request outliving llm_config.retry.call_timeout_seconds
+RETRYABLE_ERRORS = (
+    RateLimitError,
+    Timeout,
+    ServiceUnavailableError,
+    InternalServerError,
+    APIConnectionError,
+)
+
+# Errors from the primary's provider that a different model may not hit, so hedging fails over
+PROVIDER_ERRORS = RETRYABLE_ERRORS + (
+    AuthenticationError,
+    PermissionDeniedError,
+    NotFoundError,
+    BadRequestError,
+)
+
+_backoff = wait_exponential(
+    multiplier=global_config.llm_config.retry.min_wait_seconds,
+    max=global_config.llm_config.retry.max_wait_seconds
+)
+
+
+def _wait_for_retry(retry_state) -> float:
+    """Honour the provider's Retry-After when it sent one, else back off exponentially."""
+    retry_after = retry_after_seconds(retry_state.outcome.exception())
+    if retry_after is not None:
+        return min(retry_after, global_config.llm_config.retry.max_retry_after_seconds)
+    return _backoff(retry_state)
+
+def cached_prompt_tokens(usage: dict) -> int:
+    """Prompt tokens the provider served from its prompt cache, as litellm reports them."""
+    details = usage.get("prompt_tokens_details")
+    cached = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", None)
+    return cached or usage.get("cache_read_input_tokens") or 0
+
+
+@dataclass
+class TokenUsage:
+    """LM tokens spent inside one usage_scope, e.g. analysing one profile."""
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    completion_tokens: int = 0
+    parent: Optional["TokenUsage"] = field(default=None, repr=False)
+
+    @property
+    def uncached_prompt_tokens(self) -> int:
+        return self.prompt_tokens - self.cached_prompt_tokens
+
+    def add(self, prompt_tokens: int, cached_prompt_tokens: int, completion_tokens: int) -> None:
+        """Count one LM call here and in every enclosing scope."""
+        scope = self
+        while scope is not None:
+            scope.prompt_tokens += prompt_tokens
+            scope.cached_prompt_tokens += cached_prompt_tokens
+            scope.completion_tokens += completion_tokens
+            scope = scope.parent
+
+
+_usage_scope: ContextVar[Optional[TokenUsage]] = ContextVar("usage_scope", default=None)
+
+
+@contextmanager
+def usage_scope():
+    """
+    Collect the tokens of every LM call made in this context, across agents.
+
+    Tasks, hedged requests and dspy.asyncify worker threads started inside inherit the
+    scope, so concurrent profiles each see only their own calls. Nested scopes also
+    count towards the scopes around them.
+    """
+    usage = TokenUsage(parent=_usage_scope.get())
+    token = _usage_scope.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage_scope.reset(token)
+
+
+class AgentUsage(BaseCallback):
+    """
+    Running totals of LM round trips and tokens across an agent's uncached runs.
+
+    Registered on the agent's LM instance rather than through dspy's thread-local
+    settings, so it sees calls made from worker threads and event-loop tasks alike.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+        self.lm_calls = 0
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def record_call(self):
+        with self._lock:
+            self.calls += 1
+
+    def on_lm_start(self, call_id, instance, inputs):
+        self._pending[call_id] = instance
+
+    def on_lm_end(self, call_id, outputs, exception):
+        lm = self._pending.pop(call_id, None)
+        if lm is None or outputs is None:
+            return
+        # The LM logs each call's outputs list in its history, which identifies this call's usage
+        entry = next((e for e in reversed(lm.history) if e["outputs"] is outputs), None)
+        if entry is None or getattr(entry["response"], "cache_hit", False):
+            return
+        usage = entry["usage"]
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        completion_tokens = usage.get("completion_tokens") or 0
+        cached = cached_prompt_tokens(usage)
+        with self._lock:
+            self.lm_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_prompt_tokens += cached
+            self.completion_tokens += completion_tokens
+            self.cost += entry.get("cost") or 0.0
+            scope = _usage_scope.get()
+            if scope is not None:
+                scope.add(prompt_tokens, cached, completion_tokens)
+        checkpoint = current_checkpoint()
+        if checkpoint is not None:
+            checkpoint.add_tokens(prompt_tokens + completion_tokens)
+
+    def per_call(self) -> dict:
+        calls = max(self.calls, 1)
+        return {
+            "calls": self.calls,
+            "lm_calls_per_call": self.lm_calls / calls,
+            "prompt_tokens_per_call": self.prompt_tokens / calls,
+            "cached_prompt_tokens_per_call": self.cached_prompt_tokens / calls,
+            "completion_tokens_per_call": self.completion_tokens / calls,
+        }
 
 class ReactAgent: # Renamed from ReactAgentWithMemory
     def __init__(
@@ -19,47 +188,215 @@ class ReactAgent: # Renamed from ReactAgentWithMemory
         agent_signature: dspy.Signature,
         tools: list[Callable] = [], # Changed List to list
         model_name: str = global_config.agent.chat_agent_model,
+        strategy: Optional[str] = None,
+        execution: Optional[str] = None,
+        backup_model_name: Optional[str] = None,
+        output_mode: Optional[str] = None,
     ):
-        api_key = global_config.llm_api_key(model_name)
-        self.lm = dspy.LM(
+        self.signature = agent_signature
+        # Initialize a LangFuseDSPYCallback for generation tracing. Callbacks are attached to the
+        # LM and program instances rather than set globally with dspy.configure, so agents on
+        # different models and signatures can run side by side, in threads or on one event loop.
+        self.callback = LangFuseDSPYCallback(agent_signature)
+        self.usage = AgentUsage()
+
+        self.lm = self._build_lm(model_name)
+
+        # Optional backup model raced against slow primary calls (see src.agent.hedging)
+        hedging = global_config.agent.hedging
+        if backup_model_name is None and hedging.enabled:
+            backup_model_name = hedging.backup_model
+        self.backup_lm = None
+        self.hedge = None
+        if backup_model_name:
+            self.backup_lm = self._build_lm(backup_model_name)
+            self.hedge = Hedge(
+                latency_percentile=hedging.latency_percentile,
+                latency_window=hedging.latency_window,
+                min_samples=hedging.min_samples,
+                initial_delay_seconds=hedging.initial_delay_seconds,
+                failover_errors=PROVIDER_ERRORS,
+            )
+
+        # Agent Intiialization: without tools ReAct's thought/action loop is pure overhead,
+        # so fall back to a single structured prediction with the same run() interface
+        self.strategy = "react" if tools else (strategy or global_config.agent.no_tool_strategy)
+        self.checkpoint_stats = None
+        if self.strategy == "react":
+            # Completed thought/action steps survive a retry (see src.agent.trajectory_checkpoint)
+            self.agent_init = CheckpointedReAct(
+                agent_signature,
+                tools=tools, # Uses tools as passed, no longer appends read_memory
+            )
+            self.checkpoint_stats = CheckpointStats()
+        elif self.strategy == "chain_of_thought":
+            self.agent_init = dspy.ChainOfThought(agent_signature)
+        elif self.strategy == "predict":
+            self.agent_init = dspy.Predict(agent_signature)
+        else:
+            raise ValueError(f"Unknown agent strategy: {self.strategy}")
+
+        # Structured output swaps the final prediction's text adapter for a JSON schema built
+        # from the output fields; ReAct's tool loop keeps parsing free-form text
+        self.output_mode = output_mode or global_config.agent.output_mode
+        if self.output_mode == "structured" and self.strategy != "react":
+            max_field_retries = global_config.agent.structured_output.max_field_retries
+            if self.strategy == "chain_of_thought":
+                self.agent_init.predict = StructuredPredict(self.agent_init.predict.signature, max_field_retries)
+            else:
+                self.agent_init = StructuredPredict(agent_signature, max_field_retries)
+        elif self.output_mode not in ("text", "structured"):
+            raise ValueError(f"Unknown agent output mode: {self.output_mode}")
+        self.agent_init.callbacks = [self.callback]
+
+        # Native async runs the program's LM calls through litellm.acompletion on the event
+        # loop; thread execution hops each run onto one of dspy.asyncify's worker threads
+        self.execution = execution or global_config.agent.execution
+        if self.execution == "async":
+            self.agent = self.agent_init.acall
+        elif self.execution == "thread":
+            self.agent = dspy.asyncify(self.agent_init)
+        else:
+            raise ValueError(f"Unknown agent execution: {self.execution}")
+
+    @staticmethod
+    def _build_lm(model_name: str) -> dspy.LM:
+        # Requests pass through the provider's process-wide rate limiter, with the static prompt
+        # prefix marked for provider caching. litellm's own retries are off so every 429 reaches
+        # the limiter, and transient errors are retried in run()
+        return PromptCachingLM(
             model=model_name,
-            api_key=api_key,
-            # cache=global_config.llm_cache_enabled,
+            api_key=global_config.llm_api_key(model_name),
+            cache=global_config.llm_cache.enabled,
+            num_retries=0,
             temperature=global_config.weird_quirk.temperature,
             max_tokens=global_config.weird_quirk.max_tokens,
         )
-        # Initialize a LangFuseDSPYCallback and configure the LM instance for generation tracing
-        self.callback = LangFuseDSPYCallback(agent_signature)
-        dspy.configure(lm=self.lm, callbacks=[self.callback])
 
-        # Agent Intiialization
-        self.agent_init = dspy.ReAct(
-            agent_signature,
-            tools=tools, # Uses tools as passed, no longer appends read_memory
+    def _attach_callbacks(self, lm: dspy.LM) -> dspy.LM:
+        """Attach this agent's tracing and usage callbacks to an LM it runs on."""
+        lm.callbacks = [
+            cb for cb in lm.callbacks if cb is not self.callback and cb is not self.usage
+        ] + [self.callback, self.usage]
+        return lm
+
+    @property
+    def output_stats(self) -> Optional[StructuredOutputStats]:
+        """Field validation counts of structured output mode, None in text mode."""
+        predict = getattr(self.agent_init, "predict", self.agent_init)
+        return predict.adapter.stats if isinstance(predict, StructuredPredict) else None
+
+    @property
+    def lm(self) -> dspy.LM:
+        return self._lm
+
+    @lm.setter
+    def lm(self, lm: dspy.LM):
+        self._lm = self._attach_callbacks(lm)
+
+    @property
+    def backup_lm(self) -> Optional[dspy.LM]:
+        return self._backup_lm
+
+    @backup_lm.setter
+    def backup_lm(self, lm: Optional[dspy.LM]):
+        self._backup_lm = self._attach_callbacks(lm) if lm is not None else None
+
+    def cache_key(self, inputs: dict) -> str:
+        """Result cache key of this agent's answer to `inputs`; the strategy and backup model can change it."""
+        return ResultCache.key(
+            self.signature,
+            self.lm.model,
+            self.lm.kwargs,
+            inputs,
+            strategy=self.strategy,
+            backup_model=self.backup_lm.model if self.backup_lm is not None else None,
         )
-        self.agent = dspy.asyncify(self.agent_init)
 
     @observe()
+    async def run(
+        self,
+        user_id: str,
+        use_cache: bool = True,
+        **kwargs,
+    ):
+        """Run the agent, serving repeated inputs from the persistent result cache.
+
+        Pass `use_cache=False` (or set llm_cache.enabled: false) to bypass the cache.
+        """
+        use_cache = use_cache and global_config.llm_cache.enabled
+        if use_cache:
+            cache = get_result_cache()
+            key = self.cache_key({"user_id": user_id, **kwargs})
+            cached = cache.get(key)
+            if cached is not None:
+                log.debug(f"Result cache hit for {self.signature.__name__} ({cache.hit_rate:.0%} hit rate)")
+                return dspy.Prediction(**cached)
+
+        if self.checkpoint_stats is None:
+            result = await self._run_with_retry(user_id, **kwargs)
+        else:
+            # Retries resume the ReAct trajectory from its last completed step
+            with trajectory_checkpoint() as checkpoint:
+                try:
+                    result = await self._run_with_retry(user_id, **kwargs)
+                finally:
+                    self.checkpoint_stats.record(checkpoint)
+
+        if use_cache:
+            cache.set(key, {name: result.get(name) for name in self.signature.output_fields})
+        return result
+
     @retry(
-        retry=retry_if_exception_type(ServiceUnavailableError),
+        retry=retry_if_exception_type(RETRYABLE_ERRORS),
         stop=stop_after_attempt(global_config.llm_config.retry.max_attempts),
-        wait=wait_exponential(
-            multiplier=global_config.llm_config.retry.min_wait_seconds,
-            max=global_config.llm_config.retry.max_wait_seconds
-        ),
+        wait=_wait_for_retry,
         before_sleep=lambda retry_state: log.warning(
-            f"Retrying due to ServiceUnavailableError. Attempt {retry_state.attempt_number}"
+            f"Retrying due to {type(retry_state.outcome.exception()).__name__}. "
+            f"Attempt {retry_state.attempt_number}"
         )
     )
-    async def run(
+    async def _run_with_retry(
         self,
         user_id: str,
         **kwargs,
     ):
+        # dspy sends images only as dspy.Image; a PIL image would be formatted as its repr
+        kwargs = {
+            name: dspy.Image.from_PIL(value) if isinstance(value, PILImage.Image) else value
+            for name, value in kwargs.items()
+        }
+        checkpoint = current_checkpoint()
+        if checkpoint is not None:
+            checkpoint.start_attempt()
         try:
-            # user_id is passed if the agent_signature requires it.
-            result = await self.agent(**kwargs, lm=self.lm, user_id=user_id)
+            self.usage.record_call()
+            # The LM is passed per call; user_id is passed if the agent_signature requires it.
+            # Each LM request holds one of the loop's in-flight slots (see llm_pool.with_loop_client)
+            if self.hedge is None:
+                call = self.agent(**kwargs, lm=self.lm, user_id=user_id)
+            else:
+                # With thread execution a cancelled loser still finishes in its worker thread
+                call = self.hedge.run(
+                    lambda: self.agent(**kwargs, lm=self.lm, user_id=user_id),
+                    lambda: self.agent(**kwargs, lm=self.backup_lm, user_id=user_id),
+                )
+            result = await call
         except Exception as e:
             log.error(f"Error in run: {str(e)}")
             raise e
-        return result
\ No newline at end of file
+        finally:
+            self._trim_history()
+        return result
+
+    def _trim_history(self):
+        """Drop old LM call and predictor trace records, which hold every prompt and input image."""
+        keep = global_config.llm_config.history_size
+        for lm in (self.lm, self.backup_lm):
+            if lm is not None:
+                del lm.history[: max(len(lm.history) - keep, 0)]
+        del GLOBAL_HISTORY[: max(len(GLOBAL_HISTORY) - keep, 0)]
+        # Every Predict call appends (predictor, inputs, prediction) to the trace, for optimizers
+        trace = dspy.settings.trace
+        if trace:
+            del trace[: max(len(trace) - keep, 0)]
\ No newline at end of file
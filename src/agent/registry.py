@@ -0,0 +1,46 @@
+import threading
+from typing import Callable
+
+import dspy
+
+from global_config import global_config
+from src.agent.react_agent import ReactAgent
+
+_agents: dict[tuple, ReactAgent] = {}
+_agents_lock = threading.Lock()
+
+
+def get_agent(
+    agent_signature: type[dspy.Signature],
+    tools: list[Callable] = [],
+    model_name: str = global_config.agent.chat_agent_model,
+) -> ReactAgent:
+    """
+    Return the process-wide ReactAgent for (signature, model, tools), building it once.
+
+    Construction (LM client, Langfuse callback, ReAct program, async wrapper) is
+    synchronous, so holding a thread lock also makes this safe across asyncio tasks.
+    """
+    key = (agent_signature, model_name, tuple(tools))
+    with _agents_lock:
+        agent = _agents.get(key)
+        if agent is None:
+            agent = ReactAgent(
+                agent_signature=agent_signature,
+                tools=list(tools),
+                model_name=model_name,
+            )
+            _agents[key] = agent
+        return agent
+
+
+def registered_agents() -> list[ReactAgent]:
+    """Every agent built so far, e.g. to total their usage."""
+    with _agents_lock:
+        return list(_agents.values())
+
+
+def clear_agents() -> None:
+    """Forget every registered agent, e.g. after changing global_config at runtime."""
+    with _agents_lock:
+        _agents.clear()
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import dspy
+from PIL import Image as PILImage
+
+from global_config import global_config
+from src.utils.photo_store import pixel_hash
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def fingerprint(value: Any) -> Any:
+    """
+    Reduce an agent input to a small JSON-serialisable form that identifies its content.
+
+    Images are reduced to a hash of their pixels (or of their encoded URL), so the
+    same photo hits the cache however it was loaded.
+    """
+    if isinstance(value, PILImage.Image):
+        return {"image": pixel_hash(value)}
+    if isinstance(value, dspy.Image):
+        return {"image": _sha256(value.url)}
+    if isinstance(value, dspy.Example):  # Includes dspy.Prediction
+        return fingerprint(value.toDict())
+    if isinstance(value, dict):
+        return {str(k): fingerprint(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [fingerprint(v) for v in value]
+    if isinstance(value, str) and len(value) > 256:
+        # Long texts such as system prompts are keyed by a hash of their content (prompt version)
+        return {"text": _sha256(value)}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return repr(value)
+
+
+def signature_fingerprint(signature: type[dspy.Signature]) -> dict:
+    """Identify a signature by its instructions and field definitions."""
+    return {
+        "name": signature.__name__,
+        "instructions": signature.instructions,
+        "inputs": {n: f.json_schema_extra.get("desc") for n, f in signature.input_fields.items()},
+        "outputs": {
+            n: [str(f.annotation), f.json_schema_extra.get("desc")]
+            for n, f in signature.output_fields.items()
+        },
+    }
+
+
+class ResultCache:
+    """
+    Durable SQLite cache of agent results.
+
+    Entries are keyed by a hash of the signature, model, sampling settings, the
+    agent's strategy and hedging backup model, and content fingerprints of every
+    input. Entries older than `ttl_seconds` are
+    treated as misses, and the least recently used entries are evicted once
+    there are more than `max_entries`. `clock` gives the current time in seconds
+    (time.time by default) and can be replaced in tests.
+    """
+
+    def __init__(
+        self,
+        path: str = global_config.llm_cache.path,
+        ttl_seconds: Optional[int] = global_config.llm_cache.ttl_seconds,
+        max_entries: Optional[int] = global_config.llm_cache.max_entries,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                outputs TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def key(
+        signature: type[dspy.Signature],
+        model_name: str,
+        lm_kwargs: dict,
+        inputs: dict,
+        strategy: Optional[str] = None,
+        backup_model: Optional[str] = None,
+    ) -> str:
+        payload = {
+            "signature": signature_fingerprint(signature),
+            "model": model_name,
+            "strategy": strategy,
+            "backup_model": backup_model,
+            "temperature": lm_kwargs.get("temperature"),
+            "max_tokens": lm_kwargs.get("max_tokens"),
+            "inputs": fingerprint(inputs),
+        }
+        return _sha256(json.dumps(payload, sort_keys=True, default=str))
+
+    def get(self, key: str) -> Optional[dict]:
+        now = self.clock()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT outputs, created_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE results SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, outputs: dict) -> None:
+        now = self.clock()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                (key, json.dumps(outputs, default=str), now, now),
+            )
+            if self.max_entries:
+                self._conn.execute(
+                    """
+                    DELETE FROM results WHERE key IN (
+                        SELECT key FROM results ORDER BY accessed_at DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_entries,),
+                )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def metrics(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "entries": len(self),
+        }
+
+
+_result_cache: Optional[ResultCache] = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """Process-wide ResultCache shared by every ReactAgent."""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache()
+        return _result_cache
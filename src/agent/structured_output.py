@@ -0,0 +1,210 @@
+import threading
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Optional, Union, get_args
+
+import dspy
+import json_repair
+import litellm
+import pydantic
+import regex
+from dspy.adapters.utils import parse_value
+from loguru import logger as log
+
+
+@lru_cache(maxsize=None)
+def response_format(signature: type[dspy.Signature], fields: Optional[frozenset[str]] = None) -> dict:
+    """
+    Provider response_format asking for a JSON object with the signature's output
+    `fields` (all of them when None), typed by their annotations. Every field is
+    required; Optional ones may be null.
+    """
+    model = pydantic.create_model(
+        signature.__name__,
+        **{
+            name: (field.annotation, ...)
+            for name, field in signature.output_fields.items()
+            if fields is None or name in fields
+        },
+    )
+    return {"type": "json_schema", "json_schema": {"name": signature.__name__, "schema": model.model_json_schema()}}
+
+
+def _is_optional(annotation) -> bool:
+    return type(None) in get_args(annotation)
+
+
+def _text(output: Union[str, dict]) -> str:
+    return output["text"] if isinstance(output, dict) else output
+
+
+class StructuredOutputStats:
+    """Completions a StructuredOutputAdapter parsed and the fields that failed validation."""
+
+    def __init__(self):
+        self.completions = 0
+        # Completions with at least one missing or invalid field in the first answer
+        self.failed_completions = 0
+        self.field_failures: Counter = Counter()
+        self.field_retries = 0
+        # Fields still invalid after every retry, left null
+        self.unrecovered_fields: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, failed: set[str] = frozenset(), retries: int = 0, unrecovered: set[str] = frozenset()) -> None:
+        with self._lock:
+            self.completions += 1
+            self.failed_completions += bool(failed)
+            self.field_failures.update(failed)
+            self.field_retries += retries
+            self.unrecovered_fields.update(unrecovered)
+
+    def report(self) -> dict:
+        with self._lock:
+            completions = max(self.completions, 1)
+            return {
+                "completions": self.completions,
+                "parse_failure_rate": self.failed_completions / completions,
+                "field_failure_rates": {field: count / completions for field, count in self.field_failures.items()},
+                "field_retries": self.field_retries,
+                "unrecovered_fields": dict(self.unrecovered_fields),
+            }
+
+
+class StructuredOutputAdapter(dspy.JSONAdapter):
+    """
+    JSONAdapter that sends the signature's output schema as the provider's response_format
+    and validates each field on its own.
+
+    dspy's adapters fail a whole completion when one field does not parse (the chat
+    adapter then repeats the entire request in JSON mode). Here the fields that validated
+    are kept, and the model is asked again, in the same conversation, for just the ones
+    that did not, up to `max_field_retries` times. Optional fields still invalid after
+    that are left null; a required one fails the call.
+    """
+
+    def __init__(self, max_field_retries: int = 1, callbacks=None):
+        super().__init__(callbacks)
+        self.max_field_retries = max_field_retries
+        self.stats = StructuredOutputStats()
+
+    def _lm_kwargs(
+        self, lm: dspy.LM, lm_kwargs: dict, signature: type[dspy.Signature], fields: Optional[frozenset[str]] = None
+    ) -> dict:
+        _, provider, _, _ = litellm.get_llm_provider(lm.model)
+        params = litellm.get_supported_openai_params(model=lm.model, custom_llm_provider=provider) or []
+        if "response_format" not in params:
+            # The prompt still asks for a JSON object; it is just not enforced
+            return lm_kwargs
+        return {**lm_kwargs, "response_format": response_format(signature, fields)}
+
+    def parse_fields(
+        self, signature: type[dspy.Signature], completion: str, fields
+    ) -> tuple[dict[str, Any], dict[str, str]]:
+        """Values of `fields` that validated against their annotations, and why each other one did not."""
+        match = regex.search(r"\{(?:[^{}]|(?R))*\}", completion, regex.DOTALL)
+        answer = json_repair.loads(match.group(0) if match else completion)
+        if not isinstance(answer, dict):
+            answer = {}
+        values, errors = {}, {}
+        for name in fields:
+            if name not in answer:
+                errors[name] = "missing"
+                continue
+            try:
+                values[name] = parse_value(answer[name], signature.output_fields[name].annotation)
+            except (ValueError, TypeError) as e:
+                errors[name] = str(e).splitlines()[0] if str(e) else type(e).__name__
+        return values, errors
+
+    def _follow_up(self, completion: str, errors: dict[str, str]) -> list[dict]:
+        """Messages asking the model to answer just the fields in `errors` again."""
+        problems = "\n".join(f"- `{name}`: {error}" for name, error in errors.items())
+        return [
+            {"role": "assistant", "content": completion},
+            {
+                "role": "user",
+                "content": (
+                    f"These fields of your answer were missing or invalid:\n{problems}\n\n"
+                    "Respond with a JSON object with only these fields: "
+                    + ", ".join(f"`{name}`" for name in errors)
+                    + "."
+                ),
+            },
+        ]
+
+    def _finish(self, signature: type[dspy.Signature], values: dict, failed: set[str], retries: int, errors: dict) -> dict:
+        self.stats.record(failed=failed, retries=retries, unrecovered=set(errors))
+        required = [name for name in errors if not _is_optional(signature.output_fields[name].annotation)]
+        if required:
+            raise ValueError(f"{signature.__name__}: invalid output fields {', '.join(required)}: {errors}")
+        if errors:
+            log.warning(f"{signature.__name__}: leaving invalid output fields null: {errors}")
+        return {**values, **{name: None for name in errors}}
+
+    def _completions(self, lm, lm_kwargs, signature, demos, inputs):
+        """
+        Parse each completion, asking again for the fields that did not validate.
+
+        A generator shared by the sync and async calls: it yields every LM request as
+        (messages, lm kwargs), is sent back that request's outputs, and returns the
+        parsed completions.
+        """
+        messages = self.format(signature, demos, inputs)
+        outputs = yield messages, self._lm_kwargs(lm, lm_kwargs, signature)
+        completions = []
+        for output in outputs:
+            completion = _text(output)
+            values, errors = self.parse_fields(signature, completion, signature.output_fields)
+            failed, history, retries = set(errors), messages, 0
+            while errors and retries < self.max_field_retries:
+                retries += 1
+                history = history + self._follow_up(completion, errors)
+                fields = frozenset(errors)
+                retry_kwargs = self._lm_kwargs(lm, {**lm_kwargs, "n": 1}, signature, fields)
+                completion = _text((yield history, retry_kwargs)[0])
+                retried, errors = self.parse_fields(signature, completion, fields)
+                values.update(retried)
+            completions.append(self._finish(signature, values, failed, retries, errors))
+        return completions
+
+    def __call__(self, lm, lm_kwargs, signature, demos, inputs) -> list[dict[str, Any]]:
+        steps = self._completions(lm, lm_kwargs, signature, demos, inputs)
+        messages, kwargs = next(steps)
+        while True:
+            try:
+                messages, kwargs = steps.send(lm(messages=messages, **kwargs))
+            except StopIteration as done:
+                return done.value
+
+    async def acall(self, lm, lm_kwargs, signature, demos, inputs) -> list[dict[str, Any]]:
+        steps = self._completions(lm, lm_kwargs, signature, demos, inputs)
+        messages, kwargs = next(steps)
+        while True:
+            try:
+                messages, kwargs = steps.send(await lm.acall(messages=messages, **kwargs))
+            except StopIteration as done:
+                return done.value
+
+
+class StructuredPredict(dspy.Predict):
+    """
+    dspy.Predict that always goes through its own StructuredOutputAdapter.
+
+    dspy reads the adapter from its thread-local settings, which concurrent agents on one
+    event loop would share and overwrite; each agent keeps its own here instead.
+    """
+
+    def __init__(self, signature, max_field_retries: int = 1, **config):
+        super().__init__(signature, **config)
+        self.adapter = StructuredOutputAdapter(max_field_retries)
+
+    def forward(self, **kwargs):
+        lm, config, signature, demos, kwargs = self._forward_preprocess(**kwargs)
+        completions = self.adapter(lm, lm_kwargs=config, signature=signature, demos=demos, inputs=kwargs)
+        return self._forward_postprocess(completions, signature, **kwargs)
+
+    async def aforward(self, **kwargs):
+        lm, config, signature, demos, kwargs = self._forward_preprocess(**kwargs)
+        completions = await self.adapter.acall(lm, lm_kwargs=config, signature=signature, demos=demos, inputs=kwargs)
+        return self._forward_postprocess(completions, signature, **kwargs)
@@ -0,0 +1,214 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Optional
+
+import dspy
+from litellm import ContextWindowExceededError
+from loguru import logger as log
+
+# CheckpointedReAct reimplements the step loop of this dspy version's ReAct; check the two
+# still match before moving to another one
+DSPY_VERSION = "2.6.23"
+assert dspy.__version__ == DSPY_VERSION, (
+    f"CheckpointedReAct follows dspy {DSPY_VERSION}'s ReAct loop, found dspy {dspy.__version__}"
+)
+
+
+class TrajectoryCheckpoint:
+    """
+    The ReAct steps one agent run has completed, kept across its retry attempts.
+
+    A step is checkpointed once its LM call and tool call have both finished, so a retry
+    after a provider error resumes from the last completed step instead of replaying the
+    whole thought/action loop. Tokens are counted per step to report what a resume saved.
+    """
+
+    def __init__(self):
+        self.trajectory: dict[str, Any] = {}
+        self.steps = 0
+        self.attempts = 0
+        # Tokens of the LM calls behind the checkpointed steps, and of calls since the last one
+        self.step_tokens = 0
+        self._unsaved_tokens = 0
+        # Over the retries so far: steps not replayed, and their tokens not paid again
+        self.resumed_steps = 0
+        self.saved_tokens = 0
+        self._lock = threading.Lock()
+
+    def start_attempt(self) -> None:
+        with self._lock:
+            self.attempts += 1
+            # The failed attempt's unfinished step is lost; the checkpointed ones are not
+            self._unsaved_tokens = 0
+            if self.attempts > 1:
+                self.resumed_steps += self.steps
+                self.saved_tokens += self.step_tokens
+
+    def add_tokens(self, tokens: int) -> None:
+        with self._lock:
+            self._unsaved_tokens += tokens
+
+    def resume(self) -> tuple[dict[str, Any], int]:
+        """A copy of the checkpointed trajectory and the number of steps in it."""
+        with self._lock:
+            return dict(self.trajectory), self.steps
+
+    def save(self, trajectory: dict[str, Any], steps: int) -> None:
+        with self._lock:
+            # Hedged runs share the checkpoint; keep whichever got further
+            if steps <= self.steps:
+                return
+            self.trajectory = dict(trajectory)
+            self.steps = steps
+            self.step_tokens += self._unsaved_tokens
+            self._unsaved_tokens = 0
+
+
+_checkpoint: ContextVar[Optional[TrajectoryCheckpoint]] = ContextVar("trajectory_checkpoint", default=None)
+
+
+def current_checkpoint() -> Optional[TrajectoryCheckpoint]:
+    return _checkpoint.get()
+
+
+@contextmanager
+def trajectory_checkpoint():
+    """Checkpoint the steps of CheckpointedReAct programs run in this context, e.g. one agent run and its retries."""
+    checkpoint = TrajectoryCheckpoint()
+    token = _checkpoint.set(checkpoint)
+    try:
+        yield checkpoint
+    finally:
+        _checkpoint.reset(token)
+
+
+class CheckpointStats:
+    """Retries of an agent's ReAct runs and how much of their trajectories they resumed."""
+
+    def __init__(self):
+        self.runs = 0
+        self.retries = 0
+        # Retries that resumed after at least one completed step
+        self.resumed_retries = 0
+        self.resumed_steps = 0
+        self.saved_tokens = 0
+        self._lock = threading.Lock()
+
+    def record(self, checkpoint: TrajectoryCheckpoint) -> None:
+        with self._lock:
+            self.runs += 1
+            self.retries += max(checkpoint.attempts - 1, 0)
+            self.resumed_retries += bool(checkpoint.resumed_steps)
+            self.resumed_steps += checkpoint.resumed_steps
+            self.saved_tokens += checkpoint.saved_tokens
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "retries": self.retries,
+                "resumed_retries": self.resumed_retries,
+                "resumed_steps": self.resumed_steps,
+                "saved_tokens": self.saved_tokens,
+            }
+
+
+class CheckpointedReAct(dspy.ReAct):
+    """
+    dspy.ReAct that starts from the current TrajectoryCheckpoint and checkpoints each
+    completed step. Without a checkpoint in context it behaves like dspy.ReAct.
+    """
+
+    @staticmethod
+    def _resume() -> tuple[dict[str, Any], int]:
+        checkpoint = _checkpoint.get()
+        if checkpoint is None:
+            return {}, 0
+        trajectory, steps = checkpoint.resume()
+        if steps:
+            log.info(f"Resuming ReAct trajectory after {steps} completed steps")
+        return trajectory, steps
+
+    @staticmethod
+    def _save(trajectory: dict[str, Any], steps: int) -> None:
+        checkpoint = _checkpoint.get()
+        if checkpoint is not None:
+            checkpoint.save(trajectory, steps)
+
+    @staticmethod
+    def _finished(trajectory: dict[str, Any], steps: int) -> bool:
+        return steps > 0 and trajectory.get(f"tool_name_{steps - 1}") == "finish"
+
+    @staticmethod
+    def _record_step(trajectory: dict[str, Any], idx: int, pred: dspy.Prediction) -> None:
+        trajectory[f"thought_{idx}"] = pred.next_thought
+        trajectory[f"tool_name_{idx}"] = pred.next_tool_name
+        trajectory[f"tool_args_{idx}"] = pred.next_tool_args
+
+    def _call(self, module: dspy.Module, trajectory: dict[str, Any], input_args: dict):
+        """Yield the call of `module` on the trajectory, dropping its oldest step while it overflows the context window."""
+        for _ in range(3):
+            try:
+                return (yield module, {**input_args, "trajectory": self._format_trajectory(trajectory)})
+            except ContextWindowExceededError:
+                log.warning("Trajectory exceeded the context window, truncating the oldest tool call information.")
+                trajectory = self.truncate_trajectory(trajectory)
+
+    def _steps(self, input_args: dict):
+        """
+        The ReAct loop, resumed from the current checkpoint and checkpointing each step.
+
+        A generator shared by the sync and async calls: it yields every module or tool
+        call as (callable, kwargs), is sent back its result or has its error thrown in,
+        and returns the final Prediction.
+        """
+        trajectory, start = self._resume()
+        max_iters = input_args.pop("max_iters", self.max_iters)
+        for idx in range(start, max_iters) if not self._finished(trajectory, start) else ():
+            try:
+                pred = yield from self._call(self.react, trajectory, input_args)
+            except ValueError as err:
+                log.warning(f"Ending the trajectory: Agent failed to select a valid tool: {err!r}")
+                break
+
+            self._record_step(trajectory, idx, pred)
+            try:
+                trajectory[f"observation_{idx}"] = yield self.tools[pred.next_tool_name], pred.next_tool_args
+            except Exception as err:
+                trajectory[f"observation_{idx}"] = f"Execution error in {pred.next_tool_name}: {err!r}"
+            self._save(trajectory, idx + 1)
+
+            if pred.next_tool_name == "finish":
+                break
+
+        extract = yield from self._call(self.extract, trajectory, input_args)
+        return dspy.Prediction(trajectory=trajectory, **extract)
+
+    def forward(self, **input_args):
+        steps = self._steps(input_args)
+        call, kwargs = next(steps)
+        while True:
+            try:
+                try:
+                    result = call(**kwargs)
+                except Exception as err:
+                    call, kwargs = steps.throw(err)
+                else:
+                    call, kwargs = steps.send(result)
+            except StopIteration as done:
+                return done.value
+
+    async def aforward(self, **input_args):
+        steps = self._steps(input_args)
+        call, kwargs = next(steps)
+        while True:
+            try:
+                try:
+                    result = await call.acall(**kwargs)
+                except Exception as err:
+                    call, kwargs = steps.throw(err)
+                else:
+                    call, kwargs = steps.send(result)
+            except StopIteration as done:
+                return done.value
@@ -0,0 +1,261 @@
+import asyncio
+import dataclasses
+import hashlib
+import json
+import os
+import time
+from enum import Enum
+from typing import Callable, Optional
+
+from langfuse.decorators import observe
+from loguru import logger as log
+
+from global_config import global_config
+from src.agent.registry import registered_agents
+from src.algo.cascade import cascade_stats
+from src.algo.feature_extract import analyze_profile, load_prompt
+from src.algo.incremental import ProfileAnalysisStore, Revisit
+from src.mobile_api.api import ProfileInfo
+from src.models.profile import Profile
+from src.utils.photo_store import PhotoStore
+
+
+def run_key(model: Optional[str] = None) -> str:
+    """
+    Identify the analysis setup a batch result was produced with.
+
+    Changing a prompt, the model, the ROI stage, the cascade, CPU pre-analysis, how photo
+    analyses are aggregated or how outputs are parsed changes the key, so a checkpoint from
+    an earlier setup does not stop profiles from being re-scored. `model` stands in for
+    agent.chat_agent_model, e.g. for results re-scored by the batch API's model.
+    """
+    agent = global_config.agent
+    setup = {
+        "photo_prompt": load_prompt("photo"),
+        "profile_prompt": load_prompt("profile"),
+        "model": model or agent.chat_agent_model,
+        "roi": global_config.roi.mode if global_config.roi.enabled else "full",
+        "cascade": vars(agent.cascade) if agent.cascade.enabled else None,
+        "pre_analysis": vars(global_config.pre_analysis) if global_config.pre_analysis.enabled else None,
+        "aggregation": global_config.aggregation,
+        "output_mode": agent.output_mode,
+        "structured_output": agent.structured_output if agent.output_mode == "structured" else None,
+    }
+    return hashlib.sha256(json.dumps(setup, sort_keys=True, default=vars).encode()).hexdigest()
+
+
+def profile_to_dict(profile: Profile) -> dict:
+    """JSON-friendly form of a Profile."""
+
+    def convert(value):
+        if isinstance(value, Enum):
+            return value.value
+        if isinstance(value, dict):
+            return {k: convert(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [convert(v) for v in value]
+        if hasattr(value, "isoformat"):
+            return value.isoformat()
+        return value
+
+    return convert(dataclasses.asdict(profile))
+
+
+def load_profile_info(fields: Optional[dict]) -> ProfileInfo:
+    profile_info = ProfileInfo()
+    for name, value in (fields or {}).items():
+        setattr(profile_info, name, value)
+    return profile_info
+
+
+class BatchCheckpoint:
+    """Profiles already analysed under a given run key, persisted after every profile."""
+
+    def __init__(self, path: str = global_config.batch.checkpoint_path, key: Optional[str] = None):
+        self.path = path
+        self.key = key or run_key()
+        self.completed: set[str] = set()
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                saved = json.load(f)
+            if saved.get("run_key") == self.key:
+                self.completed = set(saved["completed"])
+
+    def __contains__(self, profile_id: str) -> bool:
+        return profile_id in self.completed
+
+    def mark(self, profile_id: str) -> None:
+        self.completed.add(profile_id)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"run_key": self.key, "completed": sorted(self.completed)}, f)
+        os.replace(tmp_path, self.path)
+
+
+class JsonlProfileSink:
+    """Appends one JSON line per analysed profile as soon as it completes."""
+
+    def __init__(self, path: str = global_config.batch.output_path, key: Optional[str] = None):
+        self.path = path
+        self.key = key
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def __call__(self, profile_id: str, profile: Profile) -> None:
+        record = {"profile_id": profile_id, "run_key": self.key, "profile": profile_to_dict(profile)}
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+@dataclasses.dataclass
+class BatchReport:
+    profiles: int = 0
+    failed: int = 0
+    partial: int = 0
+    skipped: int = 0
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    elapsed_seconds: float = 0.0
+
+    def per_minute(self) -> dict:
+        minutes = max(self.elapsed_seconds, 1e-9) / 60
+        return {
+            "profiles_per_min": self.profiles / minutes,
+            "tokens_per_min": (self.prompt_tokens + self.completion_tokens) / minutes,
+            "cost_per_min": self.cost / minutes,
+        }
+
+
+def _usage_totals() -> dict[int, tuple]:
+    return {
+        id(agent): (
+            agent.usage.prompt_tokens,
+            agent.usage.completion_tokens,
+            agent.usage.cost,
+            agent.usage.cached_prompt_tokens,
+        )
+        for agent in registered_agents()
+    }
+
+
+def _add_usage(report: BatchReport, before: dict[int, tuple]) -> None:
+    """Add LM usage since `before` across every registered agent, including new ones."""
+    for agent_id, totals in _usage_totals().items():
+        start = before.get(agent_id, (0, 0, 0.0, 0))
+        report.prompt_tokens += totals[0] - start[0]
+        report.completion_tokens += totals[1] - start[1]
+        report.cost += totals[2] - start[2]
+        report.cached_prompt_tokens += totals[3] - start[3]
+
+
+@observe()
+async def run_batch(
+    store: PhotoStore,
+    sink: Callable[[str, Profile], None],
+    checkpoint: BatchCheckpoint,
+    profile_ids: Optional[list[str]] = None,
+    max_concurrent_profiles: Optional[int] = None,
+) -> BatchReport:
+    """
+    Analyse many archived profiles in one event loop.
+
+    Profiles run concurrently up to `max_concurrent_profiles`; their photo and
+    aggregation calls all draw on the same per-loop LM budget
+    (llm_config.concurrency.max_in_flight) and decoded-image budget. Each result
+    goes to `sink` and is then checkpointed, so an interrupted batch resumes
+    where it stopped. Failed profiles, and partial ones cut short by
+    analysis.deadline_seconds, are logged and left for the next run.
+    With incremental.enabled, a profile analysed before under the same run key only
+    has its new photos analysed.
+    """
+    profile_ids = store.profile_ids() if profile_ids is None else profile_ids
+    pending = [pid for pid in profile_ids if pid not in checkpoint]
+    report = BatchReport(skipped=len(profile_ids) - len(pending))
+    profile_slots = asyncio.Semaphore(max_concurrent_profiles or global_config.batch.max_concurrent_profiles)
+    usage_before = _usage_totals()
+    analyses = ProfileAnalysisStore(key=checkpoint.key) if global_config.incremental.enabled else None
+    start = time.perf_counter()
+
+    async def analyze_one(profile_id: str):
+        async with profile_slots:
+            try:
+                profile = await analyze_profile(
+                    store.paths(profile_id),
+                    load_profile_info(store.profile_info(profile_id)),
+                    revisit=Revisit(analyses, profile_id) if analyses is not None else None,
+                )
+            except Exception as e:
+                report.failed += 1
+                log.warning(f"Batch analysis of {profile_id} failed: {e}")
+                return
+            sink(profile_id, profile)
+            if profile.partial:
+                report.partial += 1
+            else:
+                checkpoint.mark(profile_id)
+            report.profiles += 1
+            elapsed_minutes = (time.perf_counter() - start) / 60
+            log.info(
+                f"[{report.profiles}/{len(pending)}] {profile_id} done "
+                f"({report.profiles / elapsed_minutes:.1f} profiles/min)"
+            )
+
+    await asyncio.gather(*(analyze_one(profile_id) for profile_id in pending))
+
+    report.elapsed_seconds = time.perf_counter() - start
+    _add_usage(report, usage_before)
+    return report
+
+
+async def main():
+    store = PhotoStore()
+    key = run_key()
+    report = await run_batch(store, JsonlProfileSink(key=key), BatchCheckpoint(key=key))
+    rates = report.per_minute()
+
+    print(f"\nBatch analysis: {report.profiles} analysed, {report.skipped} already done, {report.failed} failed, {report.partial} partial")
+    print(f"  elapsed: {report.elapsed_seconds:.1f}s")
+    print(f"  profiles/min: {rates['profiles_per_min']:.1f}")
+    print(f"  tokens/min: {rates['tokens_per_min']:.0f}")
+    print(
+        f"  input tokens: {report.cached_prompt_tokens} cached, "
+        f"{report.prompt_tokens - report.cached_prompt_tokens} uncached"
+    )
+    print(f"  cost/min: ${rates['cost_per_min']:.4f}")
+    print(f"  results: {global_config.batch.output_path}")
+    if global_config.agent.cascade.enabled:
+        cascade = cascade_stats.report()
+        print(f"\nModel cascade over {cascade['photos']} photos:")
+        for model_name, tier in cascade["tiers"].items():
+            rates = ", ".join(
+                f"{field} {rate:.0%}" for field, rate in sorted(tier["field_escalation_rates"].items())
+            )
+            print(f"  {model_name}: {tier['photo_escalation_rate']:.0%} of photos, ${tier['cost']:.4f}")
+            if rates:
+                print(f"    fields: {rates}")
+    if global_config.agent.output_mode == "structured":
+        print("\nStructured output:")
+        for agent in registered_agents():
+            if agent.output_stats is None or not agent.output_stats.completions:
+                continue
+            output = agent.output_stats.report()
+            print(
+                f"  {agent.signature.__name__} ({agent.lm.model}): "
+                f"{output['parse_failure_rate']:.0%} of answers had invalid fields, "
+                f"{output['field_retries']} field retries, "
+                f"{agent.usage.per_call()['completion_tokens_per_call']:.0f} output tokens/call"
+            )
+    for agent in registered_agents():
+        if agent.checkpoint_stats is None or not agent.checkpoint_stats.retries:
+            continue
+        checkpoints = agent.checkpoint_stats.report()
+        print(
+            f"\nReAct retries ({agent.signature.__name__}): {checkpoints['retries']} retries, "
+            f"{checkpoints['resumed_steps']} steps resumed, {checkpoints['saved_tokens']} tokens not re-paid"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
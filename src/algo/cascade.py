@@ -0,0 +1,165 @@
+import asyncio
+import statistics
+import threading
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Awaitable, Callable, Optional
+
+import dspy
+
+from global_config import global_config
+from src.agent.registry import registered_agents
+
+UNCERTAIN_FIELD = "uncertain_fields"
+
+
+@lru_cache(maxsize=None)
+def cascade_signature(
+    signature: type[dspy.Signature], fields: Optional[frozenset[str]] = None
+) -> type[dspy.Signature]:
+    """
+    `signature` restricted to the output `fields` (all of them when None), plus a list
+    of the fields the model is not confident about. Cached, so every photo asking
+    for the same fields shares one registered agent.
+    """
+    cascaded = signature
+    if fields is not None:
+        for name in signature.output_fields:
+            if name not in fields:
+                cascaded = cascaded.delete(name)
+    return cascaded.append(
+        UNCERTAIN_FIELD,
+        dspy.OutputField(desc="Names of the output fields above you are not confident about"),
+        type_=list[str],
+    )
+
+
+def _normalize(value):
+    return value.strip().lower() if isinstance(value, str) else value
+
+
+def _disagreements(analyses: list[Optional[dict]]) -> list[set[str]]:
+    """Per photo, the person-level fields whose value disagrees with most other photos."""
+    cascade = global_config.agent.cascade
+    flagged = [set() for _ in analyses]
+    for field in cascade.consistent_fields:
+        values = [
+            (i, analysis[field])
+            for i, analysis in enumerate(analyses)
+            if analysis is not None and analysis.get(field) is not None
+        ]
+        if len(values) < cascade.min_photos_for_agreement:
+            continue
+        if field == "age":
+            median = statistics.median(value for _, value in values)
+            outliers = [i for i, value in values if abs(value - median) > cascade.age_tolerance]
+        else:
+            majority, count = Counter(_normalize(value) for _, value in values).most_common(1)[0]
+            if count * 2 <= len(values):
+                # No majority to disagree with
+                continue
+            outliers = [i for i, value in values if _normalize(value) != majority]
+        for i in outliers:
+            flagged[i].add(field)
+    return flagged
+
+
+def fields_to_escalate(analyses: list[Optional[dict]], output_fields: list[str]) -> list[set[str]]:
+    """
+    Per photo, the output fields the next tier should answer: every field when the
+    photo's analysis failed, required fields left null, fields the model marked as
+    uncertain, and person-level fields that disagree with the profile's other photos.
+    """
+    required = set(global_config.agent.cascade.required_fields)
+    flagged = []
+    for analysis, disagreeing in zip(analyses, _disagreements(analyses)):
+        if analysis is None:
+            flagged.append(set(output_fields))
+            continue
+        fields = {f for f in required if analysis.get(f) is None}
+        fields |= set(analysis.get(UNCERTAIN_FIELD) or [])
+        fields |= disagreeing
+        flagged.append(fields & set(output_fields))
+    return flagged
+
+
+class CascadeStats:
+    """Photos analysed by the cascade and how often each tier was asked for each field."""
+
+    def __init__(self):
+        self.photos = 0
+        # model name -> photos escalated to it, and how often each field was
+        self.escalated_photos: Counter = Counter()
+        self.escalated_fields: dict[str, Counter] = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def record(self, photos: int = 0, model_name: Optional[str] = None, fields: list[set[str]] = ()) -> None:
+        with self._lock:
+            self.photos += photos
+            for photo_fields in fields:
+                self.escalated_photos[model_name] += bool(photo_fields)
+                self.escalated_fields[model_name].update(photo_fields)
+
+    def report(self) -> dict:
+        """Escalation rate per tier and field, and the LM cost spent on each tier so far."""
+        cost = Counter()
+        for agent in registered_agents():
+            if UNCERTAIN_FIELD in agent.signature.output_fields:
+                cost[agent.lm.model] += agent.usage.cost
+        with self._lock:
+            photos = max(self.photos, 1)
+            tiers = global_config.agent.cascade.tiers
+            return {
+                "photos": self.photos,
+                "tiers": {
+                    model_name: {
+                        "photo_escalation_rate": self.escalated_photos[model_name] / photos,
+                        "field_escalation_rates": {
+                            field: count / photos
+                            for field, count in self.escalated_fields[model_name].items()
+                        },
+                        "cost": cost[model_name],
+                    }
+                    for model_name in tiers
+                },
+            }
+
+
+cascade_stats = CascadeStats()
+
+
+async def escalate(
+    analyses: list[Optional[dspy.Prediction]],
+    analyze_photo: Callable[[int, str, frozenset[str]], Awaitable[Optional[dspy.Prediction]]],
+    output_fields: list[str],
+) -> list[Optional[dspy.Prediction]]:
+    """
+    Run the cascade's stronger tiers over the first tier's photo analyses.
+
+    `analyze_photo(i, model_name, fields)` re-analyses photo `i` on one tier for just
+    `fields`. Each tier answers the fields flagged after the previous one; its answers
+    replace the cheaper tier's. Photos whose analysis failed on every tier stay None.
+    """
+    tiers = global_config.agent.cascade.tiers
+    current = [analysis.toDict() if analysis is not None else None for analysis in analyses]
+    cascade_stats.record(photos=len(current))
+
+    for model_name in tiers[1:]:
+        flagged = fields_to_escalate(current, output_fields)
+        if not any(flagged):
+            break
+        cascade_stats.record(model_name=model_name, fields=flagged)
+        escalated = await asyncio.gather(*(
+            analyze_photo(i, model_name, frozenset(fields)) if fields else asyncio.sleep(0)
+            for i, fields in enumerate(flagged)
+        ))
+        for i, (fields, result) in enumerate(zip(flagged, escalated)):
+            if not fields or result is None:
+                continue
+            answers = {f: result.get(f) for f in fields}
+            current[i] = {**(current[i] or {}), **answers, UNCERTAIN_FIELD: result.get(UNCERTAIN_FIELD)}
+
+    return [
+        dspy.Prediction(**{f: analysis.get(f) for f in output_fields}) if analysis is not None else None
+        for analysis in current
+    ]
@@ -1,14 +1,30 @@
 import dspy
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Literal, Annotated
+import pydantic
 from src.models.profile import Profile, DatingStyle, Lifestyle, Education, PhotoAnalysis
-from src.agent.react_agent import ReactAgent
+from src.agent.registry import get_agent
+from src.agent.react_agent import TokenUsage, usage_scope
 from datetime import datetime
 from PIL import Image
 import glob
 import os
 import asyncio
-from langfuse.decorators import observe
+import weakref
+import numpy as np
+from langfuse.decorators import langfuse_context, observe
 from src.mobile_api.api import ProfileInfo
+from src.algo.roi import detect_faces, prepare_photo_inputs
+from src.algo.cascade import cascade_signature, escalate
+from src.algo.pre_analysis import HINTS_FIELD, PreAnalysisStats, pre_analysis_signature, pre_analyze, split_estimates
+from src.algo.incremental import Revisit, inputs_key
+from src.algo.photo_summary import should_summarize, summarize_photos
+from src.utils.photo_store import pixel_hash
+from global_config import global_config
+from loguru import logger as log
+
+def _one_of(values: tuple[str, ...]):
+    """Literal of lowercase `values` that also accepts them in other cases, e.g. 'Active' for text-mode answers."""
+    return Annotated[Literal[values], pydantic.BeforeValidator(lambda v: v.strip().lower() if isinstance(v, str) else v)]
 
 class InferPhotoFeatures(dspy.Signature):
     """Analyze a single profile photo and extract features."""
@@ -33,6 +49,11 @@ class InferPhotoFeatures(dspy.Signature):
     personality_traits: Optional[list[str]] = dspy.OutputField(desc="Inferred personality traits from the photo")
 
 
+class InferPhotoFeaturesWithFace(InferPhotoFeatures):
+    """Analyze a single profile photo and extract features. `image` is a low-resolution view of the whole photo and `face_image` a high-resolution crop of the person's face or body."""
+    face_image: dspy.Image = dspy.InputField(desc="High-resolution crop of the person in the photo")
+
+
 class InferProfileFeatures(dspy.Signature):
     """Aggregate features from all photos and profile data to infer overall profile characteristics."""
     system_prompt: str = dspy.InputField(desc="System prompt for the agent")
@@ -51,18 +72,40 @@ class InferProfileFeatures(dspy.Signature):
     # Lifestyle and preferences
     party_frequency: Optional[int] = dspy.OutputField(desc="Party frequency (1-5 scale)")
     drug_usage: Optional[int] = dspy.OutputField(desc="Drug usage level (1-5 scale)")
-    dating_style: Optional[str] = dspy.OutputField(desc="Dating style (traditional, casual, adventurous)")
-    lifestyle: Optional[str] = dspy.OutputField(desc="Lifestyle (active, relaxed, party, intellectual)")
+    dating_style: Optional[_one_of(tuple(style.value for style in DatingStyle))] = dspy.OutputField(desc="Dating style (traditional, casual, adventurous)")
+    lifestyle: Optional[_one_of(tuple(lifestyle.value for lifestyle in Lifestyle))] = dspy.OutputField(desc="Lifestyle (active, relaxed, party, intellectual)")
     
     # Inferred attributes
     inferred_interests: Optional[list[str]] = dspy.OutputField(desc="Combined list of inferred interests")
     inferred_personality_traits: Optional[list[str]] = dspy.OutputField(desc="Combined list of inferred personality traits")
 
 
+class InferProfileFeaturesFromSummary(InferProfileFeatures):
+    """Aggregate features from all photos and profile data to infer overall profile characteristics. `photo_analyses` summarises every photo's analysis: yes/no counts, numeric medians and ranges, and the most common values and list items with the number of photos showing each."""
+    photo_analyses: dict = dspy.InputField(desc="Photo analyses merged across all photos")
+
+
+PROMPT_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "prompts", "feature_extractor.txt")
+
+# prompt_type -> (mtime of the prompts file it was read at, prompt)
+_prompts: dict[str, tuple[Optional[int], str]] = {}
+
+
 def load_prompt(prompt_type: str) -> str:
-    """Load the appropriate prompt from the prompts file."""
-    prompt_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), "prompts", "feature_extractor.txt")
-    
+    """Load the appropriate prompt from the prompts file, re-reading it only after it changes."""
+    try:
+        mtime = os.stat(PROMPT_FILE).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    cached = _prompts.get(prompt_type)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    prompt = _read_prompt(PROMPT_FILE, prompt_type)
+    _prompts[prompt_type] = (mtime, prompt)
+    return prompt
+
+
+def _read_prompt(prompt_file: str, prompt_type: str) -> str:
     # Default prompts in case file is missing
     default_photo_prompt = """You are an expert at analyzing profile photos and extracting meaningful features. For each photo, analyze:
 1. Physical attributes (freckles, hair color, piercings, makeup)
@@ -93,6 +136,16 @@ Be thorough but objective in your analysis. Only infer information that you can
         # Return default prompts if file is missing or malformed
         return default_photo_prompt if prompt_type == "photo" else default_profile_prompt
 
+_image_budgets: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _image_budget() -> asyncio.Semaphore:
+    """Process-wide cap on decoded photos held in memory, shared by every running analysis."""
+    loop = asyncio.get_running_loop()
+    if loop not in _image_budgets:
+        _image_budgets[loop] = asyncio.Semaphore(global_config.analysis.max_decoded_images)
+    return _image_budgets[loop]
+
 def map_relationship_to_dating_style(relationship_type: Optional[str]) -> DatingStyle:
     """Map relationship type from the API to a DatingStyle enum value."""
     if not relationship_type:
@@ -110,10 +163,147 @@ def map_relationship_to_dating_style(relationship_type: Optional[str]) -> Dating
     else:
         return DatingStyle.UNKNOWN
 
+class _Deadline:
+    """
+    One profile's latency budget, cutting analysis steps short when it runs out.
+    Without a budget (None) every step runs to completion.
+    """
+
+    def __init__(self, seconds: Optional[float]):
+        self._loop = asyncio.get_running_loop()
+        self.end = self._loop.time() + seconds if seconds is not None else None
+        self.cut_short = False
+
+    def left(self, reserve: float = 0.0) -> Optional[float]:
+        """Seconds until `reserve` seconds before the end, None without a budget."""
+        if self.end is None:
+            return None
+        return max(0.0, self.end - reserve - self._loop.time())
+
+    async def gather(self, tasks: list[asyncio.Task], reserve: float = 0.0) -> list:
+        """Results of `tasks` in order; tasks still running `reserve` seconds before the end are cancelled and give None."""
+        if not tasks:
+            return []
+        done, pending = await asyncio.wait(tasks, timeout=self.left(reserve))
+        for task in pending:
+            task.cancel()
+        if pending:
+            self.cut_short = True
+            await asyncio.gather(*pending, return_exceptions=True)
+        return [task.result() if task in done else None for task in tasks]
+
+    async def run(self, awaitable, reserve: float = 0.0, on_timeout=None):
+        """Await `awaitable` until `reserve` seconds before the end, then cancel it and return `on_timeout`."""
+        try:
+            return await asyncio.wait_for(awaitable, self.left(reserve))
+        except TimeoutError:
+            # A TimeoutError raised inside the awaitable is not the budget running out
+            if self.end is None or self.left(reserve) > 0:
+                raise
+            self.cut_short = True
+            return on_timeout
+
+def _prepare_photo(image: Image.Image, roi_mode: str, estimate: bool) -> tuple[dict, dict]:
+    """
+    CPU stage of a photo analysis, run off the event loop: the ROI image inputs and,
+    if `estimate`, the pre-analysis estimates, detecting the photo's faces only once.
+    """
+    faces = detect_faces(np.asarray(image.convert("L"))) if estimate and roi_mode != "full" else None
+    photo_inputs = prepare_photo_inputs(image, roi_mode, faces=faces)
+    return photo_inputs, pre_analyze(image, faces=faces) if estimate else {}
+
+
+def _photo_analyzer(
+    max_concurrent_photos: Optional[int] = None,
+    pre_analysis_stats: Optional[PreAnalysisStats] = None,
+    revisit: Optional[Revisit] = None,
+):
+    """Build a coroutine function analysing one photo path, returning None if it fails."""
+    # Optional CPU-only ROI stage: tighten each photo around its subject before the LLM call
+    roi_mode = global_config.roi.mode if global_config.roi.enabled else "full"
+    cascade = global_config.agent.cascade
+    pre_analysis = global_config.pre_analysis
+
+    async def analyze_photo(path: str, model_name: Optional[str] = None, fields: Optional[frozenset[str]] = None):
+        """Decode one photo only while it is being analysed, then release it."""
+        async with _image_budget():
+            image = Image.open(path)
+            try:
+                image.load()
+                if revisit is not None and fields is None:
+                    # Revisited profile: a photo with the same pixels as last time keeps its analysis
+                    stored = revisit.stored_photo(path, pixel_hash(image))
+                    if stored is not None:
+                        return stored
+                photo_inputs, estimates = await asyncio.to_thread(
+                    _prepare_photo, image, roi_mode, pre_analysis.enabled
+                )
+                signature = InferPhotoFeaturesWithFace if "face_image" in photo_inputs else InferPhotoFeatures
+                if cascade.enabled:
+                    # Cheapest tier first, asked to name the fields it is unsure of; see _cascade
+                    signature = cascade_signature(signature, fields)
+                    model_name = model_name or cascade.tiers[0]
+                answers, hints = {}, {}
+                if pre_analysis.enabled:
+                    # Optional CPU estimates: confident ones answer their field instead of the LLM,
+                    # the rest are hints. A cascade escalation asking for given fields only gets hints
+                    answers, hints = split_estimates(estimates, signature.output_fields, skip=fields is None)
+                    signature = pre_analysis_signature(signature, frozenset(answers), bool(hints))
+                    if pre_analysis_stats is not None and fields is None:
+                        pre_analysis_stats.record(list(answers), list(hints))
+                # Reuse the process-wide ReactAgent for this signature and model
+                agent = get_agent(
+                    agent_signature=signature,
+                    model_name=model_name or global_config.agent.chat_agent_model
+                )
+                result = await agent.run(
+                    user_id="",  # No user context needed
+                    system_prompt=load_prompt("photo"),
+                    **photo_inputs,
+                    **({HINTS_FIELD: hints} if hints else {}),
+                )
+                return dspy.Prediction(**answers, **result.toDict()) if answers else result
+            finally:
+                image.close()
+    
+    # Analyze photos concurrently; each call keeps its own retry policy inside ReactAgent.run
+    photo_slots = asyncio.Semaphore(max_concurrent_photos or global_config.analysis.max_concurrent_photos)
+
+    async def analyze_photo_isolated(path: str, model_name: Optional[str] = None, fields: Optional[frozenset[str]] = None):
+        async with photo_slots:
+            try:
+                return await analyze_photo(path, model_name, fields)
+            except Exception as e:
+                log.warning(f"Skipping photo {path} after failed analysis: {e}")
+                return None
+
+    return analyze_photo_isolated
+
+async def _cascade(profile_images: list[str], results: list, analyze_photo, revisit: Optional[Revisit] = None) -> list:
+    """
+    With agent.cascade enabled, escalate doubtful fields of the first tier's analyses to stronger tiers.
+    Analyses reused from a revisited profile's last analysis already went through the cascade.
+    """
+    if not global_config.agent.cascade.enabled:
+        return results
+    fresh = [i for i, path in enumerate(profile_images) if revisit is None or path not in revisit.reused]
+    escalated = await escalate(
+        [results[i] for i in fresh],
+        lambda i, model_name, fields: analyze_photo(profile_images[fresh[i]], model_name, fields),
+        list(InferPhotoFeatures.output_fields),
+    )
+    results = list(results)
+    for i, result in zip(fresh, escalated):
+        results[i] = result
+    return results
+
 @observe()
 async def analyze_profile(
     profile_images: list[str],
     profile_info: ProfileInfo,
+    max_concurrent_photos: Optional[int] = None,
+    revisit: Optional[Revisit] = None,
+    deadline_seconds: Optional[float] = None,
 ) -> Profile:
     """
     Analyze a Hinge profile using both profile images and profile information.
@@ -121,29 +311,121 @@ async def analyze_profile(
     Args:
         profile_images: List of paths to profile images
         profile_info: Profile information from the API
+        max_concurrent_photos: Override for analysis.max_concurrent_photos
+        revisit: The profile's stored previous analysis, to analyse only new photos and
+            re-aggregate only when the aggregation's inputs changed (see src.algo.incremental)
+        deadline_seconds: Override for analysis.deadline_seconds, the latency budget
     
     Returns:
-        Profile object with analyzed features
+        Profile object with analyzed features, marked partial if the budget ran out
     """
-    # Load images as PIL Images
-    images = [Image.open(path) for path in profile_images]
-    
-    # Initialize the ReactAgent with our InferPhotoFeatures signature for individual photo analysis
-    photo_agent = ReactAgent(
-        agent_signature=InferPhotoFeatures,
-        model_name="gemini/gemini-2.0-flash"
+    pre_analysis = PreAnalysisStats()
+    analyze_photo = _photo_analyzer(max_concurrent_photos, pre_analysis, revisit)
+    deadline = _Deadline(deadline_seconds if deadline_seconds is not None else global_config.analysis.deadline_seconds)
+
+    with usage_scope() as tokens:
+        photo_tasks = [asyncio.create_task(analyze_photo(path)) for path in profile_images]
+        profile = await _aggregate_photos(profile_images, photo_tasks, profile_info, analyze_photo, revisit, deadline)
+    _report_tokens(profile, tokens, pre_analysis=pre_analysis, revisit=revisit)
+    return profile
+
+@observe()
+async def analyze_profile_stream(
+    photo_queue: "asyncio.Queue[Optional[str]]",
+    profile_info: ProfileInfo,
+    max_concurrent_photos: Optional[int] = None,
+    revisit: Optional[Revisit] = None,
+    deadline_seconds: Optional[float] = None,
+) -> Profile:
+    """
+    Analyze a profile whose photos are still being captured.
+
+    Each path put on `photo_queue` is analysed as soon as it arrives; a `None` marks
+    the end of capture. Aggregation starts once the last photo's analysis completes.
+    `profile_info` is only read at that point, so the producer may keep filling it in
+    while it scrolls. The latency budget (`deadline_seconds`, else
+    analysis.deadline_seconds) counts from the end of capture.
+
+    Returns:
+        Profile object with analyzed features, photos in arrival order, marked partial
+        if the budget ran out
+    """
+    pre_analysis = PreAnalysisStats()
+    analyze_photo = _photo_analyzer(max_concurrent_photos, pre_analysis, revisit)
+
+    paths, photo_tasks = [], []
+    with usage_scope() as tokens:
+        while (path := await photo_queue.get()) is not None:
+            paths.append(path)
+            photo_tasks.append(asyncio.create_task(analyze_photo(path)))
+
+        deadline = _Deadline(deadline_seconds if deadline_seconds is not None else global_config.analysis.deadline_seconds)
+        profile = await _aggregate_photos(paths, photo_tasks, profile_info, analyze_photo, revisit, deadline)
+    _report_tokens(profile, tokens, pre_analysis=pre_analysis, revisit=revisit)
+    return profile
+
+async def _aggregate_photos(
+    paths: list[str],
+    photo_tasks: list[asyncio.Task],
+    profile_info: ProfileInfo,
+    analyze_photo,
+    revisit: Optional[Revisit],
+    deadline: _Deadline,
+) -> Profile:
+    """
+    Wait for the photo analyses, escalate them through the cascade and aggregate them.
+    Photo analyses and cascade escalations still running when only the aggregation's
+    reserve of the budget is left are cancelled, and the profile is built from the rest.
+    """
+    reserve = global_config.analysis.aggregation_reserve_seconds
+    # Results stay in input order; failed and cancelled photos are dropped from aggregation
+    results = await deadline.gather(photo_tasks, reserve)
+    results = await deadline.run(_cascade(paths, results, analyze_photo, revisit), reserve, on_timeout=results)
+    if revisit is not None:
+        revisit.keep_photos(paths, results)
+    photo_analyses = [result for result in results if result is not None]
+    if deadline.cut_short:
+        log.warning(
+            f"Latency budget ran out: aggregating {len(photo_analyses)} of {len(paths)} photos"
+        )
+    profile = await _synthesize_profile(photo_analyses, profile_info, revisit, deadline)
+    profile.partial = deadline.cut_short
+    return profile
+
+def _report_tokens(
+    profile: Profile,
+    tokens: TokenUsage,
+    pre_analysis: Optional[PreAnalysisStats] = None,
+    revisit: Optional[Revisit] = None,
+) -> None:
+    """
+    Log how much of a profile's prompt input the provider served from its prompt cache,
+    how many output fields the CPU pre-analysis answered instead of the LLM, and what a
+    revisit reused from the profile's previous analysis.
+    """
+    input_tokens = {
+        "cached": tokens.cached_prompt_tokens,
+        "uncached": tokens.uncached_prompt_tokens,
+        "completion": tokens.completion_tokens,
+    }
+    log.info(
+        f"Profile {profile.name or '<unnamed>'} input tokens: "
+        f"{input_tokens['cached']} cached, {input_tokens['uncached']} uncached"
     )
-    
-    # Analyze each photo individually
-    photo_analyses = []
-    for image in images:
-        result = await photo_agent.run(
-            user_id="",  # No user context needed
-            system_prompt=load_prompt("photo"),
-            image=image
+    metadata = {"tokens": input_tokens}
+    if pre_analysis is not None and pre_analysis.photos:
+        metadata["pre_analysis"] = pre_analysis.report()
+        log.info(
+            f"Profile {profile.name or '<unnamed>'}: pre-analysis answered "
+            f"{pre_analysis.avoided_output_fields} LLM output fields over {pre_analysis.photos} photos"
         )
-        photo_analyses.append(result)
-    
+    if revisit is not None:
+        metadata["revisit"] = revisit.report()
+        log.info(f"Profile {profile.name or '<unnamed>'} revisit: {metadata['revisit']}")
+    langfuse_context.update_current_observation(metadata=metadata)
+
+def aggregation_request(photo_analyses: list, profile_info: ProfileInfo) -> tuple[type[dspy.Signature], dict, dict]:
+    """The aggregation's signature and inputs, and the profile information as a dictionary."""
     # Convert ProfileInfo to dictionary
     profile_dict = {
         "name": profile_info.name,
@@ -160,20 +442,55 @@ async def analyze_profile(
         "prompts": profile_info.prompts
     }
     
-    # Initialize the ReactAgent with our InferProfileFeatures signature for overall analysis
-    profile_agent = ReactAgent(
-        agent_signature=InferProfileFeatures,
-        model_name="gemini/gemini-2.0-flash"
-    )
-    
-    # Run the overall profile analysis
-    profile_result = await profile_agent.run(
-        user_id="",  # No user context needed
-        system_prompt=load_prompt("profile"),
-        photo_analyses=photo_analyses,
-        profile_info=profile_dict
-    )
-    
+    # Past a few photos, merge their analyses locally so the prompt stays the same size
+    summarize = should_summarize(len(photo_analyses))
+    aggregation_inputs = {
+        "system_prompt": load_prompt("profile"),
+        "photo_analyses": (
+            summarize_photos(photo_analyses, InferPhotoFeatures.output_fields) if summarize else photo_analyses
+        ),
+        "profile_info": profile_dict,
+    }
+    return (InferProfileFeaturesFromSummary if summarize else InferProfileFeatures), aggregation_inputs, profile_dict
+
+async def _synthesize_profile(
+    photo_analyses: list,
+    profile_info: ProfileInfo,
+    revisit: Optional[Revisit] = None,
+    deadline: Optional[_Deadline] = None,
+) -> Profile:
+    """
+    Aggregate per-photo analyses and profile information into a Profile. On a revisit,
+    the stored aggregation is reused when the photo analyses, profile information and
+    prompt are all unchanged. If `deadline` runs out first, the Profile is built from
+    the photos and profile information alone.
+    """
+    signature, aggregation_inputs, profile_dict = aggregation_request(photo_analyses, profile_info)
+    aggregation_key = inputs_key(**aggregation_inputs) if revisit is not None else None
+    profile_result = revisit.stored_aggregation(aggregation_key, profile_dict) if revisit is not None else None
+
+    if profile_result is None:
+        # Reuse the process-wide ReactAgent with our InferProfileFeatures signature for overall analysis
+        profile_agent = get_agent(
+            agent_signature=signature,
+            model_name=global_config.agent.chat_agent_model
+        )
+
+        # Run the overall profile analysis
+        aggregation = profile_agent.run(
+            user_id="",  # No user context needed
+            **aggregation_inputs
+        )
+        profile_result = await (deadline.run(aggregation) if deadline is not None else aggregation)
+        if profile_result is None:
+            log.warning("Latency budget ran out before the profile aggregation finished")
+            profile_result = dspy.Prediction(**dict.fromkeys(InferProfileFeatures.output_fields))
+        elif revisit is not None:
+            revisit.save(aggregation_key, profile_result)
+    return build_profile(photo_analyses, profile_info, profile_result)
+
+def build_profile(photo_analyses: list, profile_info: ProfileInfo, profile_result: dspy.Prediction) -> Profile:
+    """Combine photo analyses, profile information and the aggregation's outputs into a Profile."""
     # Convert photo analyses to PhotoAnalysis objects
     photo_objects = [
         PhotoAnalysis(
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+from typing import Any, Iterator, Optional
+
+import dspy
+
+from global_config import global_config
+from src.agent.result_cache import fingerprint
+from src.utils.photo_store import _write_json_atomic
+
+
+def inputs_key(**inputs: Any) -> str:
+    """Hash of an agent's inputs by content, e.g. to tell whether an aggregation would change."""
+    return hashlib.sha256(json.dumps(fingerprint(inputs), sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ProfileAnalysisStore:
+    """
+    The last analysis of each profile, for incremental re-analysis when it comes round again.
+
+    One JSON file per profile under `root` holds its photo analyses by pixel hash, the
+    profile information it was captured with, and the aggregation's inputs hash and
+    outputs. Records written under a different `key` (e.g. batch.run_key() of another
+    prompt or model) are ignored.
+    """
+
+    def __init__(self, root: str = global_config.incremental.root, key: Optional[str] = None):
+        self.root = root
+        self.key = key
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, profile_id: str) -> str:
+        return os.path.join(self.root, f"{profile_id}.json")
+
+    def get(self, profile_id: str) -> Optional[dict]:
+        path = self.path(profile_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            record = json.load(f)
+        return record if record.get("key") == self.key else None
+
+    def put(self, profile_id: str, record: dict) -> None:
+        _write_json_atomic(self.path(profile_id), {**record, "key": self.key})
+
+    def records(self) -> Iterator[tuple[str, dict]]:
+        """Every stored (profile_id, record), whatever key it was written under."""
+        for name in sorted(os.listdir(self.root)):
+            if name.endswith(".json"):
+                with open(os.path.join(self.root, name), "r") as f:
+                    yield name[: -len(".json")], json.load(f)
+
+
+class Revisit:
+    """
+    One analysis of a profile against its stored previous analysis.
+
+    Photos whose pixel hash was analysed last time are reused as they are, and the
+    aggregation is reused when its inputs hash as they did. `save` then stores this
+    capture's analysis, so photos dropped from the profile are forgotten.
+    """
+
+    def __init__(self, store: ProfileAnalysisStore, profile_id: str):
+        self.store = store
+        self.profile_id = profile_id
+        self.previous = store.get(profile_id) or {}
+        # path -> pixel hash of every photo in this capture, and the paths served from the store
+        self.hashes: dict[str, str] = {}
+        self.reused: set[str] = set()
+        self.photos: dict[str, dict] = {}
+        self.profile_info: dict = {}
+        self.aggregation_reused = False
+
+    def stored_photo(self, path: str, photo_hash: str) -> Optional[dspy.Prediction]:
+        """The stored analysis of a photo, if it was analysed last time."""
+        self.hashes[path] = photo_hash
+        analysis = self.previous.get("photos", {}).get(photo_hash)
+        if analysis is None:
+            return None
+        self.reused.add(path)
+        return dspy.Prediction(**analysis)
+
+    def keep_photos(self, paths: list[str], results: list[Optional[dspy.Prediction]]) -> None:
+        """Remember this capture's final photo analyses; failed photos are retried next time."""
+        for path, result in zip(paths, results):
+            if result is not None and path in self.hashes:
+                self.photos[self.hashes[path]] = result.toDict()
+
+    def stored_aggregation(self, key: str, profile_info: dict) -> Optional[dspy.Prediction]:
+        """
+        The stored aggregation outputs, if its inputs hashed to `key` last time. This
+        capture's `profile_info` is recorded either way, for `save` and `report`.
+        """
+        self.profile_info = profile_info
+        aggregation = self.previous.get("aggregation") or {}
+        if aggregation.get("inputs") != key:
+            return None
+        self.aggregation_reused = True
+        return dspy.Prediction(**aggregation["outputs"])
+
+    def save(self, aggregation_key: str, aggregation: dspy.Prediction) -> None:
+        self.store.put(self.profile_id, {
+            "photos": self.photos,
+            "profile_info": self.profile_info,
+            "aggregation": {"inputs": aggregation_key, "outputs": aggregation.toDict()},
+        })
+
+    def report(self) -> dict:
+        """What changed since the stored analysis and how much of it was reused."""
+        previous_info = self.previous.get("profile_info") or {}
+        return {
+            "photos": len(self.hashes),
+            "reused_photos": len(self.reused),
+            "new_photos": len(self.hashes) - len(self.reused),
+            "changed_profile_fields": sorted(
+                name for name in set(previous_info) | set(self.profile_info)
+                if previous_info.get(name) != self.profile_info.get(name)
+            ) if self.previous else [],
+            "aggregation_reused": self.aggregation_reused,
+        }
@@ -0,0 +1,71 @@
+import statistics
+from collections import Counter
+from typing import Any, Optional, Union, get_args, get_origin
+
+import dspy
+from pydantic.fields import FieldInfo
+
+from global_config import global_config
+
+
+def _base_type(annotation):
+    """The type inside Optional[...]."""
+    if get_origin(annotation) is Union:
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        return args[0] if len(args) == 1 else annotation
+    return annotation
+
+
+def _top(counter: Counter, limit: int) -> dict[Any, int]:
+    # most_common keeps first-seen order among ties, so the summary is deterministic
+    return dict(counter.most_common(limit))
+
+
+def summarize_field(values: list, annotation) -> Optional[Any]:
+    """
+    Merge one output field across photos, by its type:
+
+    - bool: how many photos said yes and no
+    - int/float: median and range
+    - list: items deduplicated case-insensitively, with how many photos named each
+    - str and anything else: the most common values, long texts cut short
+    """
+    summary = global_config.aggregation.summary
+    values = [value for value in values if value is not None]
+    if not values:
+        return None
+    base = _base_type(annotation)
+    if base is bool:
+        return {"yes": sum(1 for v in values if v), "no": sum(1 for v in values if not v)}
+    if base in (int, float) and all(isinstance(v, (int, float)) for v in values):
+        return {"median": statistics.median(values), "range": [min(values), max(values)]}
+    if get_origin(base) is list:
+        items = Counter()
+        for value in values:
+            # Count each item once per photo
+            items.update({str(item).strip().lower() for item in value if str(item).strip()})
+        return _top(items, summary.max_list_items)
+    texts = Counter(
+        text if len(text) <= summary.max_text_chars else text[: summary.max_text_chars].rstrip() + "…"
+        for text in (str(value).strip() for value in values)
+    )
+    return _top(texts, summary.max_values)
+
+
+def summarize_photos(photo_analyses: list[dspy.Prediction], output_fields: dict[str, FieldInfo]) -> dict:
+    """
+    Merge per-photo analyses into one summary whose size does not grow with the number
+    of photos: the reduce step of profile aggregation, done locally before the LLM call.
+    """
+    fields = {}
+    for name, field in output_fields.items():
+        merged = summarize_field([analysis.get(name) for analysis in photo_analyses], field.annotation)
+        if merged is not None:
+            fields[name] = merged
+    return {"photo_count": len(photo_analyses), "fields": fields}
+
+
+def should_summarize(photo_count: int) -> bool:
+    """Whether aggregation sends the merged summary instead of every photo analysis."""
+    aggregation = global_config.aggregation
+    return aggregation.mode == "summary" and photo_count > aggregation.summary.min_photos
@@ -0,0 +1,199 @@
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from functools import cached_property, lru_cache
+from typing import Any, Callable, Iterable, Optional
+
+import dspy
+import numpy as np
+from PIL import Image
+
+from global_config import global_config
+from src.algo.roi import detect_faces
+
+HINTS_FIELD = "hints"
+
+
+@dataclass(frozen=True)
+class Estimate:
+    """A CPU estimate of one photo field and how much to trust it, from 0 to 1."""
+    value: Any
+    confidence: float
+
+
+class PhotoPixels:
+    """A photo's pixel arrays, with detections computed once and shared by every estimator."""
+
+    def __init__(self, image: Image.Image, faces: Optional[list[tuple]] = None):
+        self.rgb = np.asarray(image.convert("RGB"))
+        self.hsv = np.asarray(image.convert("HSV")).astype(np.float32) / 255
+        if faces is not None:
+            self.faces = faces
+
+    @cached_property
+    def gray(self) -> np.ndarray:
+        return np.asarray(Image.fromarray(self.rgb).convert("L"))
+
+    @cached_property
+    def faces(self) -> list[tuple]:
+        return detect_faces(self.gray)
+
+
+Estimator = Callable[[PhotoPixels], Optional[Estimate]]
+
+# Field name -> function estimating it; pre_analysis.estimators picks which ones run
+ESTIMATORS: dict[str, Estimator] = {}
+
+
+def estimator(field: str) -> Callable[[Estimator], Estimator]:
+    """Register a CPU estimator for `field`."""
+    def register(estimate: Estimator) -> Estimator:
+        ESTIMATORS[field] = estimate
+        return estimate
+    return register
+
+
+@estimator("location_type")
+def estimate_location_type(photo: PhotoPixels) -> Optional[Estimate]:
+    """
+    Outdoor when the top of the photo is blue sky, indoor when it has neither sky nor
+    foliage anywhere. Sky is strong evidence; its absence is weak, since plenty of
+    outdoor photos are framed without it.
+    """
+    r, g, b = (photo.rgb[..., c].astype(np.int16) for c in range(3))
+    value = photo.hsv[..., 2]
+    sky = (b > r + 20) & (b >= g) & (value > 0.45)
+    foliage = (g > r + 10) & (g > b + 10)
+    top_sky = sky[: max(1, sky.shape[0] // 3)].mean()
+    if top_sky > 0.25:
+        return Estimate("outdoor", min(0.95, 0.6 + top_sky / 2))
+    if top_sky < 0.02 and foliage.mean() < 0.05:
+        return Estimate("indoor", 0.6)
+    return None
+
+
+def hair_labels(hsv: np.ndarray) -> np.ndarray:
+    """Coarse hair colour name for each HSV pixel (channels scaled to 0-1)."""
+    hue, saturation, value = hsv[..., 0] * 360, hsv[..., 1], hsv[..., 2]
+    labels = np.full(hue.shape, "brown", dtype=object)
+    labels[(value > 0.55) & (hue >= 25) & (hue < 65) & (saturation > 0.2)] = "blonde"
+    labels[((hue < 20) | (hue >= 340)) & (saturation > 0.6) & (value > 0.35)] = "red"
+    labels[(saturation < 0.15) & (value > 0.65)] = "gray"
+    labels[value < 0.2] = "black"
+    return labels
+
+
+@estimator("hair_color")
+def estimate_hair_color(photo: PhotoPixels) -> Optional[Estimate]:
+    """
+    Dominant colour of the band above the largest face. Pixels close to the face's own
+    colour are left out, so a forehead or bald head does not vote; confidence is the
+    share of the remaining pixels that agree.
+    """
+    if not photo.faces:
+        return None
+    x1, y1, x2, y2 = max(photo.faces, key=lambda f: (f[2] - f[0]) * (f[3] - f[1]))
+    height = y2 - y1
+    band = photo.hsv[max(0, y1 - int(0.4 * height)): y1 + int(0.1 * height), x1:x2].reshape(-1, 3)
+    skin = np.median(photo.hsv[y1 + height // 3: y2 - height // 3, x1:x2].reshape(-1, 3), axis=0)
+    band = band[np.abs(band - skin).sum(axis=1) > 0.15]
+    if len(band) < 50:
+        return None
+    names, counts = np.unique(hair_labels(band), return_counts=True)
+    best = counts.argmax()
+    return Estimate(str(names[best]), float(counts[best] / counts.sum()))
+
+
+@estimator("people_count")
+def estimate_people_count(photo: PhotoPixels) -> Optional[Estimate]:
+    """Number of frontal faces; profiles and turned heads go uncounted, so only a hint."""
+    if not photo.faces:
+        return None
+    return Estimate(len(photo.faces), 0.7)
+
+
+def pre_analyze(
+    image: Image.Image, fields: Optional[list[str]] = None, faces: Optional[list[tuple]] = None
+) -> dict[str, Estimate]:
+    """
+    Run the estimators for `fields` (pre_analysis.estimators when None) on one photo,
+    reusing its detect_faces boxes if the caller already has them.
+    """
+    photo = PhotoPixels(image, faces=faces)
+    estimates = {}
+    for field in fields if fields is not None else global_config.pre_analysis.estimators:
+        estimate = ESTIMATORS[field](photo)
+        if estimate is not None:
+            estimates[field] = estimate
+    return estimates
+
+
+def split_estimates(
+    estimates: dict[str, Estimate], output_fields, skip: bool = True
+) -> tuple[dict[str, Any], dict[str, dict]]:
+    """
+    (answers, hints): estimates confident enough to stand in for an output field the
+    LLM is then not asked for, and the rest worth passing to it as hints. With `skip`
+    False every usable estimate is a hint.
+    """
+    pre_analysis = global_config.pre_analysis
+    answers, hints = {}, {}
+    for field, estimate in estimates.items():
+        if skip and field in output_fields and estimate.confidence >= pre_analysis.skip_confidence:
+            answers[field] = estimate.value
+        elif estimate.confidence >= pre_analysis.hint_confidence:
+            hints[field] = {"value": estimate.value, "confidence": round(estimate.confidence, 2)}
+    return answers, hints
+
+
+@lru_cache(maxsize=None)
+def pre_analysis_signature(
+    signature: type[dspy.Signature], answered: frozenset[str], hinted: bool
+) -> type[dspy.Signature]:
+    """
+    `signature` without the output fields the pre-analysis `answered`, taking its hints
+    as an input when `hinted`. Cached, so photos with the same answered fields share
+    one registered agent.
+    """
+    restricted = signature
+    for name in answered:
+        restricted = restricted.delete(name)
+    if hinted:
+        restricted = restricted.append(
+            HINTS_FIELD,
+            dspy.InputField(
+                desc="Rough CPU estimates of some fields with confidences from 0 to 1; check them against the photo"
+            ),
+            type_=dict[str, dict],
+        )
+    return restricted
+
+
+class PreAnalysisStats:
+    """Output fields the CPU pre-analysis answered or hinted at, over one profile's photos."""
+
+    def __init__(self):
+        self.photos = 0
+        self.answered_fields: Counter = Counter()
+        self.hinted_fields: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, answered: Iterable[str], hinted: Iterable[str]) -> None:
+        with self._lock:
+            self.photos += 1
+            self.answered_fields.update(answered)
+            self.hinted_fields.update(hinted)
+
+    @property
+    def avoided_output_fields(self) -> int:
+        """LLM output fields the pre-analysis answered instead."""
+        return sum(self.answered_fields.values())
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "photos": self.photos,
+                "avoided_output_fields": self.avoided_output_fields,
+                "answered_fields": dict(self.answered_fields),
+                "hinted_fields": dict(self.hinted_fields),
+            }
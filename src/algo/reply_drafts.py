@@ -0,0 +1,96 @@
+import asyncio
+import os
+from typing import Optional
+
+import dspy
+from loguru import logger as log
+
+from global_config import global_config
+from src.agent.registry import get_agent
+from src.agent.result_cache import get_result_cache
+from src.mobile_api.api import HingeAPI, ProfileInfo, SubjectPair
+
+MY_DATA_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "prompts", "my_data.md")
+
+
+class DraftReplies(dspy.Signature):
+    """Draft opening messages to a dating profile, one set per subject (a prompt answer or a photo). Write as the person described in my_data: each reply picks up on its subject specifically, sounds natural and is one or two sentences long. Return the drafts for every subject id, best first."""
+    my_data: str = dspy.InputField(desc="About the person sending the replies")
+    profile_info: str = dspy.InputField(desc="Profile information of the person being replied to")
+    subjects: list[dict] = dspy.InputField(desc="Subjects to reply to, each with an id and its content")
+
+    drafts: dict[str, list[str]] = dspy.OutputField(desc="Reply drafts for each subject id, best first")
+
+
+def load_my_data() -> str:
+    try:
+        with open(MY_DATA_FILE, "r") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ""
+
+
+async def draft_replies(
+    subject_pairs: list[SubjectPair],
+    profile_info: ProfileInfo,
+    use_cache: bool = True,
+) -> dict[str, list[str]]:
+    """
+    Ranked reply drafts for every subject on a profile, keyed by SubjectPair.subject_id.
+
+    Subjects are drafted together, up to replies.max_subjects_per_call per LM call, rather
+    than one call each. Drafts are cached by subject content, the profile's information
+    and the user's my_data, so a revisited profile, or a subject seen again after
+    scrolling, needs no new call, while the same prompt on another profile is redrafted.
+    """
+    replies = global_config.replies
+    agent = get_agent(DraftReplies)
+    my_data = load_my_data()
+    cache = get_result_cache()
+
+    drafts: dict[str, list[str]] = {}
+    # cache key -> the pairs with that content, so repeated subjects are drafted once
+    missing: dict[str, list[SubjectPair]] = {}
+    for pair in subject_pairs:
+        key = agent.cache_key(
+            {"subject": pair.subject_content, "profile_info": vars(profile_info), "my_data": my_data}
+        )
+        cached = cache.get(key) if use_cache else None
+        if cached is not None:
+            drafts[pair.subject_id] = cached["drafts"]
+        else:
+            missing.setdefault(key, []).append(pair)
+
+    async def draft_batch(keys: list[str]):
+        result = await agent.run(
+            user_id="",
+            use_cache=False,
+            my_data=my_data,
+            profile_info=str(profile_info),
+            subjects=[{"id": str(i), "content": missing[key][0].subject_content} for i, key in enumerate(keys)],
+        )
+        answered = result.drafts or {}
+        for i, key in enumerate(keys):
+            texts = [str(text).strip() for text in answered.get(str(i)) or [] if str(text).strip()]
+            texts = texts[: replies.drafts_per_subject]
+            if not texts:
+                log.warning(f"No reply drafted for {missing[key][0]}")
+                continue
+            if use_cache:
+                cache.set(key, {"drafts": texts})
+            for pair in missing[key]:
+                drafts[pair.subject_id] = texts
+
+    keys = list(missing)
+    batch_size = replies.max_subjects_per_call
+    await asyncio.gather(*(draft_batch(keys[i : i + batch_size]) for i in range(0, len(keys), batch_size)))
+    return {pair.subject_id: drafts[pair.subject_id] for pair in subject_pairs if pair.subject_id in drafts}
+
+
+def submit_best_reply(api: HingeAPI, drafts: dict[str, list[str]], subject_id: Optional[str] = None) -> bool:
+    """Send the best draft through HingeAPI.submit_reply, for `subject_id` or else the first drafted subject."""
+    if subject_id is None:
+        subject_id = next(iter(drafts), None)
+    if not drafts.get(subject_id):
+        return False
+    return api.submit_reply(subject_id, drafts[subject_id][0])
@@ -0,0 +1,120 @@
+import asyncio
+import dataclasses
+import os
+import time
+from typing import Callable, Optional
+
+import dspy
+
+from global_config import global_config
+from src.agent.batch_api import BatchJobs, BatchRequest
+from src.algo.batch import JsonlProfileSink, load_profile_info, run_key
+from src.algo.feature_extract import aggregation_request, build_profile
+from src.algo.incremental import ProfileAnalysisStore, inputs_key
+from src.models.profile import Profile
+
+
+@dataclasses.dataclass
+class RescoreReport:
+    profiles: int = 0
+    up_to_date: int = 0
+    failed: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # The same tokens priced as interactive calls, and at the batch discount
+    interactive_cost: float = 0.0
+    batch_cost: float = 0.0
+    elapsed_seconds: float = 0.0
+
+    def per_profile(self) -> dict:
+        profiles = max(self.profiles, 1)
+        return {
+            "tokens_per_profile": (self.prompt_tokens + self.completion_tokens) / profiles,
+            "interactive_cost_per_profile": self.interactive_cost / profiles,
+            "batch_cost_per_profile": self.batch_cost / profiles,
+        }
+
+
+def rescored_store(analyses: ProfileAnalysisStore, model_name: str, key: Optional[str] = None) -> ProfileAnalysisStore:
+    """
+    Where re-scored records go: a `rescored` directory beside the stored analyses, under `key`
+    (by default the run key with `model_name` in place of the interactive model). The
+    interactive records are left as they were, so a revisit still reuses their photos.
+    """
+    return ProfileAnalysisStore(root=os.path.join(analyses.root, "rescored"), key=key or run_key(model=model_name))
+
+
+async def rescore_profiles(
+    analyses: ProfileAnalysisStore,
+    sink: Callable[[str, Profile], None],
+    jobs: Optional[BatchJobs] = None,
+    profile_ids: Optional[list[str]] = None,
+    store_key: Optional[str] = None,
+) -> RescoreReport:
+    """
+    Re-run the profile aggregation of stored analyses through the provider batch API.
+
+    Every profile in `analyses` (under whatever run key it was stored) whose aggregation
+    inputs changed since it was stored, e.g. after a prompt edit, is re-aggregated from
+    its stored photo analyses and profile information. All of them go in one batch job.
+    Each result goes to `sink` and to rescored_store(), not over the interactive record,
+    so the interactive pipeline neither reuses another model's aggregation nor loses its
+    photo analyses. A profile already re-scored from its current inputs is up to date.
+    Profiles whose answer failed or did not parse are logged and left as they were.
+    """
+    jobs = jobs or BatchJobs()
+    rescored = rescored_store(analyses, jobs.model_name, store_key)
+    report = RescoreReport()
+    start = time.perf_counter()
+
+    pending = {}
+    requests = []
+    for profile_id, record in analyses.records():
+        if profile_ids is not None and profile_id not in profile_ids:
+            continue
+        photo_analyses = [dspy.Prediction(**analysis) for analysis in record.get("photos", {}).values()]
+        profile_info = load_profile_info(record.get("profile_info"))
+        signature, inputs, _ = aggregation_request(photo_analyses, profile_info)
+        key = inputs_key(**inputs)
+        latest = rescored.get(profile_id) or record
+        if (latest.get("aggregation") or {}).get("inputs") == key:
+            report.up_to_date += 1
+            continue
+        pending[profile_id] = (record, photo_analyses, profile_info, key)
+        requests.append(BatchRequest(profile_id, signature, inputs))
+
+    results = await jobs.run(requests)
+    for profile_id, (record, photo_analyses, profile_info, key) in pending.items():
+        prediction = results.get(profile_id)
+        if prediction is None:
+            report.failed += 1
+            continue
+        rescored.put(profile_id, {**record, "aggregation": {"inputs": key, "outputs": prediction.toDict()}})
+        sink(profile_id, build_profile(photo_analyses, profile_info, prediction))
+        report.profiles += 1
+
+    report.prompt_tokens = jobs.usage.prompt_tokens
+    report.completion_tokens = jobs.usage.completion_tokens
+    report.interactive_cost = jobs.usage.interactive_cost
+    report.batch_cost = jobs.usage.batch_cost
+    report.elapsed_seconds = time.perf_counter() - start
+    return report
+
+
+async def main():
+    jobs = BatchJobs()
+    report = await rescore_profiles(ProfileAnalysisStore(), JsonlProfileSink(key=f"rescore:{jobs.model_name}"), jobs)
+    costs = report.per_profile()
+
+    print(f"\nBatch re-scoring: {report.profiles} re-scored, {report.up_to_date} up to date, {report.failed} failed")
+    print(f"  elapsed: {report.elapsed_seconds:.1f}s")
+    print(f"  tokens/profile: {costs['tokens_per_profile']:.0f}")
+    print(
+        f"  cost/profile: ${costs['batch_cost_per_profile']:.5f} batch vs "
+        f"${costs['interactive_cost_per_profile']:.5f} interactive ({jobs.model_name})"
+    )
+    print(f"  results: {global_config.batch.output_path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,183 @@
+import threading
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from global_config import global_config
+from src.agent.image_tokens import estimate_image_tokens
+
+try:
+    import cv2
+except ImportError:  # OpenCV is optional; fall back to the NumPy saliency map
+    cv2 = None
+
+
+def _union(boxes: list[tuple]) -> tuple:
+    return (
+        min(b[0] for b in boxes),
+        min(b[1] for b in boxes),
+        max(b[2] for b in boxes),
+        max(b[3] for b in boxes),
+    )
+
+
+# One set of detectors per thread: photos are prepared in worker threads,
+# and OpenCV does not promise a detector is safe to share between them
+_detectors = threading.local()
+
+
+def _face_cascade():
+    if not hasattr(_detectors, "face_cascade"):
+        # Haar cascades moved out of the main package in OpenCV 5
+        _detectors.face_cascade = (
+            cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+            if hasattr(cv2, "CascadeClassifier")
+            else None
+        )
+    return _detectors.face_cascade
+
+
+def _people_detector():
+    if not hasattr(_detectors, "people"):
+        hog = None
+        if hasattr(cv2, "HOGDescriptor"):
+            hog = cv2.HOGDescriptor()
+            hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+        _detectors.people = hog
+    return _detectors.people
+
+
+def detect_faces(gray: np.ndarray) -> list[tuple]:
+    """Frontal face boxes (x1, y1, x2, y2) in a grayscale image; empty without OpenCV's cascades."""
+    cascade = _face_cascade()
+    if cascade is None:
+        return []
+    min_side = max(24, min(gray.shape) // 12)
+    faces = cascade.detectMultiScale(
+        gray, scaleFactor=1.1, minNeighbors=5, minSize=(min_side, min_side)
+    )
+    return [(x, y, x + w, y + h) for x, y, w, h in faces]
+
+
+def _detect_people(rgb: np.ndarray) -> list[tuple]:
+    hog = _people_detector()
+    if hog is None:
+        return []
+    people, _ = hog.detectMultiScale(rgb, winStride=(8, 8))
+    return [(x, y, x + w, y + h) for x, y, w, h in people]
+
+
+def _saliency_box(gray: np.ndarray, energy_fraction: float = 0.9) -> Optional[tuple]:
+    """
+    Bounding box holding most of the image's gradient energy.
+
+    Photo-card backgrounds are flat, so edges concentrate on the subject.
+    """
+    gy, gx = np.gradient(gray.astype(np.float32))
+    energy = np.hypot(gx, gy)
+    total = energy.sum()
+    if total == 0:
+        return None
+
+    tail = (1 - energy_fraction) / 2
+
+    def span(profile: np.ndarray) -> tuple[int, int]:
+        cumulative = np.cumsum(profile) / total
+        start = int(np.searchsorted(cumulative, tail))
+        end = int(np.searchsorted(cumulative, 1 - tail)) + 1
+        return start, min(end, len(profile))
+
+    x1, x2 = span(energy.sum(axis=0))
+    y1, y2 = span(energy.sum(axis=1))
+    return (x1, y1, x2, y2)
+
+
+def detect_subject(
+    image: Image.Image, faces: Optional[list[tuple]] = None
+) -> tuple[Optional[tuple], Optional[tuple], str]:
+    """
+    Locate the subject of a photo on CPU.
+
+    `faces` are the photo's detect_faces boxes when the caller already has them.
+
+    Returns:
+        (subject_box, face_box, source) where boxes are (x1, y1, x2, y2) or None
+        and source names the detector that produced the subject box.
+    """
+    rgb = np.asarray(image.convert("RGB"))
+    gray = np.asarray(image.convert("L"))
+
+    if cv2 is not None:
+        if faces is None:
+            faces = detect_faces(gray)
+        people = _detect_people(rgb)
+        face_box = _union(faces) if faces else None
+        if people:
+            return _union(people + faces), face_box, "opencv_person"
+        if faces:
+            # Extend a face box down to roughly cover head and shoulders
+            x1, y1, x2, y2 = face_box
+            return (x1, y1, x2, min(gray.shape[0], y2 + 2 * (y2 - y1))), face_box, "opencv_face"
+
+    return _saliency_box(gray), None, "saliency"
+
+
+def expand_box(box: tuple, size: tuple[int, int], margin: float) -> tuple:
+    """Grow a box by `margin` of its own size on every side, clamped to the image."""
+    x1, y1, x2, y2 = box
+    dx = int((x2 - x1) * margin)
+    dy = int((y2 - y1) * margin)
+    width, height = size
+    return (max(0, x1 - dx), max(0, y1 - dy), min(width, x2 + dx), min(height, y2 + dy))
+
+
+def _fit(image: Image.Image, max_side: int) -> Image.Image:
+    if max(image.size) <= max_side:
+        return image
+    fitted = image.copy()
+    fitted.thumbnail((max_side, max_side), Image.LANCZOS)
+    return fitted
+
+
+def prepare_photo_inputs(
+    image: Image.Image,
+    mode: str = global_config.roi.mode,
+    margin: float = global_config.roi.margin,
+    faces: Optional[list[tuple]] = None,
+) -> dict:
+    """
+    Build the image inputs for InferPhotoFeatures according to the ROI mode.
+
+    Modes:
+        full:  the original crop, unchanged
+        tight: the crop tightened around the subject plus a margin
+        dual:  a low-resolution full image plus a high-resolution face crop
+               (or subject crop when no face is found), as `image` / `face_image`
+
+    `faces` are passed on to detect_subject.
+    """
+    if mode == "full":
+        return {"image": image}
+
+    subject_box, face_box, _ = detect_subject(image, faces)
+    subject = image.crop(expand_box(subject_box, image.size, margin)) if subject_box else image
+
+    if mode == "tight":
+        return {"image": subject}
+    if mode == "dual":
+        detail = image.crop(expand_box(face_box, image.size, margin)) if face_box else subject
+        return {
+            "image": _fit(image, global_config.roi.low_res_side),
+            "face_image": _fit(detail, global_config.roi.high_res_side),
+        }
+    raise ValueError(f"Unknown ROI mode: {mode}")
+
+
+def input_tokens(photo_inputs: dict) -> int:
+    """Estimated image tokens for a set of photo inputs."""
+    return sum(
+        estimate_image_tokens(value.size)
+        for value in photo_inputs.values()
+        if isinstance(value, Image.Image)
+    )
@@ -0,0 +1,103 @@
+import asyncio
+import glob
+
+from PIL import Image
+from langfuse.decorators import observe
+from loguru import logger as log
+
+from global_config import global_config
+from src.agent.registry import get_agent
+from src.algo.feature_extract import (
+    InferPhotoFeatures,
+    InferPhotoFeaturesWithFace,
+    load_prompt,
+)
+from src.algo.roi import input_tokens, prepare_photo_inputs
+
+MODES = ("full", "tight", "dual")
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return value.strip().lower()
+    if isinstance(value, list):
+        return frozenset(_normalize(v) for v in value)
+    return value
+
+
+def field_agreement(baseline, candidate) -> dict[str, bool]:
+    """Per output field, whether `candidate` matches the full-image `baseline`."""
+    return {
+        field: _normalize(getattr(baseline, field, None))
+        == _normalize(getattr(candidate, field, None))
+        for field in InferPhotoFeatures.output_fields
+    }
+
+
+@observe()
+async def compare_roi_modes(photo_paths: list[str]) -> dict[str, dict]:
+    """
+    Run every photo through each ROI mode and compare against the full image.
+
+    Returns, per mode, the estimated image tokens and the fraction of photos on
+    which each output field agrees with the `full` baseline.
+    """
+    agents = {
+        "single": get_agent(agent_signature=InferPhotoFeatures),
+        "dual": get_agent(agent_signature=InferPhotoFeaturesWithFace),
+    }
+    report = {mode: {"tokens": 0, "agreement": {}} for mode in MODES}
+    results = {mode: [] for mode in MODES}
+
+    for path in photo_paths:
+        with Image.open(path) as image:
+            image.load()
+            for mode in MODES:
+                photo_inputs = prepare_photo_inputs(image, mode)
+                agent = agents["dual" if "face_image" in photo_inputs else "single"]
+                report[mode]["tokens"] += input_tokens(photo_inputs)
+                results[mode].append(
+                    await agent.run(
+                        user_id="",
+                        system_prompt=load_prompt("photo"),
+                        **photo_inputs,
+                    )
+                )
+
+    for mode in MODES:
+        matches = [
+            field_agreement(baseline, candidate)
+            for baseline, candidate in zip(results["full"], results[mode])
+        ]
+        report[mode]["agreement"] = {
+            field: sum(m[field] for m in matches) / len(matches)
+            for field in InferPhotoFeatures.output_fields
+        }
+    return report
+
+
+async def main():
+    photo_paths = sorted(glob.glob(global_config.roi.eval_photo_glob))
+    if not photo_paths:
+        log.error(f"No photos match {global_config.roi.eval_photo_glob}")
+        return
+
+    report = await compare_roi_modes(photo_paths)
+    baseline_tokens = report["full"]["tokens"]
+
+    print(f"\nROI report over {len(photo_paths)} photos")
+    for mode in MODES:
+        tokens = report[mode]["tokens"]
+        agreement = report[mode]["agreement"]
+        overall = sum(agreement.values()) / len(agreement)
+        print(
+            f"\n{mode:>5}: {tokens} image tokens "
+            f"({1 - tokens / baseline_tokens:.0%} saved), "
+            f"{overall:.0%} field agreement"
+        )
+        for field, rate in agreement.items():
+            print(f"  {field}: {rate:.0%}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,184 @@
+import os
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from global_config import global_config
+
+
+class StitchedProfile:
+    """
+    Tall image of an entire profile, assembled from overlapping scroll frames.
+
+    Each frame is registered against the previous one by cross-correlating the
+    row signatures of the scrollable band (everything between the fixed header
+    and footer). Only the rows a frame adds are written to disk as a tile, so
+    memory stays bounded by a single frame regardless of profile length.
+
+    Coordinates:
+        Frame coordinates are the raw screen coordinates used by UI dumps.
+        Stitched coordinates start at the top of the first frame's scrollable
+        band and grow downwards through the whole profile.
+    """
+
+    def __init__(
+        self,
+        tile_dir: str = global_config.capture.stitch.tile_dir,
+        header_px: int = global_config.capture.stitch.header_px,
+        footer_px: int = global_config.capture.stitch.footer_px,
+        min_overlap_px: int = global_config.capture.stitch.min_overlap_px,
+    ):
+        self.tile_dir = tile_dir
+        self.header_px = header_px
+        self.footer_px = footer_px
+        self.min_overlap_px = min_overlap_px
+
+        self.width: Optional[int] = None
+        self.band_height: Optional[int] = None
+        self.height = 0  # Height of the stitched image so far
+
+        self.frame_offsets: list[int] = []  # Stitched y of each frame's band top
+        self.dump_paths: list[Optional[str]] = []
+        self.tiles: list[tuple[int, int, str]] = []  # (stitched y0, y1, path)
+
+        self._previous_signature: Optional[np.ndarray] = None
+
+        os.makedirs(self.tile_dir, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self.frame_offsets)
+
+    def _band(self, frame: Image.Image) -> Image.Image:
+        """Crop a frame to its scrollable band."""
+        return frame.crop(
+            (0, self.header_px, frame.width, frame.height - self.footer_px)
+        )
+
+    @staticmethod
+    def _row_signature(band: Image.Image, columns: int = 32) -> np.ndarray:
+        """
+        Compress a band into a (rows, columns) grayscale signature.
+
+        Averaging horizontally keeps the vertical resolution needed for
+        registration while making correlation cheap.
+        """
+        gray = band.convert("L").resize((columns, band.height), Image.BILINEAR)
+        signature = np.asarray(gray, dtype=np.float32)
+        return signature - signature.mean(axis=1, keepdims=True)
+
+    def _register(self, previous: np.ndarray, current: np.ndarray) -> int:
+        """
+        Find the scroll shift between two consecutive band signatures.
+
+        Returns the number of rows the content moved up, i.e. row `r` of the
+        current frame shows the same content as row `r + shift` of the
+        previous one. A shift of 0 means the view did not move.
+        """
+        rows = previous.shape[0]
+        n = 2 * rows
+
+        # corr[s] = sum_r previous[r + s] * current[r], for every shift at once
+        spectrum = np.fft.rfft(previous, n, axis=0) * np.conj(
+            np.fft.rfft(current, n, axis=0)
+        )
+        corr = np.fft.irfft(spectrum, n, axis=0)[:rows].sum(axis=1)
+
+        # Energy of the overlapping part of each frame, per shift
+        prev_energy = (previous * previous).sum(axis=1)
+        curr_energy = (current * current).sum(axis=1)
+        prev_suffix = np.cumsum(prev_energy[::-1])[::-1]  # rows s..end
+        curr_prefix = np.cumsum(curr_energy)[::-1]  # rows 0..rows-s-1
+        denom = np.sqrt(prev_suffix * curr_prefix)
+
+        # Flat overlaps (blank background) have no energy and carry no signal
+        scores = np.where(denom > 1e-6, corr / np.maximum(denom, 1e-6), 0.0)
+        scores = scores[: rows - self.min_overlap_px + 1]
+        return int(np.argmax(scores))
+
+    def add_frame(self, frame: Image.Image, dump_path: Optional[str] = None) -> int:
+        """
+        Register a new scroll frame and write the rows it reveals as a tile.
+
+        Args:
+            frame: Full-screen screenshot taken after the latest scroll
+            dump_path: UI dump captured for the same screen state, if any
+
+        Returns:
+            The scroll shift in pixels relative to the previous frame
+            (the full band height for the first frame, 0 if nothing moved).
+        """
+        band = self._band(frame)
+        signature = self._row_signature(band)
+
+        if self._previous_signature is None:
+            self.width, self.band_height = band.size
+            shift = self.band_height
+            offset = 0
+            new_rows = (0, self.band_height)
+        else:
+            if band.size != (self.width, self.band_height):
+                raise ValueError(
+                    f"Frame size {band.size} does not match stitched band "
+                    f"{(self.width, self.band_height)}"
+                )
+            shift = self._register(self._previous_signature, signature)
+            offset = self.frame_offsets[-1] + shift
+            new_rows = (self.band_height - shift, self.band_height)
+
+        self.frame_offsets.append(offset)
+        self.dump_paths.append(dump_path)
+        self._previous_signature = signature
+
+        if shift > 0:
+            tile_path = os.path.join(self.tile_dir, f"tile_{len(self.tiles)}.png")
+            band.crop((0, new_rows[0], self.width, new_rows[1])).save(tile_path)
+            self.tiles.append((self.height, self.height + shift, tile_path))
+            self.height += shift
+
+        return shift
+
+    def to_stitched_bounds(self, bounds: tuple, frame_index: int = -1) -> tuple:
+        """Map (x1, y1, x2, y2) bounds from a frame's UI dump into stitched space."""
+        x1, y1, x2, y2 = bounds
+        offset = self.frame_offsets[frame_index] - self.header_px
+        return (
+            x1,
+            max(y1 + offset, 0),
+            x2,
+            min(y2 + offset, self.height),
+        )
+
+    def crop(self, bounds: tuple) -> Image.Image:
+        """
+        Crop a region given in stitched coordinates.
+
+        Only the tiles overlapping the region are opened.
+        """
+        x1, y1, x2, y2 = bounds
+        region = Image.new("RGB", (x2 - x1, y2 - y1))
+        for tile_y0, tile_y1, tile_path in self.tiles:
+            if tile_y1 <= y1 or tile_y0 >= y2:
+                continue
+            with Image.open(tile_path) as tile:
+                top = max(y1, tile_y0)
+                bottom = min(y2, tile_y1)
+                piece = tile.crop((x1, top - tile_y0, x2, bottom - tile_y0))
+                region.paste(piece.convert("RGB"), (0, top - y1))
+        return region
+
+    def crop_frame_bounds(self, bounds: tuple, frame_index: int = -1) -> Image.Image:
+        """Crop a region given in a frame's UI dump coordinates."""
+        return self.crop(self.to_stitched_bounds(bounds, frame_index))
+
+    def save(self, output_path: str) -> str:
+        """Write the full stitched image, pasting one tile at a time."""
+        if self.width is None:
+            raise ValueError("No frames have been added")
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        canvas = Image.new("RGB", (self.width, self.height))
+        for tile_y0, _, tile_path in self.tiles:
+            with Image.open(tile_path) as tile:
+                canvas.paste(tile.convert("RGB"), (0, tile_y0))
+        canvas.save(output_path)
+        return output_path
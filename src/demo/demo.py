@@ -8,8 +8,16 @@ import re
 import os
 import glob
 from src.mobile_api.api import HingeAPI, SubjectPair
-from src.utils.adb_helpers import tap, parse_bounds, get_element_center, screenshot, get_ui_dump
-from src.algo.feature_extract import analyze_profile
+from src.utils.adb_helpers import tap, parse_bounds, get_element_center, screenshot, get_ui_dump, screen_size
+from src.algo.feature_extract import analyze_profile_stream
+from src.algo.incremental import ProfileAnalysisStore, Revisit
+from src.algo.reply_drafts import draft_replies, submit_best_reply
+from src.algo.batch import run_key
+from src.algo.stitch import StitchedProfile
+from src.utils.photo_store import PhotoStore, profile_key
+from src.utils.image_pool import ImageWorkerPool
+from global_config import global_config
+from PIL import Image
 import asyncio
 from datetime import datetime
 
@@ -74,7 +82,7 @@ def find_photo_element(root):
 
     # Fallback: Look for large view elements (potential photo container)
     print("Falling back to searching for large View elements...")
-    screen_width = 1080 # Assuming 1080p screen, adjust if necessary
+    screen_width, _ = screen_size()
     min_photo_width = screen_width * 0.7 # Example threshold
 
     potential_candidates = []
@@ -152,28 +160,50 @@ def find_all_photo_elements(root):
     return photo_elements
 
 # ---------- Photo Scraping Workflow ---------- #
-def capture_profile_photos(output_dir="profile_photos"):
-    """Cycles through photos on the current profile by scrolling vertically and captures screenshots."""
+def capture_profile_photos(output_dir="profile_photos", stitch=False):
+    """Cycles through photos on the current profile by scrolling vertically and captures screenshots.
+
+    With `stitch=True` a single frame is grabbed per scroll and registered into one tall
+    StitchedProfile image; photos are then cropped from that canonical image instead of
+    being saved as separate full-screen screenshots.
+    """
     os.makedirs(output_dir, exist_ok=True)
     screenshot_index = 1
     processed_photo_bounds = set() # Use bounds string as ID
     no_new_photos_streak = 0
     max_scrolls_without_new = 3 # Stop after 3 scrolls reveal nothing new
+    stitched = StitchedProfile() if stitch else None
+    stitched_photo_bounds = [] # Photo bounds in stitched coordinates
+    dump_index = 0
 
     print("Starting photo capture process with vertical scrolling...")
 
     while no_new_photos_streak < max_scrolls_without_new:
         print(f"\nProcessing screen state (scroll attempt {no_new_photos_streak + 1})...")
         # 1. Get current UI state
-        dump_file = "window_dump.xml"
         try:
-            get_ui_dump(dump_file)
+            dump_file = get_ui_dump(dump_index)
+            dump_index += 1
             tree = ET.parse(dump_file)
             root = tree.getroot()
         except Exception as e:
             print(f"An unexpected error occurred during UI dump/parse: {e}. Stopping.")
             break
 
+        # 1b. Register this screen into the stitched image (one frame per scroll)
+        if stitched is not None:
+            frame_path = os.path.join(stitched.tile_dir, "frame.png")
+            if not screenshot(frame_path):
+                print("Failed to capture frame for stitching. Stopping.")
+                break
+            with Image.open(frame_path) as frame:
+                shift = stitched.add_frame(frame, dump_file)
+            os.remove(frame_path)
+            print(f"  Stitched frame {len(stitched)} (scrolled {shift}px, total height {stitched.height}px)")
+            if len(stitched) > 1 and shift == 0:
+                print("View did not move since the last frame. Reached end of profile.")
+                break
+
         # 2. Find all potential photo elements visible
         visible_photos = find_all_photo_elements(root)
         if not visible_photos:
@@ -196,6 +226,15 @@ def capture_profile_photos(output_dir="profile_photos"):
                 processed_photo_bounds.add(bounds_str)
                 new_photos_found_this_iteration = True
 
+                if stitched is not None:
+                    bounds = parse_bounds(bounds_str)
+                    if bounds:
+                        # The same photo seen on two screens maps to the same stitched region
+                        photo_bounds = stitched.to_stitched_bounds(bounds)
+                        if photo_bounds not in stitched_photo_bounds:
+                            stitched_photo_bounds.append(photo_bounds)
+                    continue
+
                 screenshot_path = os.path.join(output_dir, f"photo_{screenshot_index}.png")
                 
                 # Option 1: Screenshot whole screen (simpler)
@@ -231,9 +270,8 @@ def capture_profile_photos(output_dir="profile_photos"):
                 break
 
         # 5. Perform vertical scroll down
-        # Get screen dimensions (assuming 1080x2400 for now, ideally get dynamically)
-        screen_width = 1080
-        screen_height = 2400
+        # Get screen dimensions from the device
+        screen_width, screen_height = screen_size()
         scroll_x = screen_width // 2
         scroll_y_start = int(screen_height * 0.8) # Start scroll from 80% down
         scroll_y_end = int(screen_height * 0.2)   # Scroll up to 20%
@@ -245,40 +283,30 @@ def capture_profile_photos(output_dir="profile_photos"):
         # 6. Wait for UI to settle after scroll
         time.sleep(2.5)
 
+    if stitched is not None and len(stitched):
+        full_path = stitched.save(global_config.capture.stitch.output_path)
+        print(f"Stitched full-profile image saved to '{full_path}' ({stitched.width}x{stitched.height}).")
+        for bounds in stitched_photo_bounds:
+            photo_path = os.path.join(output_dir, f"photo_{screenshot_index}.png")
+            stitched.crop(bounds).save(photo_path)
+            print(f"  Photo {screenshot_index} cropped from stitched image at {bounds}.")
+            screenshot_index += 1
+
     total_photos = screenshot_index - 1
     print(f"\nPhoto capture finished. {total_photos} photos saved in '{output_dir}'.")
 
-def main():
-    # Clean up photo_dump directory
-    if os.path.exists("photo_dump"):
-        for file in os.listdir("photo_dump"):
-            os.remove(os.path.join("photo_dump", file))
-    else:
-        os.makedirs("photo_dump")
-
-    # Create feature_extracted directory if it doesn't exist
-    os.makedirs("feature_extracted", exist_ok=True)
-
-    # Track processed photos to avoid duplicates
-    processed_photo_bounds = set()
-
-    def is_valid_photo_bounds(bounds):
-        """Check if the photo bounds have a reasonable aspect ratio."""
-        if not bounds:
-            return False
-        x1, y1, x2, y2 = bounds
-        width = x2 - x1
-        height = y2 - y1
-        # Skip photos that are too wide relative to their height (aspect ratio > 3)
-        return width / height <= 1.5 if height > 0 else False
-
-    # Initialize API with first dump
-    dump_path = get_ui_dump(0)
-    api = HingeAPI(dump_path)
-    
-    # Print profile information
+def is_valid_photo_bounds(bounds):
+    """Check if the photo bounds have a reasonable aspect ratio."""
+    if not bounds:
+        return False
+    x1, y1, x2, y2 = bounds
+    width = x2 - x1
+    height = y2 - y1
+    # Skip photos that are too wide relative to their height (aspect ratio > 3)
+    return width / height <= 1.5 if height > 0 else False
+
+def print_profile_info(profile_info):
     print("\n=== Profile Information ===")
-    profile_info = api.get_profile_info()
     print(f"Name: {profile_info.name}")
     print(f"Age: {profile_info.age}")
     print(f"Height: {profile_info.height}")
@@ -295,26 +323,76 @@ def main():
         for prompt in profile_info.prompts:
             print(f"- {prompt}")
     print("=========================\n")
-    
+
+def is_photo_subject(subject_str, bounds):
+    """Whether a subject from HingeAPI.get_all_subjects is a photo worth capturing."""
+    is_photo = "[Image]" in subject_str or "photo" in subject_str.lower()
+    return is_photo and bool(bounds) and is_valid_photo_bounds(bounds)
+
+async def first_photo_hash(api, pool):
+    """Pixel hash of the first photo on the profile's first screen, or None if there is none."""
+    for subject_str, content, bounds in api.get_all_subjects():
+        if is_photo_subject(subject_str, bounds):
+            submitted = await asyncio.to_thread(
+                api.submit_subject_photos, [SubjectPair(subject_str, content, None, bounds)], pool
+            )
+            if not submitted:
+                return None
+            [(_, future)] = submitted
+            return (await asyncio.wrap_future(future)).photo_hash
+    return None
+
+def capture_profile(api, store, pool, profile_id, loop, photo_queue):
+    """Scroll through the current profile, streaming each stored photo onto `photo_queue`.
+
+    Runs in a worker thread so the event loop keeps analysing photos while the device
+    scrolls. Finished crops are recorded in the PhotoStore index on the event loop
+    (single writer) and queued right away; `None` is queued after the last photo.
+    """
+    processed_photo_bounds = set()
+    queued_hashes = set()
+    screen_width, screen_height = screen_size()
+    scroll_distance = int(screen_height * 0.6)
+    stored = [] # Futures of store_photo coroutines running on the event loop
+
+    async def store_photo(bounds, scroll_offset, dump_id, future):
+        try:
+            result = await asyncio.wrap_future(future)
+        except Exception as e:
+            print(f"Error processing photo at {bounds}: {e}")
+            return
+        store.record(result.photo_hash, profile_id, bounds=bounds, scroll_offset=scroll_offset, dump_id=dump_id)
+        print(f"Saved photo to: {result.path}")
+        # The same photo can be captured from two screens; analyse it once
+        if result.photo_hash not in queued_hashes:
+            queued_hashes.add(result.photo_hash)
+            await photo_queue.put(result.path)
+
+    def queue_new_photos(subjects, scroll_offset):
+        """Hand new photo subjects on this screen to the image worker pool and return at once."""
+        new_pairs = []
+        for subject_str, content, bounds in subjects:
+            if is_photo_subject(subject_str, bounds):
+                if bounds not in processed_photo_bounds:
+                    print(f"Capturing photo: {content}")
+                    new_pairs.append(SubjectPair(subject_str, content, None, bounds))
+                    processed_photo_bounds.add(bounds)
+        dump_id = os.path.basename(api.xml_path)
+        for pair, future in api.submit_subject_photos(new_pairs, pool):
+            stored.append(asyncio.run_coroutine_threadsafe(
+                store_photo(pair.bounds, scroll_offset, dump_id, future), loop
+            ))
+
     # Get initial subjects
     subjects = api.get_all_subjects()
     print(f"\nFound {len(subjects)} initial subjects")
+    queue_new_photos(subjects, scroll_offset=0)
     
-    # Try to capture and save photos
-    for subject_str, content, bounds in subjects:
-        if "[Image]" in subject_str or "photo" in subject_str.lower():
-            if bounds and bounds not in processed_photo_bounds and is_valid_photo_bounds(bounds):
-                print(f"Capturing photo: {content}")
-                photo_path = api.capture_subject_photo(SubjectPair(subject_str, content, None, bounds), "photo_dump")
-                if photo_path:
-                    print(f"Saved photo to: {photo_path}")
-                    processed_photo_bounds.add(bounds)
-    
-    # Scroll to find more subjects
+    # Scroll to find more subjects while earlier photos are cropped and analysed
     for i in range(1, 5):
         print(f"\nScroll {i}/4:")
         # Swipe up to scroll
-        swipe(1080 // 2, int(2400 * 0.8), 1080 // 2, int(2400 * 0.2), 500)
+        swipe(screen_width // 2, int(screen_height * 0.8), screen_width // 2, int(screen_height * 0.2), 500)
         time.sleep(1)  # Wait for scroll animation
         
         # Get new UI dump and update the existing API instance
@@ -324,96 +402,141 @@ def main():
         api.subject_pairs = api._parse_subjects_and_hearts()  # Update subjects
         
         # Print profile information for this scroll
-        print("\n=== Profile Information ===")
-        profile_info = api.get_profile_info()
-        print(f"Name: {profile_info.name}")
-        print(f"Age: {profile_info.age}")
-        print(f"Height: {profile_info.height}")
-        print(f"Location: {profile_info.location}")
-        print(f"Job: {profile_info.job}")
-        print(f"University: {profile_info.university}")
-        print(f"Hometown: {profile_info.hometown}")
-        print(f"Gender: {profile_info.gender}")
-        print(f"Relationship Type: {profile_info.relationship_type}")
-        print(f"Religion: {profile_info.religion}")
-        print(f"Politics: {profile_info.politics}")
-        if profile_info.prompts:
-            print("\nPrompts:")
-            for prompt in profile_info.prompts:
-                print(f"- {prompt}")
-        print("=========================\n")
+        print_profile_info(api.get_profile_info())
         
         # Get subjects after scroll
         subjects = api.get_all_subjects()
         print(f"Found {len(subjects)} subjects after scroll")
-        
-        # Try to capture and save photos
-        for subject_str, content, bounds in subjects:
-            if "[Image]" in subject_str or "photo" in subject_str.lower():
-                if bounds and bounds not in processed_photo_bounds and is_valid_photo_bounds(bounds):
-                    print(f"Capturing photo: {content}")
-                    photo_path = api.capture_subject_photo(SubjectPair(subject_str, content, None, bounds), "photo_dump")
-                    if photo_path:
-                        print(f"Saved photo to: {photo_path}")
-                        processed_photo_bounds.add(bounds)
-    
+        queue_new_photos(subjects, scroll_offset=i * scroll_distance)  # Nominal offset from swipe distance
+
+    # End the stream once every crop has been recorded and queued
+    for future in stored:
+        future.result()
+    loop.call_soon_threadsafe(photo_queue.put_nowait, None)
     print(f"\nFinished scanning for subjects. Captured {len(processed_photo_bounds)} unique photos.")
 
-    # Run feature extraction on captured photos
-    print("\nRunning feature extraction on captured photos...")
-    profile_photos = sorted(glob.glob("photo_dump/photo_*.png"))
+def skip_to_next_profile():
+    """Tap the Skip button to bring up the next profile."""
+    root = ET.parse(get_ui_dump(0)).getroot()
+    skip_button = find_element(root, 'content-desc', r'^Skip', clickable_only=True)
+    bounds = parse_bounds(skip_button.get("bounds")) if skip_button is not None else None
+    if not bounds:
+        raise RuntimeError("Skip button not found; cannot advance to the next profile.")
+    tap(*get_element_center(bounds))
+    time.sleep(2)  # Wait for the next profile to load
+
+def write_profile_analysis(profile, profile_id):
+    """Write analysis results to a timestamped file and return its path."""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_file = f"feature_extracted/profile_analysis_{timestamp}_{profile_id}.txt"
     
-    if profile_photos:
-        # Run feature extraction
-        profile = asyncio.run(analyze_profile(profile_images=profile_photos, profile_info=profile_info))
+    with open(output_file, "w") as f:
+        f.write("=== Profile Analysis Results ===\n")
+        if profile.partial:
+            f.write("(Partial: the latency budget ran out before every photo was analysed)\n")
+        f.write(f"Name: {profile.name}\n")
+        f.write(f"Age: {profile.age}\n")
+        f.write(f"Location: {profile.location}\n")
+        f.write(f"Bio: {profile.bio}\n\n")
         
-        # Generate timestamp for the output file
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_file = f"feature_extracted/profile_analysis_{timestamp}.txt"
+        f.write("=== Photo Analysis ===\n")
+        for i, photo in enumerate(profile.photos, 1):
+            f.write(f"\nPhoto {i}:\n")
+            f.write(f"Location: {photo.location_type}\n")
+            f.write(f"Style: {photo.style}\n")
+            f.write(f"Activities: {', '.join(photo.activities)}\n")
+            f.write("Physical Attributes:\n")
+            f.write(f"  Has Freckles: {photo.has_freckles}\n")
+            f.write(f"  Hair Color: {photo.hair_color}\n")
+            f.write(f"  Has Piercings: {photo.has_piercings}\n")
+            f.write(f"  Makeup Level: {photo.makeup_level}\n")
         
-        # Write analysis results to file
-        with open(output_file, "w") as f:
-            f.write("=== Profile Analysis Results ===\n")
-            f.write(f"Name: {profile.name}\n")
-            f.write(f"Age: {profile.age}\n")
-            f.write(f"Location: {profile.location}\n")
-            f.write(f"Bio: {profile.bio}\n\n")
-            
-            f.write("=== Photo Analysis ===\n")
-            for i, photo in enumerate(profile.photos, 1):
-                f.write(f"\nPhoto {i}:\n")
-                f.write(f"Location: {photo.location_type}\n")
-                f.write(f"Style: {photo.style}\n")
-                f.write(f"Activities: {', '.join(photo.activities)}\n")
-                f.write("Physical Attributes:\n")
-                f.write(f"  Has Freckles: {photo.has_freckles}\n")
-                f.write(f"  Hair Color: {photo.hair_color}\n")
-                f.write(f"  Has Piercings: {photo.has_piercings}\n")
-                f.write(f"  Makeup Level: {photo.makeup_level}\n")
-            
-            f.write("\n=== Education ===\n")
-            for edu in profile.education:
-                f.write(f"Institution: {edu.institution}\n")
-                if edu.degree:
-                    f.write(f"Degree: {edu.degree}\n")
-                if edu.field:
-                    f.write(f"Field: {edu.field}\n")
-            
-            f.write("\n=== Lifestyle ===\n")
-            f.write(f"Party Frequency: {profile.party_frequency}\n")
-            f.write(f"Drug Usage: {profile.drug_usage}\n")
-            f.write(f"Dating Style: {profile.dating_style}\n")
-            f.write(f"Lifestyle: {profile.lifestyle}\n")
-            
-            f.write("\n=== Inferred Information ===\n")
-            f.write(f"Inferred Interests: {', '.join(profile.inferred_interests)}\n")
-            f.write(f"Inferred Personality Traits: {', '.join(profile.inferred_personality_traits)}\n")
+        f.write("\n=== Education ===\n")
+        for edu in profile.education:
+            f.write(f"Institution: {edu.institution}\n")
+            if edu.degree:
+                f.write(f"Degree: {edu.degree}\n")
+            if edu.field:
+                f.write(f"Field: {edu.field}\n")
         
-        print(f"Feature extraction results saved to: {output_file}")
-    else:
-        print("No photos were captured for feature extraction.")
+        f.write("\n=== Lifestyle ===\n")
+        f.write(f"Party Frequency: {profile.party_frequency}\n")
+        f.write(f"Drug Usage: {profile.drug_usage}\n")
+        f.write(f"Dating Style: {profile.dating_style}\n")
+        f.write(f"Lifestyle: {profile.lifestyle}\n")
+        
+        f.write("\n=== Inferred Information ===\n")
+        f.write(f"Inferred Interests: {', '.join(profile.inferred_interests)}\n")
+        f.write(f"Inferred Personality Traits: {', '.join(profile.inferred_personality_traits)}\n")
+    
+    return output_file
+
+async def analyze_and_save(photo_queue, profile_info, profile_id, analyses=None):
+    """Consume one profile's photo stream, then write its analysis to feature_extracted/."""
+    # A profile seen on an earlier run only has its new photos analysed
+    revisit = Revisit(analyses, profile_id) if analyses is not None else None
+    profile = await analyze_profile_stream(photo_queue, profile_info, revisit=revisit)
+    if not profile.photos:
+        print(f"No photos were analysed for {profile_id}.")
+    output_file = write_profile_analysis(profile, profile_id)
+    print(f"Feature extraction results for {profile_id} saved to: {output_file}")
+
+async def draft_and_reply(api, profile_info):
+    """Draft replies to the subjects on screen in one call, optionally sending the best one."""
+    drafts = await draft_replies(api.subject_pairs, profile_info)
+    for pair in api.subject_pairs:
+        for rank, draft in enumerate(drafts.get(pair.subject_id, []), 1):
+            print(f"{pair} #{rank}: {draft}")
+    if global_config.replies.submit:
+        await asyncio.to_thread(submit_best_reply, api, drafts)
+
+async def run_pipeline(profile_count=global_config.pipeline.profiles_per_run):
+    """Capture and analyse profiles as a producer/consumer pipeline.
+
+    Photos are analysed while the device is still scrolling the profile they belong
+    to, and once a profile's capture is done the device moves on to the next profile
+    while the previous one is still being aggregated and its replies drafted.
+    """
+    loop = asyncio.get_running_loop()
+    store = PhotoStore("photo_dump")
+    analysis_store = ProfileAnalysisStore(key=run_key()) if global_config.incremental.enabled else None
+    analyses = []
+    replies = []
+
+    with ImageWorkerPool(store_root=store.root) as pool:
+        for n in range(profile_count):
+            if n:
+                if global_config.replies.submit and replies:
+                    # Submitting taps the profile on screen, so its reply must be sent before moving on
+                    await replies[-1]
+                await asyncio.to_thread(skip_to_next_profile)
+
+            # Initialize API with first dump
+            api = HingeAPI(await asyncio.to_thread(get_ui_dump, 0))
+            profile_info = api.get_profile_info()
+            print_profile_info(profile_info)
+            # Name and age are not unique; the first photo tells apart people who share them
+            profile_id = profile_key(profile_info, await first_photo_hash(api, pool))
+
+            photo_queue = asyncio.Queue()
+            analyses.append(asyncio.create_task(analyze_and_save(photo_queue, profile_info, profile_id, analysis_store)))
+            await asyncio.to_thread(capture_profile, api, store, pool, profile_id, loop, photo_queue)
+            store.record_profile_info(profile_id, profile_info)
+            if global_config.replies.enabled:
+                replies.append(asyncio.create_task(draft_and_reply(api, profile_info)))
+
+        await asyncio.gather(*analyses, *replies)
+
+def main():
+    # Photos are kept across runs in a content-addressed PhotoStore, so re-captures are free
+    os.makedirs("photo_dump", exist_ok=True)
+
+    # Create feature_extracted directory if it doesn't exist
+    os.makedirs("feature_extracted", exist_ok=True)
+
+    asyncio.run(run_pipeline())
     
     print("✅ Demo started.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,11 +1,14 @@
 import dspy
 from typing import Any, Optional
 import lxml.etree as ET
-from src.utils.adb_helpers import tap, parse_bounds, get_element_center, type_text, get_ui_dump, screenshot
+from src.utils.adb_helpers import tap, parse_bounds, get_element_center, type_text, get_ui_dump, screenshot, screenshot_raw
 from PIL import Image
 import os
 import time
-from datetime import datetime
+from src.algo.stitch import StitchedProfile
+from src.utils.photo_store import PhotoStore
+from src.utils.image_pool import ImageWorkerPool
+from concurrent.futures import Future
 
 class ProfileInfo:
     """Class to hold profile information that is unique to the current page."""
@@ -306,15 +309,24 @@ class HingeAPI:
                 return False
         return False
 
-    def capture_subject_photo(self, subject_pair: SubjectPair, output_dir: str = "photo_dump") -> Optional[str]:
-        """Capture and save a photo of the subject."""
+    def capture_subject_photo(
+        self,
+        subject_pair: SubjectPair,
+        output_dir: str = "photo_dump",
+        profile_id: str = "default",
+        scroll_offset: Optional[int] = None,
+    ) -> Optional[str]:
+        """Capture a photo of the subject into the content-addressed PhotoStore at `output_dir`.
+
+        Returns the path of the stored object. Identical pixels always map to the same
+        file, so re-capturing a photo costs no extra write.
+        """
         if not subject_pair.bounds:
             print("No bounds available for photo capture")
             return None
             
         try:
-            # Create output directory if it doesn't exist
-            os.makedirs(output_dir, exist_ok=True)
+            store = PhotoStore(output_dir)
             
             # Take full screenshot
             temp_screenshot = os.path.join(output_dir, "temp_screenshot.png")
@@ -322,18 +334,17 @@ class HingeAPI:
                 print("Failed to take screenshot")
                 return None
                 
-            # Crop to subject bounds
+            # Crop to subject bounds and store by pixel hash
             with Image.open(temp_screenshot) as img:
                 x1, y1, x2, y2 = subject_pair.bounds
                 cropped = img.crop((x1, y1, x2, y2))
-                
-                # Generate output filename with timestamp
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                output_filename = f"photo_{timestamp}.png"
-                output_path = os.path.join(output_dir, output_filename)
-                
-                # Save cropped image
-                cropped.save(output_path)
+                output_path = store.add(
+                    cropped,
+                    profile_id,
+                    bounds=subject_pair.bounds,
+                    scroll_offset=scroll_offset,
+                    dump_id=os.path.basename(self.xml_path),
+                )
                 
             # Clean up temp file
             if os.path.exists(temp_screenshot):
@@ -345,6 +356,58 @@ class HingeAPI:
             print(f"Error capturing photo: {e}")
             return None
 
-    
-    
-    
+    def submit_subject_photos(
+        self,
+        subject_pairs: list[SubjectPair],
+        pool: ImageWorkerPool,
+    ) -> list[tuple[SubjectPair, Future]]:
+        """Grab one raw frame and queue a crop for each subject on the image worker pool.
+
+        Returns immediately so the caller can keep scrolling; each future resolves to an
+        ImageJobResult whose capture should then be recorded in the PhotoStore index.
+        """
+        subject_pairs = [pair for pair in subject_pairs if pair.bounds]
+        if not subject_pairs:
+            return []
+
+        frame = screenshot_raw()
+        if frame is None:
+            print("Failed to take screenshot")
+            return []
+
+        width, height, data = frame
+        with pool.share(width, height, data) as shared:
+            return [(pair, pool.submit(shared, pair.bounds)) for pair in subject_pairs]
+
+    def crop_subject_from_stitched(
+        self,
+        subject_pair: SubjectPair,
+        stitched: StitchedProfile,
+        frame_index: int = -1,
+        output_dir: str = "photo_dump",
+        profile_id: str = "default",
+    ) -> Optional[str]:
+        """Crop a subject out of the stitched full-profile image instead of a fresh screenshot.
+
+        `subject_pair.bounds` are in the coordinates of the UI dump registered as
+        `frame_index` in `stitched`.
+        """
+        if not subject_pair.bounds:
+            print("No bounds available for photo capture")
+            return None
+
+        try:
+            store = PhotoStore(output_dir)
+            cropped = stitched.crop_frame_bounds(subject_pair.bounds, frame_index)
+            dump_path = stitched.dump_paths[frame_index]
+            return store.add(
+                cropped,
+                profile_id,
+                bounds=subject_pair.bounds,
+                scroll_offset=stitched.frame_offsets[frame_index],
+                dump_id=os.path.basename(dump_path) if dump_path else None,
+            )
+
+        except Exception as e:
+            print(f"Error cropping photo from stitched image: {e}")
+            return None
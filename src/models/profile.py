@@ -63,6 +63,9 @@ class Profile:
     # Inferred attributes
     inferred_interests: list[str] = None
     inferred_personality_traits: list[str] = None
+
+    # Set when the latency budget cut some photo analyses or the aggregation short
+    partial: bool = False
     
     def __post_init__(self):
         if self.photos is None:
@@ -4,6 +4,10 @@ import pathlib
 import time
 import random
 import os
+import re
+from functools import lru_cache
+
+from global_config import global_config
 
 # ADB tap primitive
 
@@ -39,6 +43,26 @@ def get_element_center(bounds):
         return (x1 + x2) // 2, (y1 + y2) // 2
     return None
 
+def parse_screen_size(wm_output):
+    """Parses `adb shell wm size` output into (width, height); an override size wins over the physical one."""
+    sizes = dict(re.findall(r'(Physical|Override) size: (\d+x\d+)', wm_output))
+    size = sizes.get("Override") or sizes.get("Physical")
+    if not size:
+        return None
+    width, height = size.split("x")
+    return int(width), int(height)
+
+@lru_cache(maxsize=1)
+def screen_size():
+    """The device screen's (width, height), or capture.screen_width/height if adb cannot tell."""
+    try:
+        result = subprocess.run(["adb", "shell", "wm", "size"], check=True, capture_output=True, text=True)
+        size = parse_screen_size(result.stdout)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Error reading screen size: {e}")
+        size = None
+    return size or (global_config.capture.screen_width, global_config.capture.screen_height)
+
 def get_ui_dump(dump_number=0):
     """Dumps UI hierarchy from device and pulls it locally to a numbered file in window_dump folder."""
     # Create window_dump directory if it doesn't exist
@@ -86,4 +110,28 @@ def screenshot(output_path: str) -> bool:
         return False
     except Exception as e:
         print(f"Unexpected error taking screenshot: {e}")
-        return False 
\ No newline at end of file
+        return False 
+
+def screenshot_raw():
+    """Grab the screen as raw RGBA pixels without PNG encode/decode.
+
+    Returns (width, height, data) or None on failure.
+    """
+    try:
+        result = subprocess.run(["adb", "exec-out", "screencap"], check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        print(f"Error running adb command: {e}")
+        return None
+
+    raw = result.stdout
+    if len(raw) < 12:
+        print("Error: screencap returned no data")
+        return None
+    width = int.from_bytes(raw[0:4], "little")
+    height = int.from_bytes(raw[4:8], "little")
+    # Header is 12 bytes, or 16 on Android 9+ which appends a colour space field
+    header_size = len(raw) - width * height * 4
+    if header_size not in (12, 16):
+        print(f"Error: unexpected screencap size {len(raw)} for {width}x{height}")
+        return None
+    return width, height, raw[header_size:]
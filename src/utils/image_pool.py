@@ -0,0 +1,194 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Optional
+
+from PIL import Image
+from loguru import logger as log
+
+from global_config import global_config
+from src.utils.photo_store import PhotoStore, pixel_hash
+
+
+@dataclass
+class ImageJobResult:
+    """Outcome of a crop/resize/hash/encode job run in a worker process."""
+
+    photo_hash: str
+    path: str
+    size: tuple[int, int]
+    bounds: tuple
+
+
+class SharedFrame:
+    """
+    A raw frame copied once into shared memory so workers can read it without pickling.
+
+    The segment is reference counted: the creator holds one reference until the
+    `with` block exits and every submitted job holds one until it completes. The
+    segment is unlinked when the last reference is dropped.
+    """
+
+    def __init__(self, width: int, height: int, data: bytes, mode: str = "RGBA"):
+        self.size = (width, height)
+        self.mode = mode
+        self._shm = shared_memory.SharedMemory(create=True, size=len(data))
+        self._shm.buf[: len(data)] = data
+        self._refs = 1
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def acquire(self) -> None:
+        with self._lock:
+            self._refs += 1
+
+    def release(self, *_) -> None:
+        with self._lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.release()
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13 has no `track`
+        return shared_memory.SharedMemory(name=name)
+
+
+_worker_store: Optional[PhotoStore] = None
+
+
+def _init_worker(store_root: str, shard_depth: int) -> None:
+    global _worker_store
+    _worker_store = PhotoStore(store_root, shard_depth)
+
+
+def _process_crop(
+    shm_name: str,
+    size: tuple[int, int],
+    mode: str,
+    bounds: tuple,
+    max_side: Optional[int],
+) -> ImageJobResult:
+    """Worker: crop a shared frame, optionally downscale, hash and write to the store."""
+    shm = _attach(shm_name)
+    try:
+        frame = Image.frombuffer(mode, size, shm.buf, "raw", mode, 0, 1)
+        cropped = frame.crop(bounds)  # Copies, so the shared buffer can be released
+        cropped.load()
+        del frame
+    finally:
+        shm.close()
+
+    if max_side and max(cropped.size) > max_side:
+        cropped.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    photo_hash = pixel_hash(cropped)
+    _worker_store.write(cropped, photo_hash)
+    return ImageJobResult(
+        photo_hash=photo_hash,
+        path=_worker_store.object_path(photo_hash),
+        size=cropped.size,
+        bounds=tuple(bounds),
+    )
+
+
+class ImageWorkerPool:
+    """
+    Process pool for CPU-bound image work (crop, resize, pixel hash, PNG encode).
+
+    The capture loop shares each raw frame once and submits one job per subject,
+    then carries on scrolling while workers process earlier frames. Workers write
+    objects straight into the PhotoStore; the caller records captures in the index
+    from the main process so there is a single index writer.
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = global_config.image_pool.max_workers,
+        store_root: str = global_config.photo_store.root,
+        max_side: Optional[int] = global_config.image_pool.max_side,
+    ):
+        self.max_workers = max_workers or os.cpu_count()
+        self.max_side = max_side
+        self.store = PhotoStore(store_root)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_init_worker,
+            initargs=(store_root, self.store.shard_depth),
+        )
+
+    def share(self, width: int, height: int, data: bytes, mode: str = "RGBA") -> SharedFrame:
+        return SharedFrame(width, height, data, mode)
+
+    def submit(self, frame: SharedFrame, bounds: tuple) -> Future:
+        """Queue a crop of `bounds` from `frame`. Resolves to an ImageJobResult."""
+        frame.acquire()
+        future = self._executor.submit(
+            _process_crop, frame.name, frame.size, frame.mode, tuple(bounds), self.max_side
+        )
+        future.add_done_callback(frame.release)
+        return future
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def benchmark(
+    worker_counts: Optional[list[int]] = None,
+    frames: int = 24,
+    crops_per_frame: int = 3,
+    store_root: str = "/tmp/image_pool_benchmark",
+) -> dict[int, float]:
+    """
+    Measure crop/hash/encode throughput (crops per second) for each worker count.
+
+    Uses synthetic full-screen RGBA frames so it runs without a device.
+    """
+    width = global_config.capture.screen_width
+    height = global_config.capture.screen_height
+    worker_counts = worker_counts or sorted({1, 2, 4, os.cpu_count()})
+    crop_height = height // crops_per_frame
+
+    results = {}
+    for workers in worker_counts:
+        with ImageWorkerPool(max_workers=workers, store_root=store_root) as pool:
+            start = time.perf_counter()
+            futures = []
+            for _ in range(frames):
+                data = os.urandom(width * height * 4)  # Unique pixels, no store hits
+                with pool.share(width, height, data) as frame:
+                    for c in range(crops_per_frame):
+                        bounds = (0, c * crop_height, width, (c + 1) * crop_height)
+                        futures.append(pool.submit(frame, bounds))
+            for future in futures:
+                future.result()
+            elapsed = time.perf_counter() - start
+        results[workers] = len(futures) / elapsed
+        log.info(f"{workers:>3} worker(s): {results[workers]:.1f} crops/s")
+    return results
+
+
+if __name__ == "__main__":
+    benchmark()
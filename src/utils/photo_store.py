@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import Optional
+
+from PIL import Image
+
+from global_config import global_config
+
+
+def pixel_hash(image: Image.Image) -> str:
+    """SHA-256 of the decoded pixels (plus mode and size), independent of file encoding."""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.width}x{image.height}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def profile_key(profile_info, first_photo_hash: Optional[str] = None) -> str:
+    """
+    Stable key for a profile, derived from what is visible on its first screen.
+
+    Name, age and hometown alone are shared by different people, so the pixel hash of
+    the profile's first photo, which a revisit sees again, tells them apart.
+    """
+    parts = [profile_info.name or "unknown", str(profile_info.age or "")]
+    if profile_info.hometown:
+        parts.append(profile_info.hometown)
+    key = "-".join(p.strip().lower().replace(" ", "_") for p in parts if p)
+    return f"{key}-{first_photo_hash[:12]}" if first_photo_hash else key
+
+
+def _temp_path(path: str) -> tuple[int, str]:
+    """A temporary file unique to this writer, next to `path` so it can be renamed over it atomically."""
+    directory, name = os.path.split(path)
+    return tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+
+
+def _write_json_atomic(path: str, data) -> None:
+    fd, tmp_path = _temp_path(path)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class PhotoStore:
+    """
+    Content-addressed store for captured photos.
+
+    Layout under `root`:
+        objects/ab/cd/<sha256>.png   pixels, written once per unique photo
+        objects/ab/cd/<sha256>.json  sidecar with every capture of that photo
+        index.json                   profile id -> ordered list of photo hashes
+        profiles/<profile_id>.json   profile information captured alongside the photos
+
+    Because objects are keyed by pixel hash, re-capturing a photo never
+    re-encodes or overwrites anything, and downstream caches can key on the hash.
+    """
+
+    def __init__(
+        self,
+        root: str = global_config.photo_store.root,
+        shard_depth: int = global_config.photo_store.shard_depth,
+    ):
+        self.root = root
+        self.shard_depth = shard_depth
+        self.index_path = os.path.join(root, "index.json")
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+
+        self.index: dict[str, list[str]] = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                self.index = json.load(f)
+
+    def _shard_dir(self, photo_hash: str) -> str:
+        shards = [photo_hash[2 * i : 2 * i + 2] for i in range(self.shard_depth)]
+        return os.path.join(self.root, "objects", *shards)
+
+    def object_path(self, photo_hash: str) -> str:
+        return os.path.join(self._shard_dir(photo_hash), f"{photo_hash}.png")
+
+    def sidecar_path(self, photo_hash: str) -> str:
+        return os.path.join(self._shard_dir(photo_hash), f"{photo_hash}.json")
+
+    def contains(self, photo_hash: str) -> bool:
+        return os.path.exists(self.object_path(photo_hash))
+
+    def write(self, image: Image.Image, photo_hash: Optional[str] = None) -> str:
+        """Write the pixels if they are not stored yet. Returns the photo hash."""
+        photo_hash = photo_hash or pixel_hash(image)
+        if not self.contains(photo_hash):
+            path = self.object_path(photo_hash)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Workers in other processes may write the same photo; each writes its own file
+            fd, tmp_path = _temp_path(path)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    image.save(f, format="PNG")
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        return photo_hash
+
+    def record(
+        self,
+        photo_hash: str,
+        profile_id: str,
+        bounds: Optional[tuple] = None,
+        scroll_offset: Optional[int] = None,
+        dump_id: Optional[str] = None,
+    ) -> None:
+        """Attach a capture of `photo_hash` to `profile_id` and its sidecar."""
+        hashes = self.index.setdefault(profile_id, [])
+        if photo_hash not in hashes:
+            hashes.append(photo_hash)
+            _write_json_atomic(self.index_path, self.index)
+
+        sidecar = self.metadata(photo_hash) or {"hash": photo_hash, "captures": []}
+        capture = {
+            "profile_id": profile_id,
+            "bounds": list(bounds) if bounds else None,
+            "scroll_offset": scroll_offset,
+            "dump_id": dump_id,
+        }
+        known = [
+            {k: v for k, v in c.items() if k != "captured_at"}
+            for c in sidecar["captures"]
+        ]
+        if capture not in known:
+            sidecar["captures"].append(
+                {**capture, "captured_at": datetime.now().isoformat()}
+            )
+            _write_json_atomic(self.sidecar_path(photo_hash), sidecar)
+
+    def add(self, image: Image.Image, profile_id: str, **capture) -> str:
+        """Store a photo and record its capture. Returns the object path."""
+        photo_hash = self.write(image)
+        self.record(photo_hash, profile_id, **capture)
+        return self.object_path(photo_hash)
+
+    def metadata(self, photo_hash: str) -> Optional[dict]:
+        path = self.sidecar_path(photo_hash)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def profile_info_path(self, profile_id: str) -> str:
+        return os.path.join(self.root, "profiles", f"{profile_id}.json")
+
+    def record_profile_info(self, profile_id: str, profile_info) -> None:
+        """Keep the profile's text fields so the capture can be re-analysed offline."""
+        path = self.profile_info_path(profile_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_json_atomic(path, vars(profile_info))
+
+    def profile_info(self, profile_id: str) -> Optional[dict]:
+        path = self.profile_info_path(profile_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def profile_ids(self) -> list[str]:
+        return list(self.index)
+
+    def hashes(self, profile_id: str) -> list[str]:
+        return list(self.index.get(profile_id, []))
+
+    def paths(self, profile_id: str) -> list[str]:
+        return [self.object_path(h) for h in self.hashes(profile_id)]
@@ -0,0 +1,331 @@
+import json
+import math
+from email import policy
+from email.parser import BytesParser
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Collection, Optional, Union
+
+import dspy
+
+# Answers every field ReAct, ChainOfThought and our signatures may ask for; the
+# chat adapter ignores the ones a given call did not request.
+DEFAULT_FIELDS = {
+    "next_thought": "I have enough information to answer.",
+    "next_tool_name": "finish",
+    "next_tool_args": "{}",
+    "reasoning": "The photo shows a person outdoors.",
+    "has_freckles": "false",
+    "hair_color": "brown",
+    "has_piercings": "false",
+    "makeup_level": "2",
+    "activities": '["hiking"]',
+    "location_type": "outdoor",
+    "style": "casual",
+    "bio": "Enjoys the outdoors.",
+    "age": "29",
+    "interests": '["hiking", "travel"]',
+    "personality_traits": '["adventurous"]',
+    "uncertain_fields": "[]",
+    "location": "London",
+    "job": "Engineer",
+    "education": "[]",
+    "party_frequency": "2",
+    "drug_usage": "1",
+    "dating_style": "traditional",
+    "lifestyle": "active",
+    "inferred_interests": '["hiking"]',
+    "inferred_personality_traits": '["adventurous"]',
+}
+
+
+class MockLLMServer:
+    """
+    Local OpenAI-compatible chat completions server for tests and benchmarks.
+
+    Every request sleeps `delay_seconds` (called for a fresh draw if it is a
+    function), then answers with `fields` (or `fields(request body)`) in the DSPy
+    chat-adapter format. Usage is reported as characters / 4. Requests, the client
+    connections they arrived on, and the most answered at once (`max_in_flight`) are
+    recorded so tests can inspect them.
+    The first `rate_limit_first` requests are refused with a 429 and `retry_after`,
+    and requests numbered (from 1) in `unavailable_requests` get a 503.
+
+    Requests with a json_schema response_format are answered with a JSON object of
+    the schema's properties instead. An evenly spread `malformed_rate` share of first
+    requests (not follow-ups in the same conversation) get `malformed_fields` in place
+    of the regular values.
+
+    Stands in for provider prompt caching too: the prefix up to a request's last
+    cache_control breakpoint is cached on first use, and later requests sharing it
+    report it as cached prompt tokens.
+
+    And for the provider batch API: JSONL files uploaded to /files can be run as a job
+    through /batches. A job completes on its `batch_polls`-th retrieval, answering each
+    line like a regular request, and its output file is served from /files/{id}/content.
+    Batch lines are recorded in `batch_requests`, not `requests`.
+    """
+
+    def __init__(
+        self,
+        delay_seconds: Union[float, Callable[[], float]] = 0.0,
+        fields: Optional[Union[dict, Callable[[dict], dict]]] = None,
+        rate_limit_first: int = 0,
+        retry_after: Optional[float] = None,
+        malformed_fields: Optional[dict] = None,
+        malformed_rate: float = 0.0,
+        unavailable_requests: Collection[int] = (),
+        batch_polls: int = 1,
+    ):
+        self.delay_seconds = delay_seconds
+        self.fields = fields or DEFAULT_FIELDS
+        self.malformed_fields = malformed_fields or {}
+        self.malformed_rate = malformed_rate
+        self.first_requests = 0
+        self.rate_limit_first = rate_limit_first
+        self.retry_after = retry_after
+        self.rate_limited = 0
+        self.unavailable_requests = set(unavailable_requests)
+        self.cached_prefixes: set[str] = set()
+        self.requests: list[dict] = []
+        self.connections: set[tuple] = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.batch_polls = batch_polls
+        self.files: dict[str, bytes] = {}
+        self.batches: dict[str, dict] = {}
+        self.batch_requests: list[dict] = []
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                data = self.rfile.read(int(self.headers["Content-Length"]))
+                if self.path.endswith("/files"):
+                    self.respond(server.upload(self.headers["Content-Type"], data))
+                    return
+                body = json.loads(data)
+                if self.path.endswith("/batches"):
+                    self.respond(server.create_batch(body))
+                    return
+                with server._lock:
+                    server.requests.append(body)
+                    server.connections.add(self.client_address)
+                    refuse = server.rate_limited < server.rate_limit_first
+                    if refuse:
+                        server.rate_limited += 1
+                    unavailable = len(server.requests) in server.unavailable_requests
+                if refuse:
+                    self.refuse()
+                    return
+                if unavailable:
+                    self.refuse(503, "Service unavailable", "service_unavailable")
+                    return
+                with server._lock:
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    delay = server.delay_seconds
+                    time.sleep(delay() if callable(delay) else delay)
+                    self.respond(server.completion(body))
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def do_GET(self):
+                parts = self.path.rstrip("/").split("/")
+                if parts[-2] == "batches" and parts[-1] in server.batches:
+                    self.respond(server.retrieve_batch(parts[-1]))
+                elif parts[-1] == "content" and parts[-2] in server.files:
+                    self.respond(server.files[parts[-2]], "application/octet-stream")
+                else:
+                    self.respond({"error": {"message": "Not found", "type": "not_found"}}, status=404)
+
+            def respond(self, payload: Union[dict, bytes], content_type: str = "application/json", status: int = 200):
+                if isinstance(payload, dict):
+                    payload = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def refuse(self, status: int = 429, message: str = "Rate limit exceeded", kind: str = "rate_limit_exceeded"):
+                payload = json.dumps({"error": {"message": message, "type": kind}}).encode()
+                self.send_response(status)
+                if status == 429 and server.retry_after is not None:
+                    self.send_header("Retry-After", str(server.retry_after))
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            # Default backlog of 5 stalls bursts of concurrent connects on SYN retries
+            request_queue_size = 256
+
+            def handle_error(self, request, client_address):
+                # Clients that cancel a request (e.g. a hedged loser) hang up mid-response
+                pass
+
+        self._httpd = Server(("127.0.0.1", 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}/v1"
+
+    def cached_prompt_tokens(self, messages: list[dict]) -> int:
+        prefix, cacheable = [], None
+        for message in messages:
+            content = message["content"]
+            parts = content if isinstance(content, list) else [{"type": "text", "text": content}]
+            for part in parts:
+                prefix.append({"role": message["role"], **{k: v for k, v in part.items() if k != "cache_control"}})
+                if "cache_control" in part:
+                    cacheable = json.dumps(prefix, sort_keys=True)
+        if cacheable is None:
+            return 0
+        with self._lock:
+            hit = cacheable in self.cached_prefixes
+            self.cached_prefixes.add(cacheable)
+        return len(cacheable) // 4 if hit else 0
+
+    def answer(self, body: dict) -> dict:
+        fields = self.fields(body) if callable(self.fields) else self.fields
+        if self.malformed_fields and len(body["messages"]) <= 2:
+            with self._lock:
+                self.first_requests += 1
+                n = self.first_requests
+                malformed = math.floor(n * self.malformed_rate) > math.floor((n - 1) * self.malformed_rate)
+            if malformed:
+                fields = {**fields, **self.malformed_fields}
+        return fields
+
+    @staticmethod
+    def json_value(value: str):
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return value
+
+    def completion(self, body: dict) -> dict:
+        fields = self.answer(body)
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            properties = response_format["json_schema"]["schema"]["properties"]
+            content = json.dumps({k: self.json_value(v) for k, v in fields.items() if k in properties})
+        else:
+            content = "\n\n".join(f"[[ ## {k} ## ]]\n{v}" for k, v in fields.items())
+            content += "\n\n[[ ## completed ## ]]"
+        prompt_tokens = len(json.dumps(body["messages"])) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "id": f"mock-{len(self.requests)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": self.cached_prompt_tokens(body["messages"])},
+            },
+        }
+
+    def upload(self, content_type: str, data: bytes) -> dict:
+        """Store the file part of a multipart upload to /files."""
+        message = BytesParser(policy=policy.HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + data)
+        part = next(p for p in message.iter_parts() if p.get_param("name", header="content-disposition") == "file")
+        content = part.get_payload(decode=True)
+        with self._lock:
+            file_id = f"file-{len(self.files)}"
+            self.files[file_id] = content
+        return {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": part.get_filename() or "input.jsonl",
+            "purpose": "batch",
+            "status": "processed",
+        }
+
+    def create_batch(self, body: dict) -> dict:
+        with self._lock:
+            batch_id = f"batch-{len(self.batches)}"
+            lines = self.files[body["input_file_id"]].decode().splitlines()
+            self.batches[batch_id] = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": body["endpoint"],
+                "input_file_id": body["input_file_id"],
+                "completion_window": body["completion_window"],
+                "status": "in_progress",
+                "created_at": int(time.time()),
+                "output_file_id": None,
+                "error_file_id": None,
+                "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+                "polls": 0,
+            }
+            return dict(self.batches[batch_id])
+
+    def retrieve_batch(self, batch_id: str) -> dict:
+        with self._lock:
+            batch = self.batches[batch_id]
+            batch["polls"] += 1
+            ready = batch["status"] == "in_progress" and batch["polls"] >= self.batch_polls
+            if ready:
+                batch["status"] = "finalizing"
+                lines = self.files[batch["input_file_id"]].decode().splitlines()
+        if ready:
+            output = []
+            for line in lines:
+                request = json.loads(line)
+                output.append(json.dumps({
+                    "id": f"response-{request['custom_id']}",
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": self.completion(request["body"])},
+                    "error": None,
+                }))
+            with self._lock:
+                self.batch_requests.extend(json.loads(line) for line in lines)
+                output_id = f"file-{len(self.files)}"
+                self.files[output_id] = "\n".join(output).encode()
+                batch.update(status="completed", output_file_id=output_id, completed_at=int(time.time()))
+                batch["request_counts"]["completed"] = len(output)
+        with self._lock:
+            return dict(batch)
+
+    def lm(self, model: str = "openai/mock-llm", lm_class: type = dspy.LM, **kwargs) -> dspy.LM:
+        """A dspy.LM (or subclass) pointed at this server."""
+        return lm_class(
+            model=model,
+            api_base=self.url,
+            api_key="mock",
+            cache=False,
+            **kwargs,
+        )
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self._httpd.shutdown()
+        self._httpd.server_close()
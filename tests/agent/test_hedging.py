@@ -0,0 +1,121 @@
+import asyncio
+import random
+import time
+
+import pytest
+from PIL import Image
+
+from global_config import global_config
+from global_config.global_config import Config
+from tests.test_template import TestTemplate, slow_test
+from tests.agent.mock_llm_server import MockLLMServer
+from src.agent import rate_limiter
+from src.agent.hedging import Hedge, percentile
+from src.agent.rate_limiter import ProviderLimiter, RateLimitedLM
+from src.agent.react_agent import PROVIDER_ERRORS, ReactAgent
+from src.algo.feature_extract import InferPhotoFeatures, load_prompt
+
+
+class TestHedgedAgents(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup, monkeypatch):
+        # The mock primary's provider gets no quota, so only its own latency is measured
+        primary_limiter = ProviderLimiter("litellm_proxy", initial_concurrency=32)
+        monkeypatch.setattr(rate_limiter, "_limiters", {"litellm_proxy": primary_limiter})
+        self.image = Image.new("RGB", (64, 64), (120, 80, 40))
+        with MockLLMServer() as primary, MockLLMServer(delay_seconds=0.05) as backup:
+            self.primary = primary
+            self.backup = backup
+            yield
+
+    def make_agent(self, **hedge_kwargs) -> ReactAgent:
+        # Primary and backup sit behind different providers, and so different rate limiters
+        agent = ReactAgent(agent_signature=InferPhotoFeatures, backup_model_name="gemini/gemini-2.0-flash")
+        agent.lm = self.primary.lm(model="litellm_proxy/mock-primary", lm_class=RateLimitedLM, num_retries=0)
+        agent.backup_lm = self.backup.lm(model="openai/mock-backup", lm_class=RateLimitedLM, num_retries=0)
+        agent.hedge = Hedge(failover_errors=PROVIDER_ERRORS, **hedge_kwargs)
+        return agent
+
+    async def run_agent(self, agent: ReactAgent):
+        return await agent.run(
+            user_id="",
+            use_cache=False,
+            system_prompt=load_prompt("photo"),
+            image=self.image,
+        )
+
+    def test_configured_backup_builds_without_an_injected_key(self, monkeypatch):
+        # An environment without OPENAI_API_KEY, the shipped backup being an OpenAI model
+        monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+        monkeypatch.setattr(global_config, "OPENAI_API_KEY", Config().OPENAI_API_KEY)
+        monkeypatch.setattr(global_config.agent.hedging, "enabled", True)
+
+        agent = ReactAgent(agent_signature=InferPhotoFeatures)
+
+        assert agent.backup_lm.model == global_config.agent.hedging.backup_model
+        assert agent.backup_lm.kwargs.get("api_key") is None
+        assert agent.hedge is not None
+
+    def test_fast_primary_is_not_hedged(self):
+        agent = self.make_agent(initial_delay_seconds=1.0)
+
+        result = asyncio.run(self.run_agent(agent))
+
+        assert result.hair_color == "brown"
+        assert agent.hedge.stats.hedged == 0
+        assert len(self.backup.requests) == 0
+
+    def test_slow_primary_is_hedged_and_cancelled(self):
+        self.primary.delay_seconds = 2.0
+        agent = self.make_agent(initial_delay_seconds=0.2)
+
+        start = time.perf_counter()
+        result = asyncio.run(self.run_agent(agent))
+        elapsed = time.perf_counter() - start
+
+        assert result.hair_color == "brown"
+        assert elapsed < 1.0
+        assert agent.hedge.stats.hedged == 1
+        assert agent.hedge.stats.backup_wins == 1
+        # The cancelled primary's generation was closed rather than left open
+        assert not agent.callback.lm_calls
+
+    def test_provider_error_fails_over_to_backup(self):
+        self.primary.rate_limit_first = 100
+        agent = self.make_agent(initial_delay_seconds=1.0)
+
+        result = asyncio.run(self.run_agent(agent))
+
+        assert result.hair_color == "brown"
+        assert len(self.primary.requests) == 1
+        assert agent.hedge.stats.failovers == 1
+        assert agent.hedge.stats.hedged == 0
+
+    @slow_test
+    def test_hedging_cuts_tail_latency(self):
+        # One primary call in ten stalls; the backup is steady but a little slower
+        rng = random.Random(0)
+        self.primary.delay_seconds = lambda: 3.0 if rng.random() < 0.1 else 0.1
+        self.backup.delay_seconds = 0.2
+        calls = 100
+
+        async def latencies(agent: ReactAgent) -> list[float]:
+            pending = asyncio.Semaphore(8)
+
+            async def one():
+                async with pending:
+                    start = time.perf_counter()
+                    await self.run_agent(agent)
+                    return time.perf_counter() - start
+
+            return await asyncio.gather(*[one() for _ in range(calls)])
+
+        unhedged = ReactAgent(agent_signature=InferPhotoFeatures)
+        unhedged.lm = self.primary.lm(model="litellm_proxy/mock-primary", lm_class=RateLimitedLM, num_retries=0)
+        baseline = asyncio.run(latencies(unhedged))
+        hedged_agent = self.make_agent(initial_delay_seconds=0.5, min_samples=10)
+        hedged = asyncio.run(latencies(hedged_agent))
+
+        report = hedged_agent.hedge.stats.report()
+        assert report["hedge_rate"] < 0.3
+        assert percentile(hedged, 99) < percentile(baseline, 99) / 2
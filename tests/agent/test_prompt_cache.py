@@ -0,0 +1,148 @@
+import asyncio
+import os
+
+import pytest
+from PIL import Image
+
+from tests.test_template import TestTemplate
+from tests.agent.mock_llm_server import MockLLMServer
+from global_config import global_config
+from src.agent.prompt_cache import PromptCachingLM, static_prefix, static_prefix_end
+from src.agent.rate_limiter import estimate_request_tokens
+from src.agent.react_agent import ReactAgent, usage_scope
+from src.algo import feature_extract
+from src.algo.feature_extract import InferPhotoFeatures, analyze_profile, load_prompt
+from src.mobile_api.api import ProfileInfo
+
+
+class TestLoadPrompt(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup, tmp_path, monkeypatch):
+        self.prompt_file = tmp_path / "feature_extractor.txt"
+        self.write("Look closely.")
+        monkeypatch.setattr(feature_extract, "PROMPT_FILE", str(self.prompt_file))
+        monkeypatch.setattr(feature_extract, "_prompts", {})
+
+        self.reads = 0
+        read_prompt = feature_extract._read_prompt
+
+        def counting_read(*args):
+            self.reads += 1
+            return read_prompt(*args)
+
+        monkeypatch.setattr(feature_extract, "_read_prompt", counting_read)
+
+    def write(self, photo_prompt: str, mtime_ns: int = 1_000_000_000):
+        self.prompt_file.write_text(
+            f"# Individual Photo Analysis Prompt\n{photo_prompt}\n# Profile Aggregation Prompt\nSum up."
+        )
+        os.utime(self.prompt_file, ns=(mtime_ns, mtime_ns))
+
+    def test_prompt_is_read_once_until_the_file_changes(self):
+        assert [load_prompt("photo") for _ in range(3)] == ["Look closely."] * 3
+        assert self.reads == 1
+
+        self.write("Look again.", mtime_ns=2_000_000_000)
+        assert load_prompt("photo") == "Look again."
+        assert self.reads == 2
+
+
+class TestShippedPromptCaching(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup):
+        with MockLLMServer() as server:
+            agent = ReactAgent(agent_signature=InferPhotoFeatures)
+            agent.lm = server.lm(lm_class=PromptCachingLM, num_retries=0)
+            asyncio.run(agent.run(
+                user_id="",
+                use_cache=False,
+                system_prompt=load_prompt("photo"),
+                image=Image.new("RGB", (64, 64), (120, 80, 40)),
+            ))
+            self.messages = server.requests[0]["messages"]
+
+    def test_real_photo_prompt_is_too_short_for_gemini_context_caching(self):
+        # Gemini's explicit context caches take whole messages of at least 4096 tokens; the real
+        # photo prompt's system message, or even its whole static prefix, is far short of that
+        system_message = estimate_request_tokens(self.messages[:1], 0)
+        prefix = estimate_request_tokens(static_prefix(self.messages, static_prefix_end(self.messages)), 0)
+        assert system_message < prefix < 4096
+
+        # So Gemini requests carry no breakpoint and rely on its implicit caching
+        gemini = PromptCachingLM(model="gemini/gemini-2.0-flash")
+        assert gemini._mark(self.messages) is self.messages
+
+
+class TestPromptCaching(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup, monkeypatch, tmp_path):
+        # Treat the mock server as a provider with explicit cache breakpoints
+        openai = global_config.llm_config.prompt_caching.providers.openai
+        monkeypatch.setattr(openai, "explicit", True)
+        monkeypatch.setattr(openai, "min_prefix_tokens", 0)
+
+        self.photo_paths = []
+        for i in range(3):
+            path = tmp_path / f"photo_{i}.png"
+            Image.new("RGB", (64, 64), (40 * i, 80, 40)).save(path)
+            self.photo_paths.append(str(path))
+
+        with MockLLMServer() as server:
+            self.server = server
+            yield
+
+    def make_agent(self, agent_signature=InferPhotoFeatures) -> ReactAgent:
+        agent = ReactAgent(agent_signature=agent_signature)
+        agent.lm = self.server.lm(lm_class=PromptCachingLM, num_retries=0)
+        return agent
+
+    def test_breakpoint_sits_before_the_image(self):
+        agent = self.make_agent()
+        asyncio.run(agent.run(
+            user_id="",
+            use_cache=False,
+            system_prompt=load_prompt("photo"),
+            image=Image.open(self.photo_paths[0]),
+        ))
+
+        messages = self.server.requests[0]["messages"]
+        parts = messages[1]["content"]
+        assert [part["type"] for part in parts] == ["text", "image_url", "text"]
+        assert parts[0]["cache_control"] == {"type": "ephemeral"}
+        assert static_prefix_end(messages) == (1, 0)
+
+    def test_profiles_report_cached_and_uncached_input_tokens(self, monkeypatch):
+        agents = {}
+
+        def get_agent(agent_signature, **kwargs):
+            if agent_signature not in agents:
+                agents[agent_signature] = self.make_agent(agent_signature)
+            return agents[agent_signature]
+
+        monkeypatch.setattr(feature_extract, "get_agent", get_agent)
+        monkeypatch.setattr(global_config.llm_cache, "enabled", False)
+
+        reports = []
+        monkeypatch.setattr(feature_extract, "_report_tokens", lambda profile, tokens, **_: reports.append(tokens))
+
+        async def run_profiles():
+            # Two profiles at once: each report must only count its own calls
+            return await asyncio.gather(
+                analyze_profile(self.photo_paths, ProfileInfo()),
+                analyze_profile(self.photo_paths[:1], ProfileInfo()),
+            )
+
+        with usage_scope() as total:
+            asyncio.run(run_profiles())
+
+        assert len(self.server.requests) == 6
+        assert sum(r.prompt_tokens for r in reports) == total.prompt_tokens
+        # The one-photo profile made two calls to the other's four
+        small, large = sorted(r.prompt_tokens for r in reports)
+        assert small < large / 1.5
+        # Every request after the first for a signature reuses its cached static prefix
+        assert all(r.cached_prompt_tokens > 0 for r in reports)
+        assert 0 < total.cached_prompt_tokens < total.prompt_tokens
+        photo_agent = agents[InferPhotoFeatures]
+        assert photo_agent.usage.cached_prompt_tokens > 0
+        assert photo_agent.usage.per_call()["cached_prompt_tokens_per_call"] > 0
@@ -0,0 +1,169 @@
+import asyncio
+import time
+
+import pytest
+from PIL import Image
+
+from global_config import global_config
+from tests.test_template import TestTemplate
+from tests.agent.mock_llm_server import MockLLMServer
+from src.agent import rate_limiter
+from src.agent.rate_limiter import ProviderLimiter, RateLimitedLM, estimate_request_tokens, get_rate_limiter
+from src.agent.react_agent import ReactAgent
+from src.algo.feature_extract import InferPhotoFeatures, load_prompt
+
+
+class TestProviderLimiter(TestTemplate):
+    def test_token_bucket_paces_calls_past_the_quota(self):
+        limiter = ProviderLimiter("mock", tokens_per_minute=600)
+
+        async def run():
+            async with limiter.acquire(600):
+                pass
+            start = time.perf_counter()
+            # 10 tokens/s, so 5 more tokens wait for half a second of refill
+            async with limiter.acquire(5):
+                pass
+            return time.perf_counter() - start
+
+        assert 0.4 < asyncio.run(run()) < 1.0
+
+    def test_concurrency_window_is_aimd(self):
+        limiter = ProviderLimiter("mock", initial_concurrency=8, max_concurrency=32, cooldown_seconds=60)
+
+        limiter.on_rate_limited(retry_after=None)
+        assert limiter.limit == 4
+        # A burst of 429s from the same overload only halves the window once
+        limiter.on_rate_limited(retry_after=None)
+        assert limiter.limit == 4
+
+        for _ in range(4):
+            limiter.on_success()
+        assert 4.8 < limiter.limit < 5
+
+    def test_window_caps_calls_in_flight(self):
+        limiter = ProviderLimiter("mock", initial_concurrency=3, additive_increase=0)
+        in_flight = 0
+        peak = 0
+
+        async def one():
+            nonlocal in_flight, peak
+            async with limiter.acquire(1):
+                in_flight += 1
+                peak = max(peak, in_flight)
+                await asyncio.sleep(0.01)
+                in_flight -= 1
+
+        async def run():
+            await asyncio.gather(*[one() for _ in range(20)])
+
+        asyncio.run(run())
+        assert peak == 3
+        assert limiter.in_flight == 0
+
+    def test_cancelled_waiter_passes_its_wakeup_on(self):
+        limiter = ProviderLimiter("mock", initial_concurrency=1, additive_increase=0)
+
+        async def wait_for_slot():
+            async with limiter.acquire(1):
+                pass
+
+        async def run():
+            async with limiter.acquire(1):
+                woken = asyncio.create_task(wait_for_slot())
+                queued = asyncio.create_task(wait_for_slot())
+                await asyncio.sleep(0.01)
+            # Leaving the slot woke the first waiter; it is cancelled before it gets to run
+            woken.cancel()
+            await asyncio.wait_for(queued, 1.0)
+            return woken.cancelled()
+
+        assert asyncio.run(run())
+        assert limiter.in_flight == 0 and not limiter._async_waiters
+
+    def test_shipped_quotas_do_not_hold_back_concurrent_calls(self, monkeypatch):
+        # Fresh limiters built from the shipped llm_config.rate_limits
+        monkeypatch.setattr(rate_limiter, "_limiters", {})
+        messages = [{"role": "user", "content": "Describe the photo."}]
+        estimate = estimate_request_tokens(messages, global_config.weird_quirk.max_tokens)
+        assert estimate < global_config.weird_quirk.max_tokens
+
+        async def call(limiter):
+            async with limiter.acquire(estimate):
+                await asyncio.sleep(0.01)
+
+        async def run(model):
+            limiter = get_rate_limiter(model)
+            start = time.perf_counter()
+            await asyncio.gather(*[call(limiter) for _ in range(4)])
+            return time.perf_counter() - start
+
+        for model in ["anthropic/claude-3-5-haiku-latest", "openai/gpt-4o-mini", "gemini/gemini-2.0-flash"]:
+            assert asyncio.run(run(model)) < 0.5, model
+
+    def test_reservation_is_capped_and_settled_against_real_usage(self):
+        limiter = ProviderLimiter("mock", tokens_per_minute=600)
+        limiter._reserve(100000)
+        # Capped at the bucket's capacity: a full minute of refill, not several
+        assert limiter.tokens.level == pytest.approx(0, abs=1)
+        # The call used 300 of the 600 reserved tokens, so half the bucket is back
+        limiter.settle(100000, 300)
+        assert limiter.tokens.level == pytest.approx(300, abs=1)
+
+
+class TestRateLimitedAgents(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup, monkeypatch):
+        # Fresh process-wide limiters so other tests' 429s do not leak in
+        monkeypatch.setattr(rate_limiter, "_limiters", {})
+        self.image = Image.new("RGB", (64, 64), (120, 80, 40))
+        with MockLLMServer(rate_limit_first=2, retry_after=0.3) as server:
+            self.server = server
+            yield
+
+    def make_agent(self, model: str) -> ReactAgent:
+        agent = ReactAgent(agent_signature=InferPhotoFeatures)
+        agent.lm = self.server.lm(model=model, lm_class=RateLimitedLM, num_retries=0)
+        return agent
+
+    async def run_agent(self, agent: ReactAgent):
+        return await agent.run(
+            user_id="",
+            use_cache=False,
+            system_prompt=load_prompt("photo"),
+            image=self.image,
+        )
+
+    def test_agent_retries_rate_limits_after_retry_after(self):
+        agent = self.make_agent("openai/mock-photo")
+
+        start = time.perf_counter()
+        result = asyncio.run(self.run_agent(agent))
+        elapsed = time.perf_counter() - start
+
+        assert result.hair_color == "brown"
+        assert len(self.server.requests) == 3
+        assert elapsed >= 2 * self.server.retry_after
+        assert get_rate_limiter("openai/mock-photo").rate_limited == 2
+
+    def test_agents_on_one_provider_share_the_pause(self):
+        first = self.make_agent("openai/mock-photo")
+        second = self.make_agent("openai/mock-profile")
+        assert get_rate_limiter(first.lm.model) is get_rate_limiter(second.lm.model)
+        self.server.rate_limit_first = 1
+
+        async def run():
+            first_run = asyncio.create_task(self.run_agent(first))
+            # Let the first agent's request get refused, then start the second
+            while not self.server.rate_limited:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)
+            start = time.perf_counter()
+            await self.run_agent(second)
+            second_elapsed = time.perf_counter() - start
+            await first_run
+            return second_elapsed
+
+        # The second agent was never refused itself, but waits out the provider's Retry-After
+        assert asyncio.run(run()) >= self.server.retry_after - 0.1
+        assert self.server.rate_limited == 1
@@ -0,0 +1,309 @@
+import asyncio
+import json
+import time
+
+import dspy
+import litellm
+import pytest
+from langfuse.decorators import langfuse_context, observe
+from PIL import Image
+
+from global_config import global_config
+from tests.test_template import TestTemplate, slow_test
+from tests.agent.mock_llm_server import DEFAULT_FIELDS, MockLLMServer
+from src.agent import llm_pool
+from src.agent.rate_limiter import RateLimitedLM
+from src.agent.react_agent import ReactAgent
+from src.agent.trajectory_checkpoint import CheckpointedReAct, trajectory_checkpoint
+from src.algo.feature_extract import InferPhotoFeatures, InferProfileFeatures, load_prompt
+
+
+class TestAgentStrategies(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup):
+        self.image = Image.new("RGB", (64, 64), (120, 80, 40))
+        with MockLLMServer() as server:
+            self.server = server
+            yield
+
+    def run_calls(self, strategy: str, calls: int = 3) -> ReactAgent:
+        agent = ReactAgent(agent_signature=InferPhotoFeatures, strategy=strategy)
+        agent.lm = self.server.lm()
+
+        async def run_all():
+            for _ in range(calls):
+                result = await agent.run(
+                    user_id="",
+                    use_cache=False,
+                    system_prompt=load_prompt("photo"),
+                    image=self.image,
+                )
+                assert result.hair_color == "brown"
+
+        asyncio.run(run_all())
+        return agent
+
+    def test_tool_less_agents_default_to_single_prediction(self):
+        agent = ReactAgent(agent_signature=InferPhotoFeatures)
+        assert agent.strategy == "predict"
+
+    def test_predict_needs_fewer_round_trips_and_tokens_than_react(self):
+        react = self.run_calls("react").usage.per_call()
+        predict = self.run_calls("predict").usage.per_call()
+
+        assert predict["lm_calls_per_call"] == 1
+        assert react["lm_calls_per_call"] >= 2
+        assert predict["prompt_tokens_per_call"] < react["prompt_tokens_per_call"]
+
+    def test_hung_call_times_out_and_is_retried(self, monkeypatch):
+        agent = ReactAgent(agent_signature=InferPhotoFeatures)
+        agent.lm = self.server.lm(lm_class=RateLimitedLM, num_retries=0)
+
+        async def run_call():
+            return await agent.run(
+                user_id="", use_cache=False, system_prompt=load_prompt("photo"), image=self.image,
+            )
+
+        async def run_all():
+            # Warm up first, so only the hung request can hit the timeout
+            await run_call()
+            monkeypatch.setattr(global_config.llm_config.retry, "call_timeout_seconds", 0.5)
+            delays = iter([3.0])
+            self.server.delay_seconds = lambda: next(delays, 0.0)
+            start = time.perf_counter()
+            result = await run_call()
+            return result, time.perf_counter() - start
+
+        result, elapsed = asyncio.run(run_all())
+
+        assert result.hair_color == "brown"
+        assert len(self.server.requests) == 3
+        assert elapsed < 2.5
+
+    def test_hung_request_from_a_worker_thread_times_out(self, monkeypatch):
+        monkeypatch.setattr(global_config.llm_config.retry, "call_timeout_seconds", 0.5)
+        self.server.delay_seconds = 3.0
+        lm = self.server.lm(lm_class=RateLimitedLM, num_retries=0)
+
+        start = time.perf_counter()
+        with pytest.raises(litellm.Timeout):
+            lm("Describe the photo.")
+        assert time.perf_counter() - start < 2.5
+
+
+def two_lookups_then_finish(body: dict) -> dict:
+    """Mock ReAct answers: look something up until the trajectory holds two observations."""
+    observations = json.dumps(body["messages"][-1]).count("## observation_")
+    if observations < 2:
+        return {**DEFAULT_FIELDS, "next_tool_name": "lookup", "next_tool_args": '{"query": "hair"}'}
+    return DEFAULT_FIELDS
+
+
+class TestReActRetries(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup):
+        self.image = Image.new("RGB", (64, 64), (120, 80, 40))
+        self.lookups = 0
+        # Requests 1-2 are the two lookup steps; the third, the finish step, is refused
+        with MockLLMServer(fields=two_lookups_then_finish, unavailable_requests={3}) as server:
+            self.server = server
+            yield
+
+    def lookup(self, query: str) -> str:
+        """Look up a detail of the photo."""
+        self.lookups += 1
+        return "brown"
+
+    def test_retry_resumes_from_the_last_completed_step(self):
+        agent = ReactAgent(agent_signature=InferPhotoFeatures, tools=[self.lookup])
+        agent.lm = self.server.lm(num_retries=0)
+
+        result = asyncio.run(agent.run(
+            user_id="", use_cache=False, system_prompt=load_prompt("photo"), image=self.image,
+        ))
+
+        assert result.hair_color == "brown"
+        assert [result.trajectory[f"tool_name_{i}"] for i in range(3)] == ["lookup", "lookup", "finish"]
+        # Only the refused finish step is repeated: 2 lookups, 2 finish attempts and the extract
+        assert len(self.server.requests) == 5
+        assert self.lookups == 2
+        stats = agent.checkpoint_stats.report()
+        assert stats["retries"] == 1 and stats["resumed_steps"] == 2
+        assert stats["saved_tokens"] > 0
+
+    def test_tool_calls_do_not_hold_an_llm_slot(self, monkeypatch):
+        monkeypatch.setattr(global_config.llm_config.concurrency, "max_in_flight", 1)
+        slot_taken = []
+
+        def lookup(query: str) -> str:
+            """Look up a detail of the photo."""
+            slot_taken.append(llm_pool._loop_pool().slots.locked())
+            return "brown"
+
+        agent = ReactAgent(agent_signature=InferPhotoFeatures, tools=[lookup])
+        agent.lm = self.server.lm(lm_class=RateLimitedLM, num_retries=0)
+        result = asyncio.run(agent.run(
+            user_id="", use_cache=False, system_prompt=load_prompt("photo"), image=self.image,
+        ))
+
+        assert result.hair_color == "brown"
+        # The only slot is free while each tool runs: it is held per LM request, not per run
+        assert slot_taken == [False, False]
+
+    def test_sync_call_resumes_from_a_checkpoint(self):
+        react = CheckpointedReAct(InferPhotoFeatures, tools=[self.lookup])
+        steps = {}
+        for i in range(2):
+            steps.update({
+                f"thought_{i}": "Check the hair.", f"tool_name_{i}": "lookup",
+                f"tool_args_{i}": {"query": "hair"}, f"observation_{i}": "brown",
+            })
+
+        with trajectory_checkpoint() as checkpoint, dspy.context(lm=self.server.lm(num_retries=0)):
+            checkpoint.save(steps, 2)
+            result = react(system_prompt=load_prompt("photo"), image=dspy.Image.from_PIL(self.image))
+
+        assert result.hair_color == "brown"
+        assert result.trajectory["tool_name_2"] == "finish"
+        # Only the finish step and the extract are requested; no lookup is replayed
+        assert len(self.server.requests) == 2
+        assert self.lookups == 0 and checkpoint.steps == 3
+
+
+class RecordingLangfuse:
+    """Stands in for the Langfuse client, recording every generation a callback opens."""
+
+    def __init__(self):
+        self.generations = []
+
+    def generation(self, **kwargs):
+        self.generations.append(kwargs)
+        return self
+
+    def end(self, **kwargs):
+        pass
+
+
+class TestConcurrentAgents(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup):
+        self.image = Image.new("RGB", (64, 64), (120, 80, 40))
+        with MockLLMServer(delay_seconds=0.05) as server:
+            self.server = server
+            yield
+
+    def test_concurrent_agents_trace_to_their_own_observations(self):
+        photo_agent = ReactAgent(agent_signature=InferPhotoFeatures)
+        photo_agent.lm = self.server.lm(model="openai/mock-photo")
+        profile_agent = ReactAgent(agent_signature=InferProfileFeatures)
+        profile_agent.lm = self.server.lm(model="openai/mock-profile")
+        for agent in (photo_agent, profile_agent):
+            agent.callback.langfuse = RecordingLangfuse()
+
+        @observe()
+        async def traced(agent, **kwargs):
+            await agent.run(user_id="", use_cache=False, **kwargs)
+            return langfuse_context.get_current_trace_id()
+
+        photo_inputs = {"system_prompt": load_prompt("photo"), "image": self.image}
+        profile_inputs = {
+            "system_prompt": load_prompt("profile"),
+            "photo_analyses": [{"hair_color": "brown"}],
+            "profile_info": {"bio": "Likes hiking"},
+        }
+
+        async def run_all():
+            # Interleave both agents in one event loop
+            traces = await asyncio.gather(
+                *[traced(photo_agent, **photo_inputs) for _ in range(8)],
+                *[traced(profile_agent, **profile_inputs) for _ in range(8)],
+            )
+            return traces[:8], traces[8:]
+
+        photo_traces, profile_traces = asyncio.run(run_all())
+
+        photo_generations = photo_agent.callback.langfuse.generations
+        profile_generations = profile_agent.callback.langfuse.generations
+        assert len(photo_generations) == 8
+        assert len(profile_generations) == 8
+        assert {g["name"] for g in photo_generations} == {"openai/mock-photo"}
+        assert {g["name"] for g in profile_generations} == {"openai/mock-profile"}
+        # Every run opened exactly one generation, inside its own trace
+        assert sorted(g["trace_id"] for g in photo_generations) == sorted(photo_traces)
+        assert sorted(g["trace_id"] for g in profile_generations) == sorted(profile_traces)
+        # ...under the agent run's observation, not the trace root or another run
+        for generation in photo_generations + profile_generations:
+            assert generation["parent_observation_id"] != generation["trace_id"]
+        assert not photo_agent.callback.lm_calls and not photo_agent.callback.module_calls
+        assert not profile_agent.callback.lm_calls and not profile_agent.callback.module_calls
+
+
+class TestNativeAsync(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup):
+        self.image = Image.new("RGB", (64, 64), (120, 80, 40))
+        with MockLLMServer(delay_seconds=0.5) as server:
+            self.server = server
+            yield
+
+    def throughput(self, execution: str, concurrency: int) -> float:
+        agent = ReactAgent(agent_signature=InferPhotoFeatures, execution=execution)
+        agent.lm = self.server.lm()
+        calls = max(concurrency, 16)
+
+        async def run_all():
+            pending = asyncio.Semaphore(concurrency)
+
+            async def one():
+                async with pending:
+                    return await agent.run(
+                        user_id="",
+                        use_cache=False,
+                        system_prompt=load_prompt("photo"),
+                        image=self.image,
+                    )
+
+            start = time.perf_counter()
+            results = await asyncio.gather(*[one() for _ in range(calls)])
+            elapsed = time.perf_counter() - start
+            assert all(r.hair_color == "brown" for r in results)
+            return calls / elapsed
+
+        return asyncio.run(run_all())
+
+    def test_async_execution_shares_pooled_connections(self):
+        agent = ReactAgent(agent_signature=InferPhotoFeatures)
+        agent.lm = self.server.lm(lm_class=RateLimitedLM, num_retries=0)
+        assert agent.execution == "async"
+
+        async def run_all():
+            await asyncio.gather(*[
+                agent.run(
+                    user_id="",
+                    use_cache=False,
+                    system_prompt=load_prompt("photo"),
+                    image=self.image,
+                )
+                for _ in range(64)
+            ])
+            return llm_pool._loop_pool()
+
+        pool = asyncio.run(run_all())
+        assert len(self.server.requests) == 64
+        assert len(self.server.connections) <= global_config.llm_config.concurrency.max_in_flight
+        assert agent.usage.lm_calls == 64
+        # Every request used the loop's client, which was closed when the loop finished
+        assert [type(client).__name__ for client in pool.clients.values()] == ["AsyncOpenAI"]
+        assert pool.http_client.is_closed
+
+    @slow_test
+    def test_async_throughput_scales_past_worker_threads(self):
+        levels = [1, 8, 32, 128]
+        rates = {
+            execution: {level: self.throughput(execution, level) for level in levels}
+            for execution in ("thread", "async")
+        }
+
+        # Worker threads cap out at dspy's async_max_workers; the event loop keeps going
+        assert rates["async"][32] > 1.5 * rates["thread"][32]
+        assert rates["async"][128] > 1.5 * rates["thread"][128]
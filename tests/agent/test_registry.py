@@ -0,0 +1,40 @@
+import time
+
+import pytest
+
+from tests.test_template import TestTemplate, slow_test
+from src.agent.react_agent import ReactAgent
+from src.agent.registry import clear_agents, get_agent
+from src.algo.feature_extract import InferPhotoFeatures, InferProfileFeatures
+
+
+class TestAgentRegistry(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup):
+        clear_agents()
+        yield
+        clear_agents()
+
+    def test_agents_are_built_once_per_key(self):
+        photo_agent = get_agent(InferPhotoFeatures)
+        assert get_agent(InferPhotoFeatures) is photo_agent
+        assert get_agent(InferProfileFeatures) is not photo_agent
+        assert get_agent(InferPhotoFeatures, model_name="gemini/gemini-1.5-flash") is not photo_agent
+
+    @slow_test
+    def test_per_profile_setup_overhead(self):
+        profiles = 20
+
+        start = time.perf_counter()
+        for _ in range(profiles):
+            ReactAgent(agent_signature=InferPhotoFeatures)
+            ReactAgent(agent_signature=InferProfileFeatures)
+        before = (time.perf_counter() - start) / profiles
+
+        start = time.perf_counter()
+        for _ in range(profiles):
+            get_agent(InferPhotoFeatures)
+            get_agent(InferProfileFeatures)
+        after = (time.perf_counter() - start) / profiles
+
+        assert after < before
@@ -0,0 +1,83 @@
+import dspy
+import pytest
+from PIL import Image
+
+from tests.test_template import TestTemplate
+from src.agent.react_agent import ReactAgent
+from src.agent.result_cache import ResultCache
+from src.algo.feature_extract import InferPhotoFeatures, InferProfileFeatures
+
+LM_KWARGS = {"temperature": 0.5, "max_tokens": 1000}
+
+
+class TestResultCache(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup, tmp_path):
+        self.cache_path = str(tmp_path / "results.sqlite")
+        self.image = Image.new("RGB", (32, 32), (10, 20, 30))
+
+    def key(self, **overrides):
+        args = {
+            "signature": InferPhotoFeatures,
+            "model_name": "gemini/gemini-2.0-flash",
+            "lm_kwargs": LM_KWARGS,
+            "inputs": {"system_prompt": "photo prompt", "image": self.image},
+        }
+        args.update(overrides)
+        return ResultCache.key(**args)
+
+    def test_key_depends_on_content_not_identity(self):
+        same_pixels = self.key(inputs={"system_prompt": "photo prompt", "image": self.image.copy()})
+        assert self.key() == same_pixels
+
+        other_image = Image.new("RGB", (32, 32), (0, 0, 0))
+        assert self.key(inputs={"system_prompt": "photo prompt", "image": other_image}) != self.key()
+        assert self.key(inputs={"system_prompt": "edited prompt", "image": self.image}) != self.key()
+        assert self.key(signature=InferProfileFeatures) != self.key()
+        assert self.key(model_name="gpt-4o") != self.key()
+        assert self.key(lm_kwargs={**LM_KWARGS, "temperature": 0.0}) != self.key()
+        assert self.key(strategy="predict") != self.key(strategy="chain_of_thought")
+        assert self.key(backup_model="openai/gpt-4o-mini") != self.key()
+
+    def test_agent_key_covers_strategy_and_backup_model(self):
+        inputs = {"user_id": "", "system_prompt": "photo prompt", "image": self.image}
+        agents = [
+            ReactAgent(agent_signature=InferPhotoFeatures, strategy="predict"),
+            ReactAgent(agent_signature=InferPhotoFeatures, strategy="chain_of_thought"),
+            ReactAgent(agent_signature=InferPhotoFeatures, strategy="predict", backup_model_name="gemini/gemini-2.0-flash-lite"),
+        ]
+        assert len({agent.cache_key(inputs) for agent in agents}) == 3
+
+    def test_hits_survive_reopen(self):
+        cache = ResultCache(self.cache_path, ttl_seconds=None, max_entries=None)
+        assert cache.get(self.key()) is None
+        cache.set(self.key(), {"hair_color": "brown", "interests": ["surfing"]})
+
+        reopened = ResultCache(self.cache_path, ttl_seconds=None, max_entries=None)
+        assert reopened.get(self.key()) == {"hair_color": "brown", "interests": ["surfing"]}
+        assert reopened.metrics()["hits"] == 1
+        assert cache.metrics()["misses"] == 1
+
+    def test_ttl_and_size_eviction(self):
+        now = [1000.0]
+        cache = ResultCache(self.cache_path, ttl_seconds=60, max_entries=2, clock=lambda: now[0])
+        for i in range(3):
+            cache.set(f"key-{i}", {"i": i})
+            now[0] += 1
+        assert len(cache) == 2
+        assert cache.get("key-0") is None
+
+        # key-2 was stored at 1002
+        now[0] = 1062
+        assert cache.get("key-2") == {"i": 2}
+        now[0] = 1062.5
+        assert cache.get("key-2") is None
+
+    def test_predictions_are_fingerprinted_by_content(self):
+        analyses = [dspy.Prediction(hair_color="brown"), dspy.Prediction(hair_color="red")]
+        key = self.key(signature=InferProfileFeatures, inputs={"photo_analyses": analyses})
+        same = self.key(
+            signature=InferProfileFeatures,
+            inputs={"photo_analyses": [dspy.Prediction(hair_color="brown"), dspy.Prediction(hair_color="red")]},
+        )
+        assert key == same
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+from PIL import Image
+
+from tests.test_template import TestTemplate
+from tests.agent.mock_llm_server import DEFAULT_FIELDS, MockLLMServer
+from src.agent.react_agent import ReactAgent
+from src.algo.feature_extract import InferPhotoFeatures, InferProfileFeatures, load_prompt
+
+PHOTO_FIELDS = {name: DEFAULT_FIELDS[name] for name in InferPhotoFeatures.output_fields}
+MALFORMED = {"makeup_level": "lots", "activities": "hiking, then a nap"}
+
+
+class TestStructuredOutput(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup):
+        self.image = Image.new("RGB", (64, 64), (120, 80, 40))
+
+    def make_agent(self, server: MockLLMServer, output_mode: str, signature=InferPhotoFeatures) -> ReactAgent:
+        agent = ReactAgent(agent_signature=signature, output_mode=output_mode)
+        agent.lm = server.lm()
+        return agent
+
+    def run_photos(self, agent: ReactAgent, photos: int) -> list:
+        async def run_one():
+            try:
+                return await agent.run(
+                    user_id="",
+                    use_cache=False,
+                    system_prompt=load_prompt("photo"),
+                    image=self.image,
+                )
+            except ValueError:  # The text adapter could not parse the completion
+                return None
+
+        async def run_all():
+            return await asyncio.gather(*(run_one() for _ in range(photos)))
+
+        return asyncio.run(run_all())
+
+    def test_response_schema_comes_from_the_output_fields(self):
+        with MockLLMServer() as server:
+            agent = self.make_agent(server, "structured", InferProfileFeatures)
+            result = asyncio.run(agent.run(
+                user_id="",
+                use_cache=False,
+                system_prompt=load_prompt("profile"),
+                photo_analyses=[],
+                profile_info={},
+            ))
+
+        schema = server.requests[0]["response_format"]["json_schema"]["schema"]
+        assert set(schema["properties"]) == set(InferProfileFeatures.output_fields)
+        assert set(schema["required"]) == set(InferProfileFeatures.output_fields)
+        # Profile's enum values constrain the answer
+        lifestyle = schema["properties"]["lifestyle"]["anyOf"][0]
+        assert lifestyle["enum"] == ["active", "relaxed", "party", "intellectual", "unknown"]
+        assert result.lifestyle == "active"
+        assert result.party_frequency == 2
+        assert result.inferred_interests == ["hiking"]
+
+    def test_enum_fields_accept_any_case(self):
+        fields = {**DEFAULT_FIELDS, "lifestyle": "Active", "dating_style": " CASUAL"}
+        for output_mode in ["text", "structured"]:
+            with MockLLMServer(fields=fields) as server:
+                agent = self.make_agent(server, output_mode, InferProfileFeatures)
+                result = asyncio.run(agent.run(
+                    user_id="",
+                    use_cache=False,
+                    system_prompt=load_prompt("profile"),
+                    photo_analyses=[],
+                    profile_info={},
+                ))
+
+            assert (result.lifestyle, result.dating_style) == ("active", "casual")
+            assert len(server.requests) == 1
+
+    def test_only_invalid_fields_are_asked_again(self):
+        with MockLLMServer(fields=PHOTO_FIELDS, malformed_fields=MALFORMED, malformed_rate=1.0) as server:
+            agent = self.make_agent(server, "structured")
+            [result] = self.run_photos(agent, 1)
+
+        assert len(server.requests) == 2
+        retry = server.requests[1]
+        assert set(retry["response_format"]["json_schema"]["schema"]["properties"]) == set(MALFORMED)
+        assert "makeup_level" in retry["messages"][-1]["content"]
+        assert result.makeup_level == 2
+        assert result.activities == ["hiking"]
+        assert result.has_freckles is False
+
+        report = agent.output_stats.report()
+        assert report["parse_failure_rate"] == 1
+        assert report["field_retries"] == 1
+        assert report["unrecovered_fields"] == {}
+
+    def test_structured_output_saves_output_tokens_and_full_retries(self):
+        photos = 40
+        usage, failures = {}, {}
+        for output_mode in ["text", "structured"]:
+            with MockLLMServer(fields=PHOTO_FIELDS, malformed_fields=MALFORMED, malformed_rate=0.25) as server:
+                agent = self.make_agent(server, output_mode)
+                results = self.run_photos(agent, photos)
+            usage[output_mode] = agent.usage
+            failures[output_mode] = sum(result is None for result in results) / photos
+
+        report = agent.output_stats.report()
+
+        assert failures["text"] > 0
+        assert failures["structured"] == 0
+        assert 0 < report["parse_failure_rate"] < 1
+        assert report["field_failure_rates"]["makeup_level"] == report["parse_failure_rate"]
+        # Re-asking for two fields costs far less than the field markers of every text answer
+        assert usage["structured"].completion_tokens < usage["text"].completion_tokens
@@ -0,0 +1,112 @@
+import asyncio
+import json
+
+import dspy
+import pytest
+from PIL import Image
+
+from tests.test_template import TestTemplate
+from global_config import global_config
+from src.algo import feature_extract
+from src.algo.batch import BatchCheckpoint, JsonlProfileSink, run_batch, run_key
+from src.mobile_api.api import ProfileInfo
+from src.utils.photo_store import PhotoStore
+
+
+class CountingAgent:
+    """Mock agent that fails for photos of the profile named 'Broken' and tracks concurrency."""
+
+    in_flight = 0
+    max_in_flight = 0
+    models: set[str] = set()
+
+    def __init__(self, agent_signature, model_name, **kwargs):
+        self.output_fields = list(agent_signature.output_fields)
+        type(self).models.add(model_name)
+
+    async def run(self, user_id, **kwargs):
+        cls = type(self)
+        cls.in_flight += 1
+        cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if kwargs.get("profile_info", {}).get("name") == "Broken":
+                raise RuntimeError("injected failure")
+            return dspy.Prediction(**{field: None for field in self.output_fields})
+        finally:
+            cls.in_flight -= 1
+
+
+class TestBatchEngine(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup, tmp_path, monkeypatch):
+        monkeypatch.setattr(feature_extract, "get_agent", CountingAgent)
+        CountingAgent.in_flight = 0
+        CountingAgent.max_in_flight = 0
+        CountingAgent.models = set()
+
+        self.store = PhotoStore(str(tmp_path / "store"))
+        for n, name in enumerate(["Ada", "Bo", "Broken", "Cy", "Di", "Ed"]):
+            profile_info = ProfileInfo()
+            profile_info.name = name
+            profile_info.age = 20 + n
+            for i in range(3):
+                self.store.add(Image.new("RGB", (32, 32), (n * 40, i * 60, 0)), name)
+            self.store.record_profile_info(name, profile_info)
+
+        self.output_path = str(tmp_path / "out" / "profiles.jsonl")
+        self.checkpoint_path = str(tmp_path / "checkpoint.json")
+
+    def run(self, key: str = "v1"):
+        return asyncio.run(
+            run_batch(
+                self.store,
+                JsonlProfileSink(self.output_path, key=key),
+                BatchCheckpoint(self.checkpoint_path, key=key),
+                max_concurrent_profiles=3,
+            )
+        )
+
+    def output(self) -> list[dict]:
+        with open(self.output_path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_streams_results_and_isolates_failures(self):
+        report = self.run()
+
+        assert (report.profiles, report.failed, report.skipped) == (5, 1, 0)
+        records = self.output()
+        assert sorted(r["profile_id"] for r in records) == ["Ada", "Bo", "Cy", "Di", "Ed"]
+        ada = next(r for r in records if r["profile_id"] == "Ada")
+        assert ada["profile"]["age"] == 20
+        assert len(ada["profile"]["photos"]) == 3
+        assert report.per_minute()["profiles_per_min"] > 0
+        # Photos of several profiles were in flight together
+        assert CountingAgent.max_in_flight > 3
+
+    def test_checkpoint_resumes_and_prompt_change_rescores(self):
+        self.run()
+        resumed = self.run()
+        assert (resumed.profiles, resumed.skipped) == (0, 5)
+        # Only the previously failed profile is retried
+        assert resumed.failed == 1
+
+        rescored = self.run(key="v2")
+        assert (rescored.profiles, rescored.skipped) == (5, 0)
+        assert len(self.output()) == 10
+
+    def test_run_key_tracks_the_analysis_setup(self, monkeypatch):
+        keys = [run_key()]
+        for section, name, value in [
+            (global_config.agent, "chat_agent_model", "openai/gpt-4o-mini"),
+            (global_config.aggregation, "mode", "raw"),
+            (global_config.agent, "output_mode", "structured"),
+            (global_config.pre_analysis, "enabled", True),
+        ]:
+            monkeypatch.setattr(section, name, value)
+            keys.append(run_key())
+        assert len(set(keys)) == len(keys)
+
+        # The key's model is the one the analysis runs on
+        self.run()
+        assert CountingAgent.models == {"openai/gpt-4o-mini"}
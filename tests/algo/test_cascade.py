@@ -0,0 +1,106 @@
+import asyncio
+import os
+
+import dspy
+import pytest
+from PIL import Image
+
+from tests.test_template import TestTemplate
+from global_config import global_config
+from src.algo import cascade, feature_extract
+from src.algo.cascade import UNCERTAIN_FIELD, CascadeStats
+from src.algo.feature_extract import analyze_profile
+from src.mobile_api.api import ProfileInfo
+
+CHEAP = "mock/cheap"
+STRONG = "mock/strong"
+
+CHEAP_ANSWERS = {
+    "hair_color": "brown",
+    "age": 28,
+    "location_type": "outdoor",
+    "style": "casual",
+    "has_freckles": False,
+    "has_piercings": False,
+    UNCERTAIN_FIELD: [],
+}
+# Per photo, where the cheap tier falls short
+CHEAP_OVERRIDES = {
+    "plain": {},
+    "unsure": {UNCERTAIN_FIELD: ["style"]},
+    "missing": {"hair_color": None},
+    "outlier": {"age": 51},
+    "same": {},
+}
+
+
+class TierAgent:
+    """Fake agent for one (signature, model): the cheap tier stumbles on some photos, the strong one never does."""
+
+    calls: list[tuple] = []
+
+    def __init__(self, agent_signature, model_name=None, **kwargs):
+        self.output_fields = list(agent_signature.output_fields)
+        self.model_name = model_name
+
+    async def run(self, user_id, **kwargs):
+        image = kwargs.get("image")
+        if image is None:  # The profile aggregation agent
+            return dspy.Prediction(**{field: None for field in self.output_fields})
+        name = os.path.basename(image.filename).removeprefix("photo_").removesuffix(".png")
+        asked = set(self.output_fields) - {UNCERTAIN_FIELD}
+        type(self).calls.append((self.model_name, name, asked))
+        if self.model_name == CHEAP:
+            if name == "broken":
+                raise RuntimeError("injected failure")
+            answers = {**CHEAP_ANSWERS, **CHEAP_OVERRIDES[name]}
+        else:
+            answers = {**CHEAP_ANSWERS, "style": "strong", "hair_color": "strong", "age": 29}
+        return dspy.Prediction(**{field: answers.get(field) for field in self.output_fields})
+
+
+class TestCascade(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup, tmp_path, monkeypatch):
+        monkeypatch.setattr(feature_extract, "get_agent", TierAgent)
+        monkeypatch.setattr(global_config.agent.cascade, "enabled", True)
+        monkeypatch.setattr(global_config.agent.cascade, "tiers", [CHEAP, STRONG])
+        monkeypatch.setattr(cascade, "cascade_stats", CascadeStats())
+        TierAgent.calls = []
+
+        self.photo_paths = []
+        for name in ["plain", "unsure", "missing", "outlier", "same", "broken"]:
+            path = tmp_path / f"photo_{name}.png"
+            Image.new("RGB", (64, 64), (120, 80, 40)).save(path)
+            self.photo_paths.append(str(path))
+
+    def test_only_doubtful_fields_are_escalated(self):
+        profile = asyncio.run(analyze_profile(self.photo_paths, ProfileInfo()))
+
+        escalated = {name: fields for model, name, fields in TierAgent.calls if model == STRONG}
+        assert escalated == {
+            "unsure": {"style"},
+            "missing": {"hair_color"},
+            "outlier": {"age"},
+            # A photo the cheap tier failed on is re-analysed in full
+            "broken": set(feature_extract.InferPhotoFeatures.output_fields),
+        }
+
+        photos = {os.path.basename(p)[6:-4]: photo for p, photo in zip(self.photo_paths, profile.photos)}
+        assert photos["plain"].style == "casual"
+        assert photos["unsure"].style == "strong"
+        assert photos["unsure"].hair_color == "brown"
+        assert photos["missing"].hair_color == "strong"
+        assert photos["broken"].style == "strong"
+        assert len(profile.photos) == len(self.photo_paths)
+
+    def test_report_escalation_rates_per_field(self):
+        asyncio.run(analyze_profile(self.photo_paths, ProfileInfo()))
+
+        report = cascade.cascade_stats.report()
+        assert report["photos"] == 6
+        strong = report["tiers"][STRONG]
+        assert strong["photo_escalation_rate"] == pytest.approx(4 / 6)
+        assert strong["field_escalation_rates"]["style"] == pytest.approx(2 / 6)
+        assert strong["field_escalation_rates"]["age"] == pytest.approx(2 / 6)
+        assert report["tiers"][CHEAP]["photo_escalation_rate"] == 0
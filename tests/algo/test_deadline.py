@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+import dspy
+import pytest
+from PIL import Image
+
+from tests.test_template import TestTemplate
+from global_config import global_config
+from src.algo import feature_extract
+from src.algo.feature_extract import analyze_profile
+from src.mobile_api.api import ProfileInfo
+
+HUNG = 255
+
+
+class HangingAgent:
+    """Fake agent that never answers for photos whose red channel is HUNG, nor for aggregation if asked."""
+
+    hang_aggregation = False
+
+    def __init__(self, agent_signature, **kwargs):
+        self.output_fields = list(agent_signature.output_fields)
+
+    async def run(self, user_id, **kwargs):
+        image = kwargs.get("image")
+        if image is None:
+            if type(self).hang_aggregation:
+                await asyncio.sleep(30)
+            answers = {"bio": "aggregated"}
+        else:
+            red = image.getpixel((0, 0))[0]
+            if red == HUNG:
+                await asyncio.sleep(30)
+            answers = {"hair_color": f"shade {red}"}
+        return dspy.Prediction(**{field: answers.get(field) for field in self.output_fields})
+
+
+class TestLatencyBudget(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup, tmp_path, monkeypatch):
+        monkeypatch.setattr(feature_extract, "get_agent", HangingAgent)
+        monkeypatch.setattr(feature_extract, "_report_tokens", lambda *args, **kwargs: None)
+        monkeypatch.setattr(global_config.analysis, "aggregation_reserve_seconds", 0.3)
+        HangingAgent.hang_aggregation = False
+
+        self.photo_paths = []
+        for i, red in enumerate([10, HUNG, 30]):
+            path = tmp_path / f"photo_{i}.png"
+            Image.new("RGB", (32, 32), (red, 80, 40)).save(path)
+            self.photo_paths.append(str(path))
+
+    def analyze(self, deadline_seconds):
+        start = time.perf_counter()
+        profile = asyncio.run(analyze_profile(self.photo_paths, ProfileInfo(), deadline_seconds=deadline_seconds))
+        return profile, time.perf_counter() - start
+
+    def test_hung_photo_is_cancelled_and_the_rest_aggregated(self):
+        profile, elapsed = self.analyze(deadline_seconds=1.0)
+
+        assert elapsed < 1.5
+        assert profile.partial
+        assert [photo.hair_color for photo in profile.photos] == ["shade 10", "shade 30"]
+        assert profile.bio == "aggregated"
+
+    def test_hung_aggregation_leaves_the_photos(self):
+        self.photo_paths = [self.photo_paths[0], self.photo_paths[2]]
+        HangingAgent.hang_aggregation = True
+
+        profile, elapsed = self.analyze(deadline_seconds=1.0)
+
+        assert elapsed < 1.5
+        assert profile.partial
+        assert len(profile.photos) == 2
+        assert profile.bio != "aggregated"
+
+    def test_within_budget_is_not_partial(self):
+        self.photo_paths = [self.photo_paths[0], self.photo_paths[2]]
+
+        profile, _ = self.analyze(deadline_seconds=5.0)
+
+        assert not profile.partial
+        assert profile.bio == "aggregated"
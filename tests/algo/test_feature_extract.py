@@ -0,0 +1,167 @@
+import asyncio
+import time
+import tracemalloc
+
+import dspy
+import pytest
+from dspy.clients.base_lm import GLOBAL_HISTORY
+from PIL import Image
+
+from tests.test_template import TestTemplate, slow_test
+from tests.agent.mock_llm_server import MockLLMServer
+from global_config import global_config
+from src.agent.react_agent import ReactAgent
+from src.algo import feature_extract
+from src.algo.feature_extract import analyze_profile, analyze_profile_stream
+from src.mobile_api.api import ProfileInfo
+
+
+class TestAnalyzeProfileMemory(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup, tmp_path, monkeypatch):
+        # Fewer decoded images than concurrent photos, so the image cap is what limits requests
+        monkeypatch.setattr(global_config.analysis, "max_decoded_images", 2)
+        monkeypatch.setattr(global_config.analysis, "max_concurrent_photos", 6)
+        monkeypatch.setattr(global_config.llm_cache, "enabled", False)
+
+        self.photo_paths = []
+        for i in range(6):
+            path = tmp_path / f"photo_{i}.png"
+            Image.effect_noise((200, 250), 64 + i).convert("RGB").save(path)
+            self.photo_paths.append(str(path))
+
+        self.profile_info = ProfileInfo()
+        self.profile_info.name = "Synthetic"
+        self.profile_info.age = 30
+
+        # Real ReactAgents, one per signature as the registry would build them, against a local server
+        with MockLLMServer(delay_seconds=0.01) as server:
+            self.server = server
+            self.agents = {}
+            monkeypatch.setattr(feature_extract, "get_agent", self.get_agent)
+            yield
+
+    def get_agent(self, agent_signature, model_name=None):
+        if agent_signature not in self.agents:
+            agent = ReactAgent(agent_signature=agent_signature)
+            agent.lm = self.server.lm()
+            self.agents[agent_signature] = agent
+        return self.agents[agent_signature]
+
+    @slow_test
+    def test_peak_memory_flat_across_profiles(self):
+        async def run_profiles(count: int) -> list[int]:
+            peaks = []
+            for _ in range(count):
+                tracemalloc.reset_peak()
+                profile = await analyze_profile(self.photo_paths, self.profile_info)
+                assert profile.photos[0].hair_color == "brown"
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                self.server.requests.clear()  # The server's record of each base64 prompt is not under test
+            return peaks
+
+        tracemalloc.start()
+        try:
+            peaks = asyncio.run(run_profiles(40))
+        finally:
+            tracemalloc.stop()
+
+        # Later profiles must not need more memory than the first ones did
+        assert max(peaks[-10:]) <= max(peaks[:10]) * 1.2
+        # Every call was made, but only the last few records, each with a base64 prompt, are kept
+        history_size = global_config.llm_config.history_size
+        assert sum(agent.usage.lm_calls for agent in self.agents.values()) == 40 * 7
+        assert len(GLOBAL_HISTORY) <= history_size
+        assert len(dspy.settings.trace) <= history_size
+        assert all(len(agent.lm.history) <= history_size for agent in self.agents.values())
+        # Photo requests were in flight together, but never more than the decoded-image cap
+        assert self.server.max_in_flight == global_config.analysis.max_decoded_images
+
+
+class DelayedAgent:
+    """Mock LLM agent with injected latency; fails on photos whose name contains 'broken'."""
+
+    delay_seconds = 0.2
+    started: list[float] = []
+
+    def __init__(self, agent_signature, **kwargs):
+        self.output_fields = list(agent_signature.output_fields)
+
+    async def run(self, user_id, **kwargs):
+        type(self).started.append(time.perf_counter())
+        await asyncio.sleep(self.delay_seconds)
+        image = kwargs.get("image")
+        name = image.filename if image is not None else ""
+        if "broken" in name:
+            raise RuntimeError("injected failure")
+        prediction = {field: None for field in self.output_fields}
+        if "hair_color" in prediction:
+            prediction["hair_color"] = name
+        return dspy.Prediction(**prediction)
+
+
+class TestParallelPhotoAnalysis(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup, tmp_path, monkeypatch):
+        monkeypatch.setattr(feature_extract, "get_agent", DelayedAgent)
+        DelayedAgent.started = []
+
+        self.photo_paths = []
+        for name in ["a", "b", "broken", "c", "d", "e", "f", "g"]:
+            path = tmp_path / f"photo_{name}.png"
+            Image.new("RGB", (64, 64), (len(name) * 20, 0, 0)).save(path)
+            self.photo_paths.append(str(path))
+
+        self.profile_info = ProfileInfo()
+
+    def test_order_is_stable_and_failures_are_isolated(self):
+        profile = asyncio.run(analyze_profile(self.photo_paths, self.profile_info))
+
+        expected = [p for p in self.photo_paths if "broken" not in p]
+        assert [photo.hair_color for photo in profile.photos] == expected
+
+    def test_stream_analyses_photos_while_capture_continues(self):
+        arrival_gap = 0.1
+
+        async def run():
+            photo_queue = asyncio.Queue()
+
+            async def capture():
+                for path in self.photo_paths:
+                    await asyncio.sleep(arrival_gap)
+                    await photo_queue.put(path)
+                # Details found on the last screen must still reach aggregation
+                self.profile_info.name = "Late Name"
+                await photo_queue.put(None)
+                return time.perf_counter()
+
+            capture_done, profile = await asyncio.gather(
+                capture(), analyze_profile_stream(photo_queue, self.profile_info)
+            )
+            return capture_done, profile
+
+        capture_done, profile = asyncio.run(run())
+
+        expected = [p for p in self.photo_paths if "broken" not in p]
+        assert [photo.hair_color for photo in profile.photos] == expected
+        assert profile.name == "Late Name"
+        # Every photo but the last was already being analysed while capture was still running
+        photo_starts = DelayedAgent.started[:len(self.photo_paths)]
+        assert sum(start < capture_done for start in photo_starts) == len(self.photo_paths) - 1
+
+    @slow_test
+    def test_concurrent_latency_beats_sequential(self):
+        def timed(max_concurrent_photos: int) -> float:
+            start = time.perf_counter()
+            asyncio.run(
+                analyze_profile(
+                    self.photo_paths,
+                    self.profile_info,
+                    max_concurrent_photos=max_concurrent_photos,
+                )
+            )
+            return time.perf_counter() - start
+
+        sequential = timed(1)
+        concurrent = timed(4)
+        assert concurrent < sequential / 2
@@ -0,0 +1,95 @@
+import asyncio
+
+import dspy
+import pytest
+from PIL import Image
+
+from tests.test_template import TestTemplate
+from src.algo import feature_extract
+from src.algo.feature_extract import analyze_profile
+from src.algo.incremental import ProfileAnalysisStore, Revisit
+from src.mobile_api.api import ProfileInfo
+
+
+class CountingAgent:
+    """Fake agent counting photo and aggregation runs; photo answers depend on the pixels."""
+
+    photo_runs = 0
+    aggregation_runs = 0
+
+    def __init__(self, agent_signature, **kwargs):
+        self.output_fields = list(agent_signature.output_fields)
+
+    async def run(self, user_id, **kwargs):
+        image = kwargs.get("image")
+        if image is None:
+            type(self).aggregation_runs += 1
+            answers = {"bio": str(kwargs["profile_info"]["prompts"])}
+            return dspy.Prediction(**{field: answers.get(field) for field in self.output_fields})
+        type(self).photo_runs += 1
+        red = image.getpixel((0, 0))[0]
+        answers = {"hair_color": f"shade {red}"}
+        return dspy.Prediction(**{field: answers.get(field) for field in self.output_fields})
+
+
+class TestIncrementalReanalysis(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup, tmp_path, monkeypatch):
+        monkeypatch.setattr(feature_extract, "get_agent", CountingAgent)
+        CountingAgent.photo_runs = 0
+        CountingAgent.aggregation_runs = 0
+        self.tmp_path = tmp_path
+        self.analyses = ProfileAnalysisStore(root=str(tmp_path / "analyses"), key="setup-1")
+        self.reports = []
+        monkeypatch.setattr(
+            feature_extract, "_report_tokens",
+            lambda profile, tokens, revisit=None, **_: self.reports.append(revisit.report()),
+        )
+
+    def photo(self, red: int, name: str) -> str:
+        # A fresh path each capture: photos are matched by pixels, not by file
+        path = self.tmp_path / f"{name}.png"
+        Image.new("RGB", (32, 32), (red, 80, 40)).save(path)
+        return str(path)
+
+    def visit(self, reds: list[int], prompts: list[str], capture: int, analyses=None):
+        profile_info = ProfileInfo()
+        profile_info.name = "Revisited"
+        profile_info.prompts = prompts
+        paths = [self.photo(red, f"capture{capture}_{i}") for i, red in enumerate(reds)]
+        before = (CountingAgent.photo_runs, CountingAgent.aggregation_runs)
+        profile = asyncio.run(analyze_profile(
+            paths, profile_info, revisit=Revisit(analyses or self.analyses, "revisited_29")
+        ))
+        runs = (CountingAgent.photo_runs - before[0], CountingAgent.aggregation_runs - before[1])
+        return profile, runs
+
+    def test_only_new_photos_and_changed_inputs_are_analysed(self):
+        _, runs = self.visit([10, 20, 30], ["Likes hiking"], capture=1)
+        assert runs == (3, 1)
+
+        # Unchanged capture: nothing to redo
+        profile, runs = self.visit([10, 20, 30], ["Likes hiking"], capture=2)
+        assert runs == (0, 0)
+        assert [p.hair_color for p in profile.photos] == ["shade 10", "shade 20", "shade 30"]
+        assert profile.bio == "['Likes hiking']"
+        assert self.reports[-1]["aggregation_reused"] and self.reports[-1]["reused_photos"] == 3
+        assert self.reports[-1]["changed_profile_fields"] == []
+
+        # One new photo: only it is analysed, and the aggregation sees it
+        profile, runs = self.visit([10, 20, 30, 40], ["Likes hiking"], capture=3)
+        assert runs == (1, 1)
+        assert [p.hair_color for p in profile.photos][-1] == "shade 40"
+
+        # Edited prompt: every photo is reused, the aggregation re-runs
+        profile, runs = self.visit([10, 20, 30, 40], ["Likes climbing"], capture=4)
+        assert runs == (0, 1)
+        assert profile.bio == "['Likes climbing']"
+        assert self.reports[-1]["changed_profile_fields"] == ["prompts"]
+        assert self.reports[-1]["new_photos"] == 0
+
+    def test_analyses_from_another_setup_are_not_reused(self):
+        self.visit([10, 20], ["Likes hiking"], capture=1)
+        other_setup = ProfileAnalysisStore(root=self.analyses.root, key="setup-2")
+        _, runs = self.visit([10, 20], ["Likes hiking"], capture=2, analyses=other_setup)
+        assert runs == (2, 1)
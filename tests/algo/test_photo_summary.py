@@ -0,0 +1,68 @@
+import json
+
+import dspy
+import pytest
+
+from tests.test_template import TestTemplate
+from src.algo.feature_extract import InferPhotoFeatures, InferProfileFeatures, InferProfileFeaturesFromSummary, load_prompt
+from src.algo.photo_summary import should_summarize, summarize_photos
+
+HAIR = ["brown", "brown", "Blonde", None]
+
+
+def photo_analysis(i: int) -> dspy.Prediction:
+    return dspy.Prediction(
+        has_freckles=i % 3 == 0,
+        hair_color=HAIR[i % len(HAIR)],
+        has_piercings=False,
+        makeup_level=1 + i % 4,
+        activities=["Hiking", "hiking ", f"trip {i % 7}"],
+        location_type="outdoor" if i % 2 else "indoor",
+        style="casual",
+        bio=f"Photo {i}: " + "enjoys long walks along the coast and trying new cafés. " * 6,
+        age=27 + i % 3,
+        interests=["travel", "coffee", f"hobby {i}"],
+        personality_traits=["curious", "Curious"],
+    )
+
+
+class TestPhotoSummary(TestTemplate):
+    def test_fields_are_merged_by_type(self):
+        summary = summarize_photos([photo_analysis(i) for i in range(8)], InferPhotoFeatures.output_fields)
+        fields = summary["fields"]
+
+        assert summary["photo_count"] == 8
+        assert fields["has_freckles"] == {"yes": 3, "no": 5}
+        assert fields["makeup_level"] == {"median": 2.5, "range": [1, 4]}
+        assert fields["age"]["range"] == [27, 29]
+        assert fields["hair_color"] == {"brown": 4, "Blonde": 2}
+        # List items are deduplicated within and across photos
+        assert fields["activities"]["hiking"] == 8
+        assert fields["personality_traits"] == {"curious": 8}
+        assert all(len(bio) <= 201 for bio in fields["bio"])
+
+    def test_aggregation_prompt_stays_bounded(self):
+        def prompt_chars(signature, photo_analyses) -> int:
+            messages = dspy.ChatAdapter().format(signature, demos=[], inputs={
+                "system_prompt": load_prompt("profile"),
+                "photo_analyses": photo_analyses,
+                "profile_info": {"name": "Many Photos", "prompts": ["Two truths and a lie"]},
+            })
+            return len(json.dumps(messages))
+
+        sizes = {}
+        for photos in [6, 60]:
+            analyses = [photo_analysis(i) for i in range(photos)]
+            sizes[photos] = (
+                prompt_chars(InferProfileFeatures, analyses),
+                prompt_chars(InferProfileFeaturesFromSummary, summarize_photos(analyses, InferPhotoFeatures.output_fields)),
+            )
+
+        raw_growth = sizes[60][0] - sizes[6][0]
+        summary_growth = sizes[60][1] - sizes[6][1]
+        assert summary_growth < raw_growth / 50
+        assert sizes[60][1] < sizes[60][0] / 5
+
+    @pytest.mark.parametrize("photos, summarized", [(1, False), (3, False), (4, True)])
+    def test_small_profiles_are_sent_raw(self, photos, summarized):
+        assert should_summarize(photos) is summarized
@@ -0,0 +1,113 @@
+import asyncio
+
+import dspy
+import pytest
+from PIL import Image, ImageDraw
+
+from tests.test_template import TestTemplate
+from global_config import global_config
+from src.algo import feature_extract
+from src.algo.feature_extract import InferPhotoFeatures, analyze_profile
+from src.algo.pre_analysis import HINTS_FIELD, PhotoPixels, estimate_hair_color, pre_analyze
+from src.mobile_api.api import ProfileInfo
+
+FACE = (40, 60, 100, 130)
+
+
+def outdoor_photo() -> Image.Image:
+    image = Image.new("RGB", (160, 200), (60, 140, 50))
+    ImageDraw.Draw(image).rectangle((0, 0, 160, 90), fill=(120, 180, 240))
+    return image
+
+
+def indoor_photo() -> Image.Image:
+    return Image.new("RGB", (160, 200), (200, 180, 150))
+
+
+def portrait(hair: tuple) -> Image.Image:
+    image = Image.new("RGB", (160, 200), (128, 128, 128))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((FACE[0], 30, FACE[2], FACE[1]), fill=hair)
+    draw.rectangle(FACE, fill=(225, 180, 150))
+    return image
+
+
+class RecordingAgent:
+    """Fake agent answering every photo field it is asked for, recording each request."""
+
+    requests: list[tuple] = []
+
+    def __init__(self, agent_signature, **kwargs):
+        self.signature = agent_signature
+
+    async def run(self, user_id, **kwargs):
+        type(self).requests.append((set(self.signature.output_fields), kwargs.get(HINTS_FIELD)))
+        # The profile aggregation agent leaves everything null
+        answer = "llm" if "has_freckles" in self.signature.output_fields else None
+        return dspy.Prediction(**{field: answer for field in self.signature.output_fields})
+
+
+class TestEstimators(TestTemplate):
+    def test_sky_means_outdoor(self):
+        estimates = pre_analyze(outdoor_photo(), ["location_type"])
+        assert estimates["location_type"].value == "outdoor"
+        assert estimates["location_type"].confidence >= global_config.pre_analysis.skip_confidence
+
+    def test_no_sky_or_foliage_is_only_a_hint_of_indoor(self):
+        estimate = pre_analyze(indoor_photo(), ["location_type"])["location_type"]
+        assert estimate.value == "indoor"
+        assert global_config.pre_analysis.hint_confidence <= estimate.confidence < global_config.pre_analysis.skip_confidence
+
+    @pytest.mark.parametrize("hair, name", [
+        ((230, 200, 110), "blonde"),
+        ((170, 50, 20), "red"),
+        ((20, 15, 15), "black"),
+        ((100, 65, 40), "brown"),
+    ])
+    def test_hair_color_above_the_face(self, hair, name):
+        estimate = estimate_hair_color(PhotoPixels(portrait(hair), faces=[FACE]))
+        assert estimate.value == name
+        assert estimate.confidence > 0.9
+
+    def test_no_face_no_hair_color(self):
+        assert estimate_hair_color(PhotoPixels(portrait((20, 15, 15)), faces=[])) is None
+
+
+class TestPreAnalysisStage(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup, tmp_path, monkeypatch):
+        monkeypatch.setattr(feature_extract, "get_agent", RecordingAgent)
+        monkeypatch.setattr(global_config.pre_analysis, "enabled", True)
+        monkeypatch.setattr(global_config.pre_analysis, "estimators", ["location_type"])
+        RecordingAgent.requests = []
+
+        self.photo_paths = []
+        for i, image in enumerate([outdoor_photo(), outdoor_photo(), indoor_photo()]):
+            path = tmp_path / f"photo_{i}.png"
+            image.save(path)
+            self.photo_paths.append(str(path))
+
+        self.reports = []
+        monkeypatch.setattr(
+            feature_extract, "_report_tokens",
+            lambda profile, tokens, pre_analysis=None, **_: self.reports.append(pre_analysis.report()),
+        )
+
+    def test_confident_estimates_replace_llm_fields_and_the_rest_are_hints(self):
+        profile = asyncio.run(analyze_profile(self.photo_paths, ProfileInfo()))
+
+        photo_requests = [r for r in RecordingAgent.requests if "has_freckles" in r[0]]
+        outdoor = [r for r in photo_requests if "location_type" not in r[0]]
+        indoor = [r for r in photo_requests if "location_type" in r[0]]
+        assert len(outdoor) == 2 and len(indoor) == 1
+        assert all(hints is None for _, hints in outdoor)
+        assert indoor[0][1]["location_type"]["value"] == "indoor"
+        assert set(InferPhotoFeatures.output_fields) - outdoor[0][0] == {"location_type"}
+
+        assert [photo.location_type for photo in profile.photos] == ["outdoor", "outdoor", "llm"]
+        assert self.reports == [{
+            "photos": 3,
+            "avoided_output_fields": 2,
+            "answered_fields": {"location_type": 2},
+            "hinted_fields": {"location_type": 1},
+        }]
@@ -0,0 +1,87 @@
+import asyncio
+from types import SimpleNamespace
+
+import dspy
+import pytest
+
+from tests.test_template import TestTemplate
+from src.agent.result_cache import ResultCache
+from src.algo import reply_drafts
+from src.algo.reply_drafts import DraftReplies, draft_replies, submit_best_reply
+from src.mobile_api.api import ProfileInfo, SubjectPair
+
+
+class DraftingAgent:
+    """Fake drafting agent answering every subject it is sent, recording each call's subjects."""
+
+    def __init__(self):
+        self.lm = SimpleNamespace(model="mock/drafts", kwargs={})
+        self.calls: list[list[dict]] = []
+
+    def cache_key(self, inputs):
+        return ResultCache.key(DraftReplies, self.lm.model, self.lm.kwargs, inputs)
+
+    async def run(self, user_id, use_cache, my_data, profile_info, subjects):
+        self.calls.append(subjects)
+        return dspy.Prediction(drafts={
+            subject["id"]: [f"Best reply to {subject['content']}", f"Other reply to {subject['content']}"]
+            for subject in subjects
+        })
+
+
+class RecordingAPI:
+    def __init__(self):
+        self.replies = []
+
+    def submit_reply(self, subject_id, response_text):
+        self.replies.append((subject_id, response_text))
+        return True
+
+
+def subject(content: str, top: int) -> SubjectPair:
+    return SubjectPair(f"text:({top})", content, (900, top, 1000, top + 100), (0, top, 1080, top + 300))
+
+
+class TestReplyDrafts(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup, tmp_path, monkeypatch):
+        self.agent = DraftingAgent()
+        cache = ResultCache(path=str(tmp_path / "results.sqlite"))
+        monkeypatch.setattr(reply_drafts, "get_agent", lambda signature: self.agent)
+        monkeypatch.setattr(reply_drafts, "get_result_cache", lambda: cache)
+        self.profile_info = ProfileInfo()
+        self.profile_info.name = "Drafted"
+
+    def draft(self, pairs):
+        return asyncio.run(draft_replies(pairs, self.profile_info))
+
+    def test_all_subjects_drafted_in_one_call_and_cached(self):
+        pairs = [subject("I geek out on ramen", 100), subject("Last trip: Colombia", 500), subject("Sunday plans", 900)]
+
+        drafts = self.draft(pairs)
+
+        assert len(self.agent.calls) == 1
+        assert list(drafts) == [pair.subject_id for pair in pairs]
+        assert drafts["text:(500)"][0] == "Best reply to Last trip: Colombia"
+
+        # Revisited, after scrolling moved every subject: no new calls
+        moved = [subject(pair.subject_content, top + 40) for pair, top in zip(pairs, [100, 500, 900])]
+        assert list(self.draft(moved).values()) == list(drafts.values())
+        assert len(self.agent.calls) == 1
+
+        # A new subject is the only one drafted
+        self.draft(moved + [subject("Two truths and a lie", 1300)])
+        assert [s["content"] for s in self.agent.calls[-1]] == ["Two truths and a lie"]
+
+        # The same subject on another profile is drafted for that profile
+        self.profile_info = ProfileInfo()
+        self.profile_info.name = "Someone else"
+        self.draft(pairs[:1])
+        assert [s["content"] for s in self.agent.calls[-1]] == ["I geek out on ramen"]
+
+    def test_best_draft_is_submitted(self):
+        pairs = [subject("I geek out on ramen", 100), subject("Last trip: Colombia", 500)]
+        api = RecordingAPI()
+
+        assert submit_best_reply(api, self.draft(pairs), "text:(500)")
+        assert api.replies == [("text:(500)", "Best reply to Last trip: Colombia")]
@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+import dspy
+import litellm
+import pytest
+
+from global_config import global_config
+from tests.test_template import TestTemplate
+from tests.agent.mock_llm_server import MockLLMServer
+from src.agent.batch_api import BatchJobs
+from src.algo.batch import load_profile_info, run_key
+from src.algo.feature_extract import InferPhotoFeatures, aggregation_request
+from src.algo.incremental import ProfileAnalysisStore, inputs_key
+from src.algo.rescore import rescore_profiles, rescored_store
+
+
+def record(name: str, hair: list[str]) -> dict:
+    return {
+        "photos": {
+            f"hash-{i}": {**dict.fromkeys(InferPhotoFeatures.output_fields), "hair_color": color, "activities": ["hiking"]}
+            for i, color in enumerate(hair)
+        },
+        "profile_info": {"name": name, "prompts": ["Two truths and a lie"]},
+        "aggregation": {"inputs": "stored before the prompt changed", "outputs": {"bio": "stale"}},
+    }
+
+
+class TestBatchRescoring(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup, tmp_path):
+        self.analyses = ProfileAnalysisStore(root=str(tmp_path / "analyses"), key="setup-1")
+        for profile_id, name, hair in [("ana_29", "Ana", ["brown"]), ("bo_31", "Bo", ["black", "black", "red", "black"])]:
+            self.analyses.put(profile_id, record(name, hair))
+
+        # One profile whose aggregation already matches its inputs
+        current = record("Cy", ["blonde"])
+        photos = [dspy.Prediction(**analysis) for analysis in current["photos"].values()]
+        _, inputs, _ = aggregation_request(photos, load_profile_info(current["profile_info"]))
+        current["aggregation"]["inputs"] = inputs_key(**inputs)
+        self.analyses.put("cy_27", current)
+
+        self.profiles = {}
+        with MockLLMServer(batch_polls=3) as server:
+            self.server = server
+            self.jobs = BatchJobs(
+                model_name="openai/gpt-4o-mini", api_base=server.url, api_key="mock", poll_seconds=0.01
+            )
+            yield
+
+    def rescore(self):
+        return asyncio.run(rescore_profiles(self.analyses, self.profiles.__setitem__, self.jobs))
+
+    def test_batch_jobs_default_to_the_configured_key(self, monkeypatch):
+        monkeypatch.setattr(global_config, "OPENAI_API_KEY", None)
+        assert BatchJobs().api_key is None
+        monkeypatch.setattr(global_config, "OPENAI_API_KEY", "sk-from-env")
+        assert BatchJobs().api_key == "sk-from-env"
+
+    def test_changed_profiles_are_rescored_in_one_batch_job(self):
+        report = self.rescore()
+
+        assert (report.profiles, report.up_to_date, report.failed) == (2, 1, 0)
+        assert sorted(self.profiles) == ["ana_29", "bo_31"]
+        assert self.profiles["bo_31"].bio == "Enjoys the outdoors."
+        assert [photo.hair_color for photo in self.profiles["bo_31"].photos] == ["black", "black", "red", "black"]
+        # One job, no interactive requests
+        assert len(self.server.batches) == 1 and not self.server.requests
+        assert sorted(line["custom_id"] for line in self.server.batch_requests) == ["ana_29", "bo_31"]
+        # The completion budget is capped at the model's output limit
+        assert {line["body"]["max_tokens"] for line in self.server.batch_requests} == {16384}
+
+        # Usage is what the job's output file reported, priced at the model's interactive rates
+        [batch] = self.server.batches.values()
+        usage = [json.loads(line)["response"]["body"]["usage"] for line in self.server.files[batch["output_file_id"]].splitlines()]
+        assert report.prompt_tokens == sum(u["prompt_tokens"] for u in usage) > 0
+        assert report.completion_tokens == sum(u["completion_tokens"] for u in usage) > 0
+        prompt_cost, completion_cost = litellm.cost_per_token(
+            model="openai/gpt-4o-mini", prompt_tokens=report.prompt_tokens, completion_tokens=report.completion_tokens
+        )
+        assert report.interactive_cost == pytest.approx(prompt_cost + completion_cost)
+        assert report.per_profile()["tokens_per_profile"] == (report.prompt_tokens + report.completion_tokens) / 2
+
+        # Results were stored apart under the batch model's run key: the interactive records keep
+        # their photo analyses for the next revisit, and a second pass has nothing to do
+        rescored = rescored_store(self.analyses, "openai/gpt-4o-mini")
+        assert rescored.key == run_key(model="openai/gpt-4o-mini")
+        assert rescored.get("bo_31")["aggregation"]["outputs"]["bio"] == "Enjoys the outdoors."
+        assert self.analyses.get("bo_31")["aggregation"]["outputs"]["bio"] == "stale"
+        assert len(self.analyses.get("bo_31")["photos"]) == 4
+        report = self.rescore()
+        assert (report.profiles, report.up_to_date) == (0, 3)
+        assert len(self.server.batches) == 1
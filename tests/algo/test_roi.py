@@ -0,0 +1,84 @@
+import pytest
+from PIL import Image, ImageDraw
+
+from tests.test_template import TestTemplate
+from src.agent.image_tokens import estimate_image_tokens
+from src.algo import feature_extract, pre_analysis, roi
+from src.algo.roi import detect_subject, expand_box, input_tokens, prepare_photo_inputs
+
+FACE = (300, 200, 400, 320)
+
+
+def photo(size=(800, 1000)) -> Image.Image:
+    """A flat photo card with a single textured subject on it."""
+    image = Image.new("RGB", size, (200, 200, 200))
+    draw = ImageDraw.Draw(image)
+    for y in range(FACE[1], 700, 10):
+        draw.rectangle((250, y, 450, y + 4), fill=(40, 40, 40))
+    return image
+
+
+class TestRegionOfInterest(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup, monkeypatch):
+        # Stand in for the OpenCV detectors, so crop boxes are checked on a known face
+        self.faces = [FACE]
+        monkeypatch.setattr(roi, "detect_faces", lambda gray: list(self.faces))
+        monkeypatch.setattr(roi, "_detect_people", lambda rgb: [])
+
+    def test_face_extends_to_head_and_shoulders(self):
+        subject_box, face_box, source = detect_subject(photo())
+
+        assert face_box == FACE
+        assert subject_box == (300, 200, 400, 200 + 3 * 120)
+        assert source == "opencv_face"
+
+    def test_tight_crop_keeps_a_margin_around_the_subject(self):
+        inputs = prepare_photo_inputs(photo(), mode="tight", margin=0.1)
+
+        # Subject (300, 200, 400, 560) grown by 10 and 36 px on every side
+        assert inputs["image"].size == (120, 432)
+
+    def test_dual_mode_sends_a_low_res_image_and_a_face_crop(self, monkeypatch):
+        monkeypatch.setattr(roi.global_config.roi, "low_res_side", 384)
+        monkeypatch.setattr(roi.global_config.roi, "high_res_side", 768)
+
+        inputs = prepare_photo_inputs(photo(), mode="dual", margin=0.5)
+
+        assert inputs["image"].size == (307, 384)
+        assert inputs["face_image"].size == (200, 240)
+        assert input_tokens(inputs) == 2 * 258
+
+    def test_saliency_box_without_a_face(self):
+        self.faces = []
+
+        subject_box, face_box, source = detect_subject(photo())
+
+        assert face_box is None and source == "saliency"
+        x1, y1, x2, y2 = subject_box
+        assert 240 <= x1 <= 260 and 440 <= x2 <= 460
+        assert 190 <= y1 <= 260 and 640 <= y2 <= 710
+
+    def test_faces_are_detected_once_for_roi_and_pre_analysis(self, monkeypatch):
+        calls = []
+        monkeypatch.setattr(feature_extract, "detect_faces", lambda gray: calls.append(gray.shape) or [FACE])
+        monkeypatch.setattr(roi, "detect_faces", lambda gray: pytest.fail("ROI detected faces again"))
+        monkeypatch.setattr(pre_analysis, "detect_faces", lambda gray: pytest.fail("pre-analysis detected faces again"))
+
+        inputs, estimates = feature_extract._prepare_photo(photo(), "tight", estimate=True)
+
+        assert calls == [(1000, 800)]
+        x1, y1, x2, y2 = expand_box((300, 200, 400, 560), (800, 1000), roi.global_config.roi.margin)
+        assert inputs["image"].size == (x2 - x1, y2 - y1)
+        assert estimates["people_count"].value == 1
+
+    def test_full_mode_is_unchanged(self):
+        image = photo()
+        assert prepare_photo_inputs(image, mode="full")["image"] is image
+        with pytest.raises(ValueError):
+            prepare_photo_inputs(image, mode="zoom")
+
+    def test_boxes_and_tokens(self):
+        assert expand_box((10, 10, 110, 60), (120, 100), 0.2) == (0, 0, 120, 70)
+        assert estimate_image_tokens((384, 384)) == 258
+        assert estimate_image_tokens((1080, 1600)) == 2 * 3 * 258
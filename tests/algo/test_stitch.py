@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from tests.test_template import TestTemplate
+from src.algo.stitch import StitchedProfile
+
+WIDTH, BAND, HEADER, FOOTER = 120, 300, 40, 50
+
+
+def profile_content(height: int) -> np.ndarray:
+    """A tall, non-repeating synthetic profile: random row blocks, so every window registers uniquely."""
+    rng = np.random.default_rng(7)
+    blocks = rng.integers(0, 255, size=(height // 4 + 1, WIDTH // 8 + 1, 3), dtype=np.uint8)
+    return np.kron(blocks, np.ones((4, 8, 1), dtype=np.uint8))[:height, :WIDTH]
+
+
+def screen(content: np.ndarray, scroll: int) -> Image.Image:
+    """The screenshot at `scroll`: fixed header and footer around a window of the content."""
+    frame = np.zeros((HEADER + BAND + FOOTER, WIDTH, 3), dtype=np.uint8)
+    frame[:HEADER] = (20, 20, 200)
+    frame[HEADER + BAND :] = (200, 20, 20)
+    frame[HEADER : HEADER + BAND] = content[scroll : scroll + BAND]
+    return Image.fromarray(frame)
+
+
+class TestStitchedProfile(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup, tmp_path):
+        self.content = profile_content(1000)
+        self.stitched = StitchedProfile(
+            tile_dir=str(tmp_path / "tiles"), header_px=HEADER, footer_px=FOOTER, min_overlap_px=60
+        )
+        self.tmp_path = tmp_path
+
+    def test_scroll_shifts_are_registered(self):
+        shifts = [self.stitched.add_frame(screen(self.content, scroll)) for scroll in [0, 180, 180, 400, 620]]
+
+        assert shifts == [BAND, 180, 0, 220, 220]
+        assert self.stitched.frame_offsets == [0, 180, 180, 400, 620]
+        assert self.stitched.height == 620 + BAND
+
+    def test_stitched_image_matches_the_content(self):
+        for scroll in [0, 200, 420, 660]:
+            self.stitched.add_frame(screen(self.content, scroll))
+
+        stitched = np.asarray(Image.open(self.stitched.save(str(self.tmp_path / "full.png"))))
+        assert np.array_equal(stitched, self.content[: 660 + BAND])
+
+    def test_frame_bounds_crop_the_same_region(self):
+        for scroll in [0, 200]:
+            self.stitched.add_frame(screen(self.content, scroll))
+
+        # A subject 60-160 rows into the second frame's band is content rows 260-360
+        bounds = (10, HEADER + 60, 90, HEADER + 160)
+        assert self.stitched.to_stitched_bounds(bounds, frame_index=1) == (10, 260, 90, 360)
+        crop = np.asarray(self.stitched.crop_frame_bounds(bounds, frame_index=1))
+        assert np.array_equal(crop, self.content[260:360, 10:90])
+
+    def test_frames_of_another_size_are_rejected(self):
+        self.stitched.add_frame(screen(self.content, 0))
+        with pytest.raises(ValueError):
+            self.stitched.add_frame(screen(self.content, 100).resize((WIDTH, HEADER + BAND + FOOTER - 10)))
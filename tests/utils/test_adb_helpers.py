@@ -0,0 +1,13 @@
+from tests.test_template import TestTemplate
+from src.utils.adb_helpers import parse_screen_size
+
+
+class TestScreenSize(TestTemplate):
+    def test_physical_size(self):
+        assert parse_screen_size("Physical size: 1440x3120\n") == (1440, 3120)
+
+    def test_override_size_wins(self):
+        assert parse_screen_size("Physical size: 1440x3120\nOverride size: 1080x2340\n") == (1080, 2340)
+
+    def test_unreadable_output(self):
+        assert parse_screen_size("error: no devices/emulators found") is None
@@ -0,0 +1,57 @@
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from tests.test_template import TestTemplate
+from src.utils.image_pool import ImageWorkerPool
+from src.utils.photo_store import pixel_hash
+
+WIDTH, HEIGHT = 200, 300
+
+
+class TestImageWorkerPool(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup, tmp_path):
+        rng = np.random.default_rng(11)
+        self.frame = rng.integers(0, 255, size=(HEIGHT, WIDTH, 4), dtype=np.uint8)
+        with ImageWorkerPool(max_workers=2, store_root=str(tmp_path / "photos"), max_side=None) as pool:
+            self.pool = pool
+            yield
+
+    def test_crops_are_written_to_the_store(self):
+        bounds = [(0, 0, 100, 150), (100, 150, 200, 300), (20, 40, 180, 90)]
+        with self.pool.share(WIDTH, HEIGHT, self.frame.tobytes()) as frame:
+            futures = [self.pool.submit(frame, b) for b in bounds]
+        results = [future.result() for future in futures]
+
+        for result, (x1, y1, x2, y2) in zip(results, bounds):
+            expected = self.frame[y1:y2, x1:x2]
+            assert result.bounds == (x1, y1, x2, y2)
+            assert result.size == (x2 - x1, y2 - y1)
+            assert result.photo_hash == pixel_hash(Image.fromarray(expected))
+            assert np.array_equal(np.asarray(Image.open(result.path)), expected)
+
+    def test_shared_frame_is_released_after_its_jobs(self):
+        with self.pool.share(WIDTH, HEIGHT, self.frame.tobytes()) as frame:
+            name = frame.name
+            futures = [self.pool.submit(frame, (0, 0, 50, 50)) for _ in range(4)]
+        # The `with` block has exited, but the jobs still hold the segment
+        assert all(future.result().size == (50, 50) for future in futures)
+        self.pool.close()  # Waits for the jobs' done callbacks
+
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+    def test_same_crop_from_many_workers_is_stored_once(self):
+        with self.pool.share(WIDTH, HEIGHT, self.frame.tobytes()) as frame:
+            futures = [self.pool.submit(frame, (10, 10, 110, 110)) for _ in range(16)]
+        paths = {future.result().path for future in futures}
+
+        assert len(paths) == 1
+        path = paths.pop()
+        assert np.array_equal(np.asarray(Image.open(path)), self.frame[10:110, 10:110])
+        # Concurrent writers each used their own temporary file, and none is left behind
+        assert os.listdir(os.path.dirname(path)) == [os.path.basename(path)]
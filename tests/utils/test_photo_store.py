@@ -0,0 +1,87 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from tests.test_template import TestTemplate
+from src.mobile_api.api import ProfileInfo
+from src.utils.photo_store import PhotoStore, pixel_hash, profile_key
+
+
+def photo(seed: int) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 255, size=(40, 30, 3), dtype=np.uint8))
+
+
+class TestPhotoStore(TestTemplate):
+    @pytest.fixture(autouse=True)
+    def setup_shared_variables(self, setup, tmp_path):
+        self.root = str(tmp_path / "photos")
+        self.store = PhotoStore(root=self.root, shard_depth=2)
+
+    def test_same_pixels_are_stored_once(self, tmp_path):
+        image = photo(1)
+        # The same pixels, encoded differently, hash the same
+        reloaded_path = str(tmp_path / "reloaded.png")
+        image.save(reloaded_path, compress_level=9)
+        reloaded = Image.open(reloaded_path).convert("RGB")
+
+        first = self.store.add(image, "ana_29", bounds=(0, 0, 30, 40), scroll_offset=0)
+        mtime = os.stat(first).st_mtime_ns
+        second = self.store.add(reloaded, "ana_29", bounds=(0, 80, 30, 120), scroll_offset=80)
+
+        assert first == second
+        assert os.stat(first).st_mtime_ns == mtime
+        photo_hash = pixel_hash(image)
+        assert first.endswith(os.path.join(photo_hash[:2], photo_hash[2:4], f"{photo_hash}.png"))
+        assert np.array_equal(np.asarray(Image.open(first)), np.asarray(image))
+        assert self.store.hashes("ana_29") == [photo_hash]
+        assert [c["scroll_offset"] for c in self.store.metadata(photo_hash)["captures"]] == [0, 80]
+        # No temporary files left behind
+        assert sorted(os.listdir(os.path.dirname(first))) == [f"{photo_hash}.json", f"{photo_hash}.png"]
+
+    def test_repeated_capture_is_recorded_once(self):
+        image = photo(2)
+        for _ in range(3):
+            self.store.add(image, "ana_29", bounds=(0, 0, 30, 40), scroll_offset=0, dump_id="dump-1")
+
+        assert len(self.store.metadata(pixel_hash(image))["captures"]) == 1
+
+    def test_index_is_ordered_and_reloaded(self):
+        images = [photo(seed) for seed in [3, 4, 5]]
+        for image in images:
+            self.store.add(image, "ana_29")
+        # A photo shared with another profile is indexed under both
+        self.store.add(images[1], "bo_31")
+
+        reopened = PhotoStore(root=self.root, shard_depth=2)
+        assert reopened.profile_ids() == ["ana_29", "bo_31"]
+        assert reopened.hashes("ana_29") == [pixel_hash(image) for image in images]
+        assert reopened.paths("bo_31") == [reopened.object_path(pixel_hash(images[1]))]
+        with open(os.path.join(self.root, "index.json")) as f:
+            assert json.load(f) == reopened.index
+
+    def test_profile_info_is_kept_under_its_key(self):
+        profile_info = ProfileInfo()
+        profile_info.name = "Ana Maria"
+        profile_info.age = 29
+        profile_info.hometown = "Bogotá"
+        profile_id = profile_key(profile_info)
+
+        self.store.record_profile_info(profile_id, profile_info)
+
+        assert profile_id == "ana_maria-29-bogotá"
+        assert self.store.profile_info(profile_id)["name"] == "Ana Maria"
+        assert self.store.profile_info("unknown") is None
+
+    def test_people_sharing_name_and_age_get_their_own_key(self):
+        profile_info = ProfileInfo()
+        profile_info.name = "Ana"
+        profile_info.age = 29
+        first, other = (pixel_hash(Image.new("RGB", (8, 8), color)) for color in [(10, 20, 30), (30, 20, 10)])
+
+        assert profile_key(profile_info, first) != profile_key(profile_info, other)
+        # The same person seen again keeps the key, so their analysis is reused
+        assert profile_key(profile_info, first) == profile_key(profile_info, first) == f"ana-29-{first[:12]}"